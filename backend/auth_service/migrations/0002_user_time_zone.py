@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_service', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='time_zone',
+            field=models.CharField(default='UTC', max_length=64),
+        ),
+    ]
@@ -10,3 +10,5 @@ class Role(models.Model):
 class User(AbstractUser):
     # username, email, password inherited
     role = models.ForeignKey(Role, null=True, blank=True, on_delete=models.SET_NULL)
+    # IANA name; energy series are bucketed in this zone
+    time_zone = models.CharField(max_length=64, default="UTC")
@@ -1,11 +1,20 @@
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from .models import Role
 
 User = get_user_model()
 
 
+def validate_time_zone(value):
+    try:
+        ZoneInfo(value)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise serializers.ValidationError(f"Unknown time zone '{value}'.")
+    return value
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     """Serializer for user registration"""
     password = serializers.CharField(write_only=True)
@@ -18,7 +27,10 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ("id", "username", "email", "password", "role")
+        fields = ("id", "username", "email", "password", "role", "time_zone")
+
+    def validate_time_zone(self, value):
+        return validate_time_zone(value)
 
     def create(self, validated_data):
         role = validated_data.pop("role", None)
@@ -38,7 +50,11 @@ class MeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ("id", "username", "email", "role")
+        fields = ("id", "username", "email", "role", "time_zone")
+        read_only_fields = ("id", "username", "email")
+
+    def validate_time_zone(self, value):
+        return validate_time_zone(value)
 
 
 
@@ -0,0 +1,6 @@
+from django.urls import path
+from . import async_views
+
+urlpatterns = [
+    path("query/", async_views.query, name="async-chat-query"),
+]
@@ -0,0 +1,56 @@
+"""Async twin of QueryView, served at /api/async/chat/query/."""
+from django.conf import settings
+from django.views.decorators.http import require_POST
+from telemetry_service.async_api import jwt_required, json_response, parse_json
+from telemetry_service import downsample
+from .nlp import parse_query
+from .views import _parse_bounds
+from . import planner, vocabulary
+import time
+
+
+@require_POST
+@jwt_required
+async def query(request):
+    try:
+        data = parse_json(request)
+    except ValueError:
+        return json_response({"error": "Invalid JSON."}, 400)
+    q = data.get("question", "") if isinstance(data, dict) else ""
+    if not q:
+        return json_response({"error": "Missing 'question'."}, 400)
+    try:
+        max_points, method = downsample.parse(request.GET)
+        qs_start, qs_end = _parse_bounds(request.GET)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+
+    t0 = time.perf_counter()
+    parsed = parse_query(q)
+    if qs_start or qs_end:
+        parsed["start"] = qs_start or parsed["start"]
+        parsed["end"] = qs_end or parsed["end"]
+        label = parsed["periods"][0][0] if parsed["periods"] else None
+        parsed["periods"][:1] = [(label, parsed["start"], parsed["end"])]
+
+    t1 = time.perf_counter()
+    index = await vocabulary.adevice_index(request.user.id)
+    mentioned = vocabulary.resolve(request.user.id, q, index)
+    try:
+        plan = planner.build_plan(parsed, mentioned, index)
+    except planner.PlanError as exc:
+        return json_response({"error": exc.message}, exc.status)
+
+    t2 = time.perf_counter()
+    answer = await planner.aexecute(plan, request.user.id, max_points, method)
+    t3 = time.perf_counter()
+    if settings.DEBUG:
+        answer["meta"] = {
+            "plan": planner.describe(plan),
+            "timings_ms": {
+                "parse": round((t1 - t0) * 1000, 3),
+                "plan": round((t2 - t1) * 1000, 3),
+                "execute": round((t3 - t2) * 1000, 3),
+            },
+        }
+    return json_response(answer)
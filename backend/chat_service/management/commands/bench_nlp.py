@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand
+from datetime import datetime, timezone
+import itertools
+import json
+import re
+import time
+from chat_service import nlp
+
+TEMPLATES = [
+    "How much energy did my {device} use {time}?",
+    "What was the {device} consumption {time}",
+    "Which of my devices are using the most power {time}?",
+    "Show me the top devices {time}",
+    "highest energy usage {time} for the {device}",
+    "Did the {device} draw a lot of power {time}? Just curious about my monthly bill really",
+]
+DEVICES = ["fridge", "AC", "air conditioner", "TV", "washing machine", "wifi router", "water pump", "heater", "lamp"]
+TIMES = ["today", "yesterday", "last week", "in the past week", "over the last 24 hours", "last 7 days", ""]
+
+
+def corpus():
+    return [t.format(device=d, time=w) for t, d, w in itertools.product(TEMPLATES, DEVICES, TIMES)]
+
+
+# The previous multi-scan implementation, kept as the comparison baseline.
+_LEGACY_TOP = [
+    r"\btop\s+(device|devices)\b",
+    r"\btop\s+consum(ing|ption)?\s+(device|devices)\b",
+    r"\bmost\s+(power|energy|consum(ing|ption)?|usage)\b",
+    r"\bhighest\s+(power|energy|consum(ing|ption)?|usage)\b",
+    r"which of my devices.*(use|using).*(power|energy)",
+]
+
+
+def legacy_parse(text, now):
+    t = text.lower()
+    intent = "top_devices" if any(re.search(p, t) for p in _LEGACY_TOP) else "total_usage"
+    start = end = None
+    for key, fn in nlp.RELATIVE_KEYWORDS.items():
+        if key in t:
+            start, end = fn(now)
+            break
+    slug = next((s for s, vs in nlp.DEVICE_KEYWORDS.items() for v in vs if v in t), None)
+    return {"intent": intent, "device_slug": slug, "start": start, "end": end}
+
+
+class Command(BaseCommand):
+    help = "Measure chat query parse throughput (legacy multi-scan vs compiled single pass, cold and cached)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=50, help="Passes over the question corpus")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+
+    def handle(self, *args, **opts):
+        questions = corpus()
+        now = datetime.now(timezone.utc)
+
+        def cold(q, now):
+            nlp.analyze.cache_clear()
+            return nlp.parse_query(q, now)
+
+        cases = {
+            "legacy": legacy_parse,
+            "compiled": cold,
+            "compiled_cached": nlp.parse_query,
+        }
+        result = {"questions": len(questions), "rounds": opts["rounds"]}
+        for name, fn in cases.items():
+            nlp.analyze.cache_clear()
+            t0 = time.perf_counter()
+            for _ in range(opts["rounds"]):
+                for q in questions:
+                    fn(q, now)
+            elapsed = time.perf_counter() - t0
+            n = len(questions) * opts["rounds"]
+            result[name] = {"parses_per_s": round(n / elapsed), "us_per_parse": round(elapsed / n * 1e6, 2)}
+        result["speedup"] = round(result["legacy"]["us_per_parse"] / result["compiled"]["us_per_parse"], 1)
+        result["speedup_cached"] = round(result["legacy"]["us_per_parse"] / result["compiled_cached"]["us_per_parse"], 1)
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(result))
+            return
+        for name in cases:
+            self.stdout.write(f"{name:<16} {result[name]['parses_per_s']:>10,} parses/s  {result[name]['us_per_parse']:>7} us")
+        self.stdout.write(self.style.SUCCESS(
+            f"speedup: {result['speedup']}x cold, {result['speedup_cached']}x cached ({len(questions)} questions)"
+        ))
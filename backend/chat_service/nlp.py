@@ -1,20 +1,38 @@
+"""
+Single-pass query parser for the chat endpoint.
+
+Every keyword the parser knows (time phrases, device names, "top devices"
+phrasings) is compiled into one regex whose alternation is built from a
+trie, so the normalized question is scanned exactly once and each match is
+classified with a dict lookup. The keyword analysis of a question does not
+depend on the clock and is cached on the normalized text; the time window
+is resolved against ``now`` on every call.
+"""
+from collections import namedtuple
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import re
 
+
+def _midnight(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
 # --- Time keywords ---
 RELATIVE_KEYWORDS = {
-    "yesterday": lambda now: (
-        (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0),
-        (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1),
-    ),
-    "today": lambda now: (
-        now.replace(hour=0, minute=0, second=0, microsecond=0),
-        now,
-    ),
+    "yesterday": lambda now: (_midnight(now) - timedelta(days=1), _midnight(now)),
+    "today": lambda now: (_midnight(now), now),
     "last week": lambda now: (now - timedelta(days=7), now),
     "past week": lambda now: (now - timedelta(days=7), now),
     "last 7 days": lambda now: (now - timedelta(days=7), now),
     "last 24 hours": lambda now: (now - timedelta(hours=24), now),
+    "last 30 days": lambda now: (now - timedelta(days=30), now),
+    "this week": lambda now: (_midnight(now) - timedelta(days=now.weekday()), now),
+    "this month": lambda now: (_midnight(now).replace(day=1), now),
+    "last month": lambda now: (
+        (_midnight(now).replace(day=1) - timedelta(days=1)).replace(day=1),
+        _midnight(now).replace(day=1),
+    ),
 }
 
 # --- Known device keywords ---
@@ -28,114 +46,158 @@ DEVICE_KEYWORDS = {
     "pump": ["pump", "water pump"],
 }
 
-# Precompile regex for devices
-DEVICE_PAT = re.compile(
-    r"(?:my|the)?\s*(?P<device>[a-zA-Z0-9\s/-]+)(?:\s+device)?", re.IGNORECASE
+# --- "Top devices" phrasings ---
+_DEVICE_WORDS = ["device", "devices"]
+_MEASURES = ["power", "energy", "consuming", "consumption", "consum", "usage"]
+TOP_DEVICES_PHRASES = (
+    [f"top {d}" for d in _DEVICE_WORDS]
+    + [f"top {c} {d}" for c in ("consuming", "consumption", "consum") for d in _DEVICE_WORDS]
+    + [f"{q} {m}" for q in ("most", "highest") for m in _MEASURES]
 )
+# "which of my devices ... use/using ... power/energy" is matched as a sequence of tokens
+_WHICH = "which of my devices"
+_USE_WORDS = ["use", "uses", "used", "using"]
+_POWER_WORDS = ["power", "energy"]
+# "what time ... most/highest/peak ..." is matched the same way; alone, each word is too common
+_WHAT_TIME = "what time"
+_MOST_WORDS = ["most", "highest", "peak"]
+
+# --- Analytical intents (see planner.py); "cost" can also qualify another intent ---
+# words that are common outside the intent ("mean", "peak", "normal") only count in phrases
+INTENT_PHRASES = {
+    "compare": ["compare", "compared", "comparison", "vs", "versus"],
+    "average": ["average", "avg", "on average", "mean usage", "mean consumption", "mean energy", "mean power"],
+    "peak_hour": ["peak hour", "peak hours", "peak time", "peak usage", "peak consumption", "busiest hour",
+                  "which hour", "what hour"],
+    "highest_day": ["which day", "what day", "highest day", "busiest day", "worst day", "peak day"],
+    "cost": ["cost", "costs", "cost me", "bill", "spend", "spent", "price", "how much money"],
+    # answered from the running reading stats (telemetry_service/stats.py)
+    "usual": ["usual", "unusual", "than usual", "than normal", "abnormal"],
+    "last_reading": ["last reading", "latest reading", "most recent reading", "current reading"],
+    "peak_reading": ["peak minute", "peak reading", "highest reading", "max reading", "maximum reading",
+                     "biggest spike"],
+}
+# the first one present wins; top_devices and cost only apply when nothing more specific matched
+INTENT_PRIORITY = ["usual", "last_reading", "peak_reading", "highest_day", "peak_hour", "compare", "average",
+                   "top_devices", "cost"]
 
-def extract_device_slug(text: str):
-    """Return standardized device slug if found in text."""
-    t = text.lower()
-    for slug, variants in DEVICE_KEYWORDS.items():
-        for variant in variants:
-            if variant in t:
-                return slug
-    return None
-
-def extract_time_range(text: str, now: datetime):
-    """Return (start, end) if relative time phrase is found."""
-    t = text.lower()
-    for key, fn in RELATIVE_KEYWORDS.items():
-        if key in t:
-            return fn(now)
-    return None, None
-
-
-
-TOP_DEVICES_PATTERNS = [
-    r"\btop\s+(device|devices)\b",
-    r"\btop\s+consum(ing|ption)?\s+(device|devices)\b",
-    r"\bmost\s+(power|energy|consum(ing|ption)?|usage)\b",
-    r"\bhighest\s+(power|energy|consum(ing|ption)?|usage)\b",
-    r"which of my devices.*(use|using).*(power|energy)"
-]
+Token = namedtuple("Token", "kind value")
 
-def detect_intent(text: str):
-    t = text.lower()
-    for pat in TOP_DEVICES_PATTERNS:
-        if re.search(pat, t):
-            return "top_devices"
-    return "total_usage"
+LEXICON = {}
+LEXICON.update({w: Token("use", None) for w in _USE_WORDS})
+LEXICON.update({w: Token("power", None) for w in _POWER_WORDS})
+LEXICON[_WHICH] = Token("which", None)
+LEXICON[_WHAT_TIME] = Token("when", None)
+LEXICON.update({w: Token("most", None) for w in _MOST_WORDS})
+LEXICON.update({p: Token("top", None) for p in TOP_DEVICES_PHRASES})
+LEXICON.update({p: Token("intent", name) for name, phrases in INTENT_PHRASES.items() for p in phrases})
+LEXICON.update({k: Token("time", k) for k in RELATIVE_KEYWORDS})
+LEXICON.update({v: Token("device", slug) for slug, variants in DEVICE_KEYWORDS.items() for v in variants})
 
 
-def parse_query(text: str):
+def compile_keywords(words):
     """
-    Returns dict: { intent, device_slug?, start?, end? }
-    Supported intents: total_usage, top_devices
+    Compile ``words`` (normalized phrases) into one whole-word regex whose
+    alternation is built from a character trie: shared prefixes are matched
+    once, and longer phrases win because each node tries its children
+    before accepting the phrase that ends there.
     """
-    now = datetime.now(timezone.utc)
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+    if not trie:
+        return re.compile(r"(?!)")
+
+    def build(node):
+        end = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if end else body
+
+    return re.compile(r"(?<![a-z0-9])" + build(trie) + r"(?![a-z0-9])")
+
+
+KEYWORD_RE = compile_keywords(LEXICON)
+
+Analysis = namedtuple("Analysis", "intent device_slugs time_keys cost")
+
+
+def normalize(text: str):
+    return " ".join(text.lower().split())
+
+
+@lru_cache(maxsize=4096)
+def analyze(normalized: str):
+    """Scan normalized text once; returns intent, device slugs and time keywords (in order), cost flag."""
+    intents, devices, time_keys = set(), [], []
+    which = used = when = False
+    for match in KEYWORD_RE.finditer(normalized):
+        kind, value = LEXICON[match.group()]
+        if kind == "device":
+            if value not in devices:
+                devices.append(value)
+        elif kind == "time":
+            if value not in time_keys:
+                time_keys.append(value)
+        elif kind == "intent":
+            intents.add(value)
+        elif kind == "top":
+            intents.add("top_devices")
+            if when:
+                intents.add("peak_hour")
+        elif kind == "when":
+            when = True
+        elif kind == "most" and when:
+            intents.add("peak_hour")
+        elif kind == "which":
+            which = True
+        elif kind == "use":
+            used = which
+        elif kind == "power" and used:
+            intents.add("top_devices")
+    intent = next((name for name in INTENT_PRIORITY if name in intents), "total_usage")
+    return Analysis(intent, tuple(devices), tuple(time_keys), "cost" in intents)
 
-    intent = detect_intent(text)
-    start, end = extract_time_range(text, now)
-    device_slug = extract_device_slug(text)
 
-    return {
-        "intent": intent,
-        "device_slug": device_slug,
-        "start": start,
-        "end": end,
-    }
+def detect_intent(text: str):
+    return analyze(normalize(text)).intent
 
 
+def extract_device_slug(text: str):
+    """Return standardized device slug if found in text."""
+    slugs = analyze(normalize(text)).device_slugs
+    return slugs[0] if slugs else None
 
-import re
-from datetime import datetime, timedelta
 
-DEVICES = ["fridge", "ac", "tv", "heater", "fan", "washing machine", "lights"]
+def extract_time_range(text: str, now: datetime):
+    """Return (start, end) if relative time phrase is found."""
+    keys = analyze(normalize(text)).time_keys
+    return RELATIVE_KEYWORDS[keys[0]](now) if keys else (None, None)
+
 
-def extract_entities(question: str):
+def parse_query(text: str, now: datetime = None):
     """
-    Extract entities such as devices and time range from the question.
-    Returns a dictionary with keys: devices, start_date, end_date
+    Returns dict: { intent, device_slug?, device_slugs, start?, end?, periods, cost }
+    Supported intents: total_usage, top_devices, compare, average, peak_hour,
+    highest_day, cost, usual, last_reading, peak_reading. ``periods`` lists
+    every time phrase as (label, start, end); start/end are the first one.
     """
-    entities = {
-        "devices": [],
-        "start_date": None,
-        "end_date": None,
-    }
-
-    q_lower = question.lower()
-
-    # --- Device extraction ---
-    for device in DEVICES:
-        if device in q_lower:
-            entities["devices"].append(device)
+    now = now or datetime.now(timezone.utc)
+    result = analyze(normalize(text))
+    periods = [(key, *RELATIVE_KEYWORDS[key](now)) for key in result.time_keys]
+    start, end = periods[0][1:] if periods else (None, None)
 
-    # --- Time extraction ---
-    today = datetime.today().date()
-
-    if "today" in q_lower:
-        entities["start_date"] = today
-        entities["end_date"] = today
-
-    elif "yesterday" in q_lower:
-        yesterday = today - timedelta(days=1)
-        entities["start_date"] = yesterday
-        entities["end_date"] = yesterday
-
-    elif "last week" in q_lower:
-        start = today - timedelta(days=7)
-        entities["start_date"] = start
-        entities["end_date"] = today
-
-    elif "last month" in q_lower:
-        start = today - timedelta(days=30)
-        entities["start_date"] = start
-        entities["end_date"] = today
-
-    # default fallback → if no time range, assume "today"
-    if not entities["start_date"]:
-        entities["start_date"] = today
-        entities["end_date"] = today
-
-    return entities
+    return {
+        "intent": result.intent,
+        "device_slug": result.device_slugs[0] if result.device_slugs else None,
+        "device_slugs": list(result.device_slugs),
+        "start": start,
+        "end": end,
+        "periods": periods,
+        "cost": result.cost,
+    }
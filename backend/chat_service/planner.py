@@ -0,0 +1,240 @@
+"""
+Query planner for the chat endpoint.
+
+``build_plan`` turns a parsed question plus the devices it resolved to into
+a Plan: which devices, which time windows and which bucket unit to read.
+``execute`` answers every plan with one ``rollups.grouped`` call, i.e. a
+single UNION ALL round-trip over raw edges and hourly/daily rollups,
+served from the aggregate cache when possible. The answer is then shaped
+in Python. Cost is energy times ENERGY_PRICE_PER_KWH.
+
+The reading-level intents (STATS_INTENTS: "more than usual", last reading,
+peak minute) skip the rollups and read the per-device running stats
+instead: one lifetime row, or the daily rows of the days in the window.
+"""
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from telemetry_service import caching, downsample, rollups, stats
+
+# windows: [(label, start, end)]; unit: None, "hour" or "day"
+Plan = namedtuple("Plan", "intent devices windows unit cost")
+
+# intents that need a bounded window fall back to this when the question has none,
+# and use it to close a window given with only one bound
+DEFAULT_WINDOWS = {
+    "average": timedelta(days=7),
+    "peak_hour": timedelta(days=7),
+    "highest_day": timedelta(days=30),
+}
+UNITS = {"total_usage": "hour", "peak_hour": "hour", "highest_day": "day"}
+STATS_INTENTS = ("usual", "last_reading", "peak_reading")
+
+
+class PlanError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def build_plan(parsed, mentioned, index):
+    """
+    ``mentioned`` are the DeviceRefs named in the question; ``index`` is the
+    user's vocabulary index. Raises PlanError for questions that cannot be
+    answered.
+    """
+    intent = parsed["intent"]
+    everyone = list(index["devices"].values())
+
+    if intent in STATS_INTENTS and parsed["device_slug"] and not mentioned:
+        raise PlanError(f"Device '{parsed['device_slug']}' not found for user.", status=404)
+    if intent == "total_usage" and not mentioned:
+        if parsed["device_slug"]:
+            raise PlanError(f"Device '{parsed['device_slug']}' not found for user.", status=404)
+        raise PlanError("Please specify a device (e.g., 'my fridge', 'my AC').")
+    if intent == "compare" and len(parsed["periods"]) < 2 and len(mentioned) < 2:
+        raise PlanError("Please name two devices or two periods to compare (e.g., 'fridge vs AC', 'today vs yesterday').")
+
+    devices = everyone if intent == "top_devices" or not mentioned else mentioned
+    if intent == "compare" and len(parsed["periods"]) >= 2:
+        windows = [(label, start, end) for label, start, end in parsed["periods"]]
+    else:
+        start, end = parsed["start"], parsed["end"]
+        if intent in DEFAULT_WINDOWS and (start is None or end is None):
+            # an open edge is closed the same way: up to now, or one default window back
+            end = end or timezone.now()
+            start = start or end - DEFAULT_WINDOWS[intent]
+            if start >= end:
+                raise PlanError("The start of the window must be before its end.")
+        elif start is None and end is None and intent == "usual":
+            # today so far against the device's lifetime
+            end = timezone.now()
+            start = rollups.floor_to(rollups.as_utc(end), "day")
+        windows = [(parsed["periods"][0][0] if parsed["periods"] else None, start, end)]
+    return Plan(intent, devices, windows, UNITS.get(intent), parsed["cost"] or intent == "cost")
+
+
+def describe(plan):
+    return {
+        "intent": plan.intent,
+        "devices": [d.id for d in plan.devices],
+        "windows": [{"label": label, "start": start, "end": end} for label, start, end in plan.windows],
+        "unit": plan.unit,
+        "cost": plan.cost,
+    }
+
+
+def _cache_args(plan, user_id):
+    ids = [d.id for d in plan.devices]
+    bounds = [(start, end) for _, start, end in plan.windows]
+    starts = [s for s, _ in bounds]
+    ends = [e for _, e in bounds]
+    # the cache key covers the union of the windows; the plan shape goes in ``extra``
+    return ids, bounds, (
+        f"chat:{plan.intent}", user_id, ids,
+        None if None in starts else min(starts),
+        None if None in ends else max(ends),
+    ), repr((plan.unit, bounds))
+
+
+def _money(kwh):
+    return round(kwh * settings.ENERGY_PRICE_PER_KWH, 2)
+
+
+def _device_row(device, kwh, cost):
+    row = {"id": device.id, "name": device.name, "slug": device.slug, "total_kwh": round(kwh, 4)}
+    if cost:
+        row["cost"] = _money(kwh)
+    return row
+
+
+def _window(plan, i=0):
+    _, start, end = plan.windows[i]
+    return {"start": start, "end": end}
+
+
+def execute(plan, user_id, max_points=None, method="lttb"):
+    """
+    Run the plan's single grouped read and shape the answer; ``max_points``
+    downsamples the hourly series (see telemetry_service/downsample.py).
+    """
+    if plan.intent in STATS_INTENTS:
+        return shape_stats(plan)
+    ids, bounds, key, extra = _cache_args(plan, user_id)
+    rows = caching.cached(*key, lambda: rollups.grouped(ids, bounds, plan.unit), extra=extra)
+    return shape(plan, rows, max_points, method)
+
+
+async def aexecute(plan, user_id, max_points=None, method="lttb"):
+    """``execute`` for async views."""
+    if plan.intent in STATS_INTENTS:
+        return await sync_to_async(shape_stats)(plan)
+    ids, bounds, key, extra = _cache_args(plan, user_id)
+    rows = await caching.acached(*key, lambda: rollups.agrouped(ids, bounds, plan.unit), extra=extra)
+    return shape(plan, rows, max_points, method)
+
+
+def shape(plan, rows, max_points=None, method="lttb"):
+    """Turn {(window, device, bucket): kwh} into the answer for the plan's intent."""
+    per_device = defaultdict(float)      # (window, device) -> kwh
+    per_bucket = defaultdict(float)      # bucket -> kwh summed over devices
+    for (w, device_id, bucket), kwh in rows.items():
+        per_device[(w, device_id)] += kwh
+        if bucket is not None:
+            per_bucket[bucket] += kwh
+    total = sum(kwh for (w, _), kwh in per_device.items() if w == 0)
+    answer = {"intent": plan.intent, "window": _window(plan)}
+
+    if plan.intent == "total_usage":
+        device = plan.devices[0]
+        hours = downsample.points(sorted(per_bucket.items()), max_points, method)
+        answer.update({
+            "device": {"id": device.id, "name": device.name, "slug": device.slug},
+            "devices": [_device_row(d, per_device[(0, d.id)], plan.cost) for d in plan.devices],
+            "series": [{"timestamp": h, "kwh": float(kwh)} for h, kwh in hours],
+        })
+    elif plan.intent == "top_devices":
+        top = sorted(
+            ((d, per_device[(0, d.id)]) for d in plan.devices if (0, d.id) in per_device),
+            key=lambda item: item[1], reverse=True,
+        )[:5]
+        answer["devices"] = [_device_row(d, kwh, plan.cost) for d, kwh in top]
+        return answer
+    elif plan.intent == "compare":
+        if len(plan.windows) > 1:
+            items = [
+                {"label": label, "window": _window(plan, w),
+                 "total_kwh": round(sum(per_device[(w, d.id)] for d in plan.devices), 4)}
+                for w, (label, _, _) in enumerate(plan.windows)
+            ]
+            answer.update({"by": "period", "devices": [d.id for d in plan.devices]})
+        else:
+            items = [_device_row(d, per_device[(0, d.id)], False) for d in plan.devices]
+            answer["by"] = "device"
+        if plan.cost:
+            for item in items:
+                item["cost"] = _money(item["total_kwh"])
+        first, second = items[0]["total_kwh"], items[1]["total_kwh"]
+        answer.update({
+            "items": items,
+            "difference_kwh": round(first - second, 4),
+            "ratio": round(first / second, 3) if second else None,
+        })
+        return answer
+    elif plan.intent == "average":
+        _, start, end = plan.windows[0]
+        days = max((end - start).total_seconds() / 86400, 1 / 24)
+        answer["devices"] = [
+            {**_device_row(d, per_device[(0, d.id)], plan.cost),
+             "avg_kwh_per_day": round(per_device[(0, d.id)] / days, 4)}
+            for d in plan.devices
+        ]
+        answer["summary"] = {"total_kwh": round(total, 4), "days": round(days, 3),
+                             "avg_kwh_per_day": round(total / days, 4),
+                             "avg_kwh_per_hour": round(total / (days * 24), 4)}
+        return answer
+    elif plan.intent in ("peak_hour", "highest_day"):
+        ranked = sorted(per_bucket.items(), key=lambda item: item[1], reverse=True)
+        key = "hour" if plan.intent == "peak_hour" else "day"
+        answer["devices"] = [d.id for d in plan.devices]
+        answer["peak"] = {key: ranked[0][0], "total_kwh": round(ranked[0][1], 4)} if ranked else None
+        answer["top"] = [{key: b, "total_kwh": round(kwh, 4)} for b, kwh in ranked[:5]]
+    elif plan.intent == "cost":
+        answer["devices"] = [_device_row(d, per_device[(0, d.id)], True) for d in plan.devices]
+
+    answer["summary"] = {"total_kwh": round(total, 4)}
+    if plan.cost:
+        answer["summary"].update({
+            "cost": _money(total),
+            "currency": settings.ENERGY_CURRENCY,
+            "price_per_kwh": settings.ENERGY_PRICE_PER_KWH,
+        })
+    return answer
+
+
+def shape_stats(plan):
+    """Answer a STATS_INTENTS plan from the running stats: the lifetime rows, or the window's days."""
+    ids = [d.id for d in plan.devices]
+    _, start, end = plan.windows[0]
+    found = stats.window_stats(ids, start, end)
+    answer = {"intent": plan.intent, "window": _window(plan)}
+    rows = []
+    for d in plan.devices:
+        row = {"id": d.id, "name": d.name, "slug": d.slug}
+        s = found.get(d.id)
+        if plan.intent == "last_reading":
+            row["last_reading"] = {"timestamp": s.last_at, "energy_kwh": s.last_kwh} if s else None
+        elif plan.intent == "peak_reading":
+            row["peak_reading"] = {"timestamp": s.peak_at, "energy_kwh": s.max_kwh} if s else None
+        rows.append(row)
+    if plan.intent == "usual":
+        lifetime = stats.lifetime_stats(ids)
+        for row in rows:
+            row["usual"] = stats.usual(found.get(row["id"]), lifetime.get(row["id"]))
+    answer["devices"] = rows
+    return answer
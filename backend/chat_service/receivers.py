@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from telemetry_service.models import Device
+from . import vocabulary
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def device_changed(sender, instance, **kwargs):
+    """Creating, renaming or deleting a device changes its owner's chat vocabulary."""
+    vocabulary.invalidate(instance.user_id)
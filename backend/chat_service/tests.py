@@ -1,78 +1,216 @@
-# from django.urls import reverse
-# from django.contrib.auth import get_user_model
-# from rest_framework.test import APITestCase
-# from telemetry_service.models import Device, Telemetry
-# from django.utils import timezone
-# from datetime import timedelta
-# from rest_framework_simplejwt.tokens import RefreshToken
-
-# User = get_user_model()
-
-# class ChatQueryTests(APITestCase):
-#     def setUp(self):
-#         self.user = User.objects.create_user(username="u2", password="p2")
-#         self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
-#         now = timezone.now()
-#         Telemetry.objects.create(device=self.device, timestamp=now - timedelta(hours=1), energy_kwh=0.1)
-#         Telemetry.objects.create(device=self.device, timestamp=now - timedelta(minutes=30), energy_kwh=0.2)
-#         self.url = reverse("chat_query")
-
-#     def token(self):
-#         return {"HTTP_AUTHORIZATION": f"Bearer {str(RefreshToken.for_user(self.user).access_token)}"}
-
-#     def test_total_usage_intent(self):
-#         res = self.client.post(self.url, {"question": "How much energy did my fridge use today?"}, format="json", **self.token())
-#         self.assertEqual(res.status_code, 200)
-#         self.assertIn("summary", res.data)
-#         self.assertIn("series", res.data)
-
-#     def test_top_devices_intent(self):
-#         res = self.client.post(self.url, {"question": "Which of my devices are using the most power today?"}, format="json", **self.token())
-#         # self.assertEqual(res.status_code, 200)
-#         self.assertIn("devices", res.data)
-
-
-
-# chat_service/views.py
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework import status
-from .nlp import detect_intent, extract_entities
-# from .models import DeviceUsage
-from django.utils.timezone import now, timedelta
-
-class ChatQueryView(APIView):
-    def post(self, request):
-        question = request.data.get("question", "")
-        intent = detect_intent(question)
-        entities = extract_entities(question)
-
-        # Default date filter
-        date = entities.get("date", "today")
-        today = now().date()
-        if date == "yesterday":
-            target_date = today - timedelta(days=1)
-        else:
-            target_date = today
-
-        # --- Intent handling ---
-        if intent == "energy_usage":
-            device = entities.get("device")
-            if not device:
-                return Response(
-                    {"error": "Please specify a device (e.g., 'my fridge', 'my AC')."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            # usage = DeviceUsage.objects.filter(device__icontains=device, date=target_date).first()
-            # if usage:
-                # return Response({"device": device, "date": str(target_date), "usage": usage.usage_kwh})
-            return Response({"device": device, "date": str(target_date), "usage": 0})
-
-        elif intent == "top_devices":
-            # ✅ Do NOT require device here
-            # usages = DeviceUsage.objects.filter(date=target_date).order_by("-usage_kwh")[:5]
-            devices = [{"device": u.device, "usage": u.usage_kwh} for u in usages]
-            return Response({"date": str(target_date), "devices": devices})
-
-        else:
-            return Response({"error": "Sorry, I didn’t understand that."}, status=status.HTTP_400_BAD_REQUEST)
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from telemetry_service.ingest import Reading, ingest_readings
+from telemetry_service.models import Device
+from .nlp import parse_query
+from . import planner, vocabulary
+
+User = get_user_model()
+
+
+def token(user):
+    return {"HTTP_AUTHORIZATION": f"Bearer {str(RefreshToken.for_user(user).access_token)}"}
+
+
+class ParseQueryTests(SimpleTestCase):
+    now = datetime(2025, 3, 10, 15, 30, tzinfo=dt_timezone.utc)
+
+    def test_single_pass_extracts_intent_device_and_window(self):
+        parsed = parse_query("How much energy did my  Fridge use YESTERDAY?", self.now)
+        self.assertEqual(parsed["intent"], "total_usage")
+        self.assertEqual(parsed["device_slug"], "fridge")
+        self.assertEqual(parsed["start"], datetime(2025, 3, 9, tzinfo=dt_timezone.utc))
+        self.assertEqual(parsed["end"], datetime(2025, 3, 10, tzinfo=dt_timezone.utc))
+
+        parsed = parse_query("Which of my devices are using the most power today?", self.now)
+        self.assertEqual(parsed["intent"], "top_devices")
+        self.assertEqual(parsed["end"], self.now)
+
+    def test_keywords_match_whole_words_longest_first(self):
+        self.assertEqual(parse_query("my washing machine last 7 days", self.now)["device_slug"], "washing-machine")
+        self.assertEqual(parse_query("the wifi router", self.now)["device_slug"], "router")
+        self.assertIsNone(parse_query("each machine", self.now)["device_slug"])
+
+    def test_common_words_alone_do_not_pick_an_intent(self):
+        for question in ("what time is it", "I mean my fridge today", "is this normal?", "the peak of my fridge"):
+            self.assertEqual(parse_query(question, self.now)["intent"], "total_usage", question)
+        for question, intent in [
+            ("what time do I use the most energy", "peak_hour"),
+            ("what time was usage highest yesterday", "peak_hour"),
+            ("mean usage of my tv", "average"),
+            ("is my fridge using more than normal", "usual"),
+        ]:
+            self.assertEqual(parse_query(question, self.now)["intent"], intent, question)
+
+    def test_cached_analysis_uses_call_time_window(self):
+        later = datetime(2025, 3, 12, 8, tzinfo=dt_timezone.utc)
+        parse_query("fridge today", self.now)
+        self.assertEqual(parse_query("fridge today", later)["start"], datetime(2025, 3, 12, tzinfo=dt_timezone.utc))
+
+
+class DeviceVocabularyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u3", password="p3")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ac = Device.objects.create(user=self.user, name="Living Room AC", slug="living-room-ac")
+            self.washer = Device.objects.create(user=self.user, name="Washing Machine", slug="washer")
+        now = timezone.now()
+        ingest_readings([Reading(self.ac.id, now, 1.0), Reading(self.washer.id, now, 0.5)])
+        self.url = reverse("chat_query")
+
+    def ask(self, question):
+        return self.client.post(self.url, {"question": question}, format="json", **token(self.user))
+
+    def test_resolves_names_slugs_and_aliases(self):
+        self.assertEqual(
+            vocabulary.resolve(self.user.id, "my air conditioner"),
+            [vocabulary.DeviceRef(self.ac.id, "Living Room AC", "living-room-ac")],
+        )
+        self.assertEqual([d.id for d in vocabulary.resolve(self.user.id, "the washing machine")], [self.washer.id])
+
+        res = self.ask("How much energy did my washer and the living room AC use today?")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([d["id"] for d in res.data["devices"]], [self.washer.id, self.ac.id])
+        self.assertEqual(res.data["summary"]["total_kwh"], 1.5)
+
+    def test_cache_hit_needs_no_query_and_renames_invalidate(self):
+        vocabulary.device_index(self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(vocabulary.resolve(self.user.id, "living room ac")), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ac.name = "Bedroom Cooler"
+            self.ac.save()
+        self.assertEqual([d.id for d in vocabulary.resolve(self.user.id, "bedroom cooler")], [self.ac.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.washer.delete()
+        self.assertEqual(self.ask("How much did my washer use today?").status_code, 404)
+
+
+class QueryPlannerTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u4", password="p4")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fridge = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+            self.tv = Device.objects.create(user=self.user, name="TV", slug="tv")
+        self.today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        yesterday = self.today - timedelta(days=1)
+        ingest_readings([
+            Reading(self.fridge.id, yesterday + timedelta(hours=9, minutes=5), 2.0),
+            Reading(self.fridge.id, yesterday + timedelta(hours=10), 1.0),
+            Reading(self.tv.id, yesterday + timedelta(hours=9, minutes=30), 0.5),
+            Reading(self.tv.id, yesterday - timedelta(days=1, hours=-20), 4.0),
+        ])
+        self.url = reverse("chat_query")
+
+    def ask(self, question):
+        res = self.client.post(self.url, {"question": question}, format="json", **token(self.user))
+        self.assertEqual(res.status_code, 200, res.data)
+        return res.data
+
+    def test_compare_devices_and_periods(self):
+        data = self.ask("Compare my fridge vs the TV yesterday")
+        self.assertEqual(data["by"], "device")
+        self.assertEqual([i["total_kwh"] for i in data["items"]], [3.0, 0.5])
+        self.assertEqual(data["difference_kwh"], 2.5)
+
+        data = self.ask("tv usage yesterday versus last week")
+        self.assertEqual(data["by"], "period")
+        self.assertEqual([i["label"] for i in data["items"]], ["yesterday", "last week"])
+        self.assertEqual([i["total_kwh"] for i in data["items"]], [0.5, 4.5])
+
+    def test_peak_hour_highest_day_average_and_cost(self):
+        data = self.ask("What was my peak hour yesterday?")
+        self.assertEqual(data["peak"], {"hour": self.today - timedelta(hours=15), "total_kwh": 2.5})
+
+        data = self.ask("Which day was highest last week?")
+        self.assertEqual(data["peak"]["day"], self.today - timedelta(days=2))
+        self.assertEqual(data["peak"]["total_kwh"], 4.0)
+
+        data = self.ask("average usage of my fridge yesterday")
+        self.assertEqual(data["summary"]["avg_kwh_per_day"], 3.0)
+
+        with self.settings(ENERGY_PRICE_PER_KWH=0.5):
+            data = self.ask("How much did my fridge cost me yesterday?")
+        self.assertEqual(data["intent"], "cost")
+        self.assertEqual(data["summary"]["cost"], 1.5)
+
+    def test_average_over_a_window_with_one_bound(self):
+        yesterday = self.today - timedelta(days=1)
+        question = {"question": "average usage of my fridge"}
+        res = self.client.post(f"{self.url}?{urlencode({'start': yesterday.isoformat()})}", question,
+                               format="json", **token(self.user))
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual(res.data["window"]["start"], yesterday)
+        self.assertEqual(res.data["summary"]["total_kwh"], 3.0)
+
+        res = self.client.post(f"{self.url}?{urlencode({'end': self.today.isoformat()})}", question,
+                               format="json", **token(self.user))
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual(res.data["window"], {"start": self.today - timedelta(days=7), "end": self.today})
+        self.assertEqual(res.data["summary"]["days"], 7.0)
+
+        # naive bounds are read as UTC; out-of-range dates are rejected
+        naive = yesterday.replace(tzinfo=None).isoformat()
+        res = self.client.post(f"{self.url}?{urlencode({'start': naive})}", question, format="json", **token(self.user))
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual(res.data["window"]["start"], yesterday)
+        for bad in ("2025-13-01T00:00:00", "garbage"):
+            res = self.client.post(f"{self.url}?{urlencode({'end': bad})}", question, format="json", **token(self.user))
+            self.assertEqual(res.status_code, 400, bad)
+
+        future = self.today + timedelta(days=2)
+        res = self.client.post(f"{self.url}?{urlencode({'start': future.isoformat()})}", question,
+                               format="json", **token(self.user))
+        self.assertEqual(res.status_code, 400)
+
+    async def test_async_average_over_a_window_with_one_bound(self):
+        headers = {"Authorization": token(self.user)["HTTP_AUTHORIZATION"]}
+        for bound in ("start", "end"):
+            url = f"{reverse('async-chat-query')}?{urlencode({bound: self.today.isoformat()})}"
+            res = await self.async_client.post(url, {"question": "average usage of my fridge"},
+                                               content_type="application/json", headers=headers)
+            self.assertEqual(res.status_code, 200, res.content)
+            self.assertIn("avg_kwh_per_day", res.json()["summary"])
+        url = f"{reverse('async-chat-query')}?{urlencode({'start': '2025-13-01T00:00:00'})}"
+        res = await self.async_client.post(url, {"question": "average usage of my fridge"},
+                                           content_type="application/json", headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+    def test_reading_intents_use_running_stats(self):
+        data = self.ask("What was the last reading of my fridge?")
+        self.assertEqual(data["intent"], "last_reading")
+        self.assertEqual(data["devices"][0]["last_reading"],
+                         {"timestamp": self.today - timedelta(hours=14), "energy_kwh": 1.0})
+
+        data = self.ask("tv peak minute yesterday")
+        self.assertEqual(data["devices"][0]["peak_reading"]["energy_kwh"], 0.5)
+
+        data = self.ask("Is my fridge drawing more than usual?")
+        self.assertEqual(data["intent"], "usual")
+        self.assertIsNone(data["devices"][0]["usual"])      # nothing read today
+        with self.assertNumQueries(1):
+            planner.execute(planner.build_plan(parse_query("last reading"), [], vocabulary.device_index(self.user.id)),
+                            self.user.id)
+
+    def test_plan_runs_one_query_and_reports_timings_in_debug(self):
+        parsed = parse_query("compare today vs yesterday")
+        plan = planner.build_plan(parsed, [], vocabulary.device_index(self.user.id))
+        with self.assertNumQueries(1):
+            planner.execute(plan, self.user.id)
+
+        with self.settings(DEBUG=True):
+            data = self.ask("Which of my devices are using the most power yesterday?")
+        self.assertEqual(data["meta"]["plan"]["intent"], "top_devices")
+        self.assertIn("execute", data["meta"]["timings_ms"])
+        self.assertNotIn("meta", self.ask("fridge yesterday"))
@@ -0,0 +1,113 @@
+"""
+Per-user device vocabulary for resolving device mentions in chat questions.
+
+Each user's index maps normalized phrases to their device ids. The phrases
+are the device name, its slug (with and without hyphens) and, when the
+name or slug contains a known device kind ("Living Room AC", "washer"),
+every alias of that kind from ``nlp.DEVICE_KEYWORDS``. The index is cached
+(CHAT_VOCABULARY_TIMEOUT) and dropped by the Device signal receivers when a
+device is created, renamed or deleted, so a cache hit resolves mentions
+without touching the database. The phrases are compiled with
+``nlp.compile_keywords`` (memoized per process), so a question is matched
+in one pass. Exact names win over generic aliases because the longest
+phrase matches first.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from telemetry_service.models import Device
+from .nlp import DEVICE_KEYWORDS, compile_keywords, normalize
+
+DeviceRef = namedtuple("DeviceRef", "id name slug")
+
+_KIND_MATCHER = compile_keywords(
+    [v for variants in DEVICE_KEYWORDS.values() for v in variants]
+    + list(DEVICE_KEYWORDS)
+)
+_KIND_OF = {v: slug for slug, variants in DEVICE_KEYWORDS.items() for v in variants + [slug]}
+
+
+def _cache():
+    return caches[settings.TELEMETRY_CACHE_ALIAS]
+
+
+def _key(user_id):
+    return f"chat:vocab:{user_id}"
+
+
+def _phrases_for(name, slug):
+    own = {normalize(name), slug.lower(), normalize(slug.replace("-", " "))}
+    aliases = set()
+    for text in own:
+        for match in _KIND_MATCHER.finditer(text):
+            kind = _KIND_OF[match.group()]
+            aliases.update(DEVICE_KEYWORDS[kind])
+            aliases.add(normalize(kind.replace("-", " ")))
+    return own | aliases
+
+
+def _devices(user_id):
+    return Device.objects.filter(user_id=user_id).order_by("id").values_list("id", "name", "slug")
+
+
+def _index_from_rows(rows):
+    devices, phrases = {}, {}
+    for pk, name, slug in rows:
+        devices[pk] = DeviceRef(pk, name, slug)
+        for phrase in _phrases_for(name, slug):
+            phrases.setdefault(phrase, []).append(pk)
+    return {"devices": devices, "phrases": phrases}
+
+
+def build_index(user_id):
+    return _index_from_rows(_devices(user_id))
+
+
+def device_index(user_id):
+    """Return the user's cached ``{"devices": {id: DeviceRef}, "phrases": {phrase: [ids]}}``."""
+    cache = _cache()
+    index = cache.get(_key(user_id))
+    if index is None:
+        index = build_index(user_id)
+        cache.set(_key(user_id), index, timeout=settings.CHAT_VOCABULARY_TIMEOUT)
+    return index
+
+
+async def adevice_index(user_id):
+    """``device_index`` for async views."""
+    cache = _cache()
+    index = await cache.aget(_key(user_id))
+    if index is None:
+        index = _index_from_rows([row async for row in _devices(user_id)])
+        await cache.aset(_key(user_id), index, timeout=settings.CHAT_VOCABULARY_TIMEOUT)
+    return index
+
+
+@lru_cache(maxsize=1024)
+def _matcher(phrases):
+    return compile_keywords(phrases)
+
+
+def resolve(user_id, text, index=None):
+    """Devices mentioned in ``text``, in order of first mention, as DeviceRefs."""
+    index = index or device_index(user_id)
+    phrases = index["phrases"]
+    found = []
+    for match in _matcher(tuple(sorted(phrases))).finditer(normalize(text)):
+        for pk in phrases[match.group()]:
+            if pk not in found:
+                found.append(pk)
+    return [index["devices"][pk] for pk in found]
+
+
+def invalidate(user_id):
+    transaction.on_commit(lambda: forget(user_id))
+
+
+def forget(user_id):
+    """Drop the user's cached index right away, without waiting for a commit."""
+    _cache().delete(_key(user_id))
@@ -165,5 +165,100 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Telemetry ingestion
+# Rows per INSERT statement when bulk loading, and the largest batch a
+# single API request may submit.
+TELEMETRY_BULK_BATCH_SIZE = int(os.getenv("TELEMETRY_BULK_BATCH_SIZE", "1000"))
+TELEMETRY_BULK_MAX_ROWS = int(os.getenv("TELEMETRY_BULK_MAX_ROWS", "10000"))
+
+# Write-behind ingest buffer (telemetry_service/buffer.py). When enabled the
+# ingest endpoints queue validated readings and answer 202; a background
+# thread writes them in BATCH_SIZE batches or every INTERVAL seconds. Beyond
+# MAX_ROWS queued readings per process they answer 503. Readings that cannot
+# be written at shutdown are spooled to SPOOL_DIR (if set) and replayed.
+TELEMETRY_BUFFER = {
+    "ENABLED": os.getenv("TELEMETRY_BUFFER", "").lower() in ("1", "true", "yes"),
+    "MAX_ROWS": int(os.getenv("TELEMETRY_BUFFER_MAX_ROWS", "200000")),
+    "BATCH_SIZE": int(os.getenv("TELEMETRY_BUFFER_BATCH_SIZE", "5000")),
+    "INTERVAL": float(os.getenv("TELEMETRY_BUFFER_INTERVAL", "1.0")),
+    "SPOOL_DIR": os.getenv("TELEMETRY_BUFFER_SPOOL_DIR") or None,
+}
 
+# Telemetry reads: keyset page size for GET .../telemetry/?page_size=, and
+# rows fetched per server-side cursor round-trip when streaming exports.
+TELEMETRY_PAGE_SIZE = 1000
+TELEMETRY_MAX_PAGE_SIZE = 10000
+TELEMETRY_EXPORT_CHUNK_SIZE = 5000
+# Upper bound on buckets per GET .../series/ response.
+TELEMETRY_SERIES_MAX_BUCKETS = 5000
+# Upper bound on ?max_points= for downsampled chart reads (telemetry_service/downsample.py).
+TELEMETRY_MAX_POINTS = 5000
+# Fleet status (GET .../devices/status/): a device whose last reading is
+# older than STALE_AFTER seconds is "stale", older than OFFLINE_AFTER "offline".
+TELEMETRY_STATUS = {
+    "STALE_AFTER": int(os.getenv("TELEMETRY_STALE_AFTER", "900")),
+    "OFFLINE_AFTER": int(os.getenv("TELEMETRY_OFFLINE_AFTER", "86400")),
+}
 
+# Raw telemetry retention (see telemetry_service/retention.py and the
+# compact_telemetry command): per-minute rows are kept for RAW_DAYS, then
+# compacted to MEDIUM_RESOLUTION ("15min" or "hour") buckets until
+# MEDIUM_DAYS, then to one row per day.
+TELEMETRY_RETENTION = {
+    "RAW_DAYS": 90,
+    "MEDIUM_DAYS": 365,
+    "MEDIUM_RESOLUTION": "15min",
+}
+
+# Cold telemetry archive (telemetry_service/archive.py and the
+# archive_telemetry command): device-days older than AFTER_DAYS are packed
+# into one row of per-minute float32 values. 0 (the default) disables it.
+TELEMETRY_ARCHIVE = {
+    "AFTER_DAYS": int(os.getenv("TELEMETRY_ARCHIVE_AFTER_DAYS", "0")),
+    "COMPRESS": True,
+}
+
+# Aggregate result cache (telemetry_service/caching.py). Local memory by
+# default; point "default" at a shared backend (e.g. Redis) when running
+# several workers so ingest invalidation reaches every process.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "smart-home",
+    }
+}
+TELEMETRY_CACHE_ALIAS = "default"
+# Expiry for windows that are still open. Closed windows never expire on a
+# shared cache; on a per-process cache (locmem) they get this expiry too.
+TELEMETRY_CACHE_TIMEOUT = 300
+
+# Per-user device vocabulary used by the chat endpoint (chat_service/vocabulary.py).
+# Device signals invalidate it; the timeout bounds staleness for writes that
+# bypass signals (bulk_create, other processes with a local-memory cache).
+CHAT_VOCABULARY_TIMEOUT = 600
+
+# Tariff used by chat cost questions (chat_service/planner.py).
+ENERGY_PRICE_PER_KWH = float(os.getenv("ENERGY_PRICE_PER_KWH", "0.15"))
+ENERGY_CURRENCY = os.getenv("ENERGY_CURRENCY", "USD")
+
+# Async (ASGI) endpoints: requests each worker lets into the database at
+# once. Every in-flight async request holds its own connection, so
+# WEB_CONCURRENCY (gunicorn workers) x this must stay within
+# DB_MAX_CONNECTIONS, the share of PostgreSQL's max_connections (100 by
+# default) this deployment may use; the default splits it evenly between
+# workers, and gunicorn.conf.py refuses to start when it is exceeded. The
+# rest queue in the event loop instead of failing with "too many clients".
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "80"))
+ASYNC_DB_CONCURRENCY = int(os.getenv("ASYNC_DB_CONCURRENCY", max(1, min(20, DB_MAX_CONNECTIONS // WEB_CONCURRENCY))))
+
+# Live telemetry stream (/api/async/live/, telemetry_service/live.py). The
+# in-process broker only reaches streams served by the ingesting worker; point
+# TELEMETRY_LIVE_BROKER at a shared broker when running several workers.
+TELEMETRY_LIVE_BROKER = os.getenv("TELEMETRY_LIVE_BROKER", "telemetry_service.live.InProcessBroker")
+TELEMETRY_LIVE_QUEUE_SIZE = 1000      # messages buffered per stream before it resyncs
+TELEMETRY_LIVE_HEARTBEAT = 15         # seconds between keep-alive comments
+TELEMETRY_LIVE_RETRY_MS = 3000        # EventSource reconnect delay
+# EventSource authenticates with ?token=, a stream-only token from
+# POST /api/async/live/token/ that is valid this long (only checked on connect)
+TELEMETRY_LIVE_TOKEN_LIFETIME = timedelta(seconds=60)
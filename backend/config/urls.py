@@ -11,4 +11,8 @@ urlpatterns = [
     path("api/auth/", include("auth_service.urls")),
     path("api/", include("telemetry_service.urls")),
     path("api/chat/", include("chat_service.urls")),
+
+    # async (ASGI) endpoints; serve with gunicorn.conf.py
+    path("api/async/", include("telemetry_service.async_urls")),
+    path("api/async/chat/", include("chat_service.async_urls")),
 ]
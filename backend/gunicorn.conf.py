@@ -0,0 +1,57 @@
+"""
+Production server config: gunicorn managing uvicorn (ASGI) workers.
+
+    gunicorn config.asgi:application -c gunicorn.conf.py
+
+Every worker runs an event loop, so the /api/async/ endpoints can keep many
+requests waiting on PostgreSQL without a thread each; the sync DRF
+endpoints still work and run in the worker's thread pool. Tune with
+environment variables, e.g. WEB_CONCURRENCY=4 GUNICORN_BIND=0.0.0.0:8000.
+
+One worker is the default. The aggregate cache and the live broker default
+to per-process implementations (locmem, InProcessBroker) that only see
+their own worker's ingests, so more workers need a shared CACHES backend
+and TELEMETRY_LIVE_BROKER, and WEB_CONCURRENCY x ASYNC_DB_CONCURRENCY
+within DB_MAX_CONNECTIONS; ``on_starting`` refuses to start otherwise.
+GUNICORN_ALLOW_LOCAL_STATE=1 waives the cache and broker checks for
+read-only load tests (bench_concurrency).
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+# uvicorn workers ignore ``threads``; it only applies if GUNICORN_WORKER_CLASS is switched to gthread (WSGI)
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+# recycle workers periodically to bound memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+backlog = 2048
+reload = os.getenv("GUNICORN_RELOAD", "").lower() in ("1", "true", "yes")
+# an empty GUNICORN_ACCESS_LOG turns access logging off
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    if workers == 1:
+        return
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    from django.conf import settings
+
+    problems = []
+    if os.getenv("GUNICORN_ALLOW_LOCAL_STATE", "").lower() not in ("1", "true", "yes"):
+        cache = settings.CACHES[settings.TELEMETRY_CACHE_ALIAS]["BACKEND"]
+        if cache.endswith((".LocMemCache", ".DummyCache")):
+            problems.append(f"the telemetry cache ({cache}) is per process")
+        if settings.TELEMETRY_LIVE_BROKER.endswith(".InProcessBroker"):
+            problems.append("TELEMETRY_LIVE_BROKER is the in-process broker")
+    if workers * settings.ASYNC_DB_CONCURRENCY > settings.DB_MAX_CONNECTIONS:
+        problems.append(f"{workers} workers x ASYNC_DB_CONCURRENCY={settings.ASYNC_DB_CONCURRENCY} "
+                        f"exceeds DB_MAX_CONNECTIONS={settings.DB_MAX_CONNECTIONS}")
+    if problems:
+        raise RuntimeError(f"Refusing to start {workers} workers: {'; '.join(problems)}.")
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TelemetryServiceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'telemetry_service'
+
+    def ready(self):
+        from . import receivers  # noqa: F401
@@ -0,0 +1,187 @@
+"""
+Columnar archive of cold telemetry (TELEMETRY_ARCHIVE).
+
+Device-days older than AFTER_DAYS are packed by ``retention.archive_day``
+into one TelemetryDayArchive row: 1,440 per-minute float32 values (NaN for
+minutes without a reading), zlib-compressed when COMPRESS is set, next to
+the day's exact total and reading count. The raw rows are then deleted, so
+cold history costs one row per device-day instead of up to 1,440.
+
+Readings are kept at minute resolution: several readings within one minute
+are summed into its slot, and an archived reading's timestamp is the start
+of its minute. Values are float32, so individual readings keep about seven
+significant digits; the stored daily total is exact.
+
+Reads stay transparent. Whole hours and days come from the rollups, which
+archiving leaves untouched; the helpers here supply the archived readings
+for the partial-hour edges of a window (rollups.py) and for the telemetry
+listing and export (views.py). Only windows that reach back before the
+archive cutoff look at this table at all, so recent reads cost nothing
+extra. Disabling the archive again (or raising AFTER_DAYS) hides archived
+days from those reads until they are restored with
+``archive_telemetry --restore``.
+"""
+import heapq
+import zlib
+from datetime import timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import TelemetryDayArchive
+
+SLOTS = 1440
+MINUTE = timedelta(minutes=1)
+DAY = timedelta(days=1)
+DTYPE = np.dtype("<f4")
+
+
+def encode(values):
+    """Pack 1,440 per-minute values; returns (bytes, compressed)."""
+    raw = np.asarray(values, dtype=DTYPE).tobytes()
+    if settings.TELEMETRY_ARCHIVE["COMPRESS"]:
+        return zlib.compress(raw), True
+    return raw, False
+
+
+def decode(row):
+    """The 1,440 per-minute values of an archive row (NaN where nothing was read)."""
+    data = bytes(row.values)
+    if row.compressed:
+        data = zlib.decompress(data)
+    return np.frombuffer(data, dtype=DTYPE)
+
+
+def cutoff(now=None):
+    """Start of the oldest UTC day that is never archived, or None when archiving is off."""
+    days = settings.TELEMETRY_ARCHIVE["AFTER_DAYS"]
+    if not days:
+        return None
+    now = now or timezone.now()
+    return now.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+
+
+def overlaps(start):
+    """Whether a window starting at ``start`` (aware, or None for open) can reach archived days."""
+    limit = cutoff()
+    return limit is not None and (start is None or start < limit)
+
+
+def _slot_range(bucket, lo, hi, hi_inclusive):
+    """Slot indices [first, last) of the day starting at ``bucket`` whose minute lies in the window."""
+    first = 0 if lo is None else -(-(lo - bucket) // MINUTE)
+    if hi is None:
+        last = SLOTS
+    elif hi_inclusive:
+        last = (hi - bucket) // MINUTE + 1
+    else:
+        last = -(-(hi - bucket) // MINUTE)
+    first, last = min(max(first, 0), SLOTS), min(max(last, 0), SLOTS)
+    return first, max(first, last)
+
+
+def readings(row, lo=None, hi=None, hi_inclusive=False):
+    """Yield (timestamp, kwh) for the archived readings of ``row`` in the window, oldest first."""
+    values = decode(row)
+    first, last = _slot_range(row.bucket, lo, hi, hi_inclusive)
+    for slot in np.flatnonzero(~np.isnan(values[first:last])) + first:
+        yield row.bucket + int(slot) * MINUTE, float(values[slot])
+
+
+def _days(lo, hi):
+    q = {}
+    if lo is not None:
+        q["bucket__gt"] = lo - DAY
+    if hi is not None:
+        q["bucket__lte"] = hi
+    return q
+
+
+def edge_readings(devices, pieces):
+    """
+    Archived readings inside rollups.plan_range "raw" pieces, as
+    [(device_id, timestamp, kwh), ...].
+    """
+    found = []
+    for lo, hi, inclusive in pieces:
+        for row in TelemetryDayArchive.objects.filter(device__in=devices, **_days(lo, hi)).order_by():
+            found += [(row.device_id, ts, kwh) for ts, kwh in readings(row, lo, hi, inclusive)]
+    return found
+
+
+def bucket_totals(device_id, start, end, unit):
+    """{bucket: [kwh, readings]} per hour or day for archived days in [start, end)."""
+    totals = {}
+    for row in TelemetryDayArchive.objects.filter(device_id=device_id, bucket__gte=start, bucket__lt=end):
+        if unit == "day":
+            totals[row.bucket] = [row.total_kwh, row.readings]
+            continue
+        hours = decode(row).reshape(24, 60)
+        present = ~np.isnan(hours)
+        for hour in np.flatnonzero(present.any(axis=1)):
+            totals[row.bucket + timedelta(hours=int(hour))] = [
+                float(np.nansum(hours[hour], dtype=np.float64)), int(present[hour].sum()),
+            ]
+    return totals
+
+
+def _batches(qs, size=31):
+    """Archive rows of ``qs`` fetched a month of days at a time."""
+    offset = 0
+    while True:
+        batch = list(qs[offset:offset + size])
+        yield from batch
+        if len(batch) < size:
+            return
+        offset += size
+
+
+def _newest(device_id, start, end, cursor):
+    qs = TelemetryDayArchive.objects.filter(device_id=device_id, **_days(start, end)).order_by("-bucket")
+    if cursor is not None:
+        qs = qs.filter(bucket__lte=cursor[0])
+    for row in _batches(qs):
+        for ts, kwh in reversed(list(readings(row, start, end, True))):
+            # archived readings sort as id 0 against the (timestamp, id) cursor
+            if cursor is None or (ts, 0) < cursor:
+                yield None, ts, kwh
+
+
+def merge_newest(device_id, rows, start, end, cursor=None, limit=None):
+    """
+    Merge archived readings into a newest-first page of raw ``(id, timestamp,
+    energy_kwh)`` rows fetched for the same window, ``cursor`` (timestamp, id)
+    and ``limit``. Archived readings have no id. A late raw reading shadows
+    the archived one for the same minute until the next archive run.
+    """
+    limit_ts = cutoff()
+    if limit_ts is None or (start is not None and start >= limit_ts):
+        return rows
+    if limit is not None and len(rows) >= limit and rows[-1][1] >= limit_ts:
+        return rows                 # the page ends before archived days begin
+    merged = heapq.merge(rows, _newest(device_id, start, end, cursor),
+                         key=lambda row: (row[1], row[0] or 0), reverse=True)
+    out = []
+    for row in merged:
+        if row[0] is None and out and out[-1][1] == row[1]:
+            continue
+        out.append(row)
+        if limit is not None and len(out) >= limit:
+            break
+    return out
+
+
+def merge_oldest(device_id, rows, start, end):
+    """Merge archived readings into an oldest-first iterator of raw (timestamp, energy_kwh)."""
+    if not overlaps(start):
+        yield from rows
+        return
+    qs = TelemetryDayArchive.objects.filter(device_id=device_id, **_days(start, end)).order_by("bucket")
+    archived = ((ts, 1, kwh) for row in _batches(qs) for ts, kwh in readings(row, start, end, True))
+    last = None
+    for ts, archived_row, kwh in heapq.merge(((ts, 0, kwh) for ts, kwh in rows), archived):
+        if archived_row and ts == last:
+            continue
+        last = ts
+        yield ts, kwh
@@ -0,0 +1,127 @@
+"""
+Helpers for the async (ASGI) endpoints under /api/async/.
+
+These are plain Django ``async def`` views rather than DRF views, because
+DRF's request cycle is synchronous and would pin a worker thread for every
+request. Authentication mirrors simplejwt's JWTAuthentication: token
+validation is pure CPU, and the user lookup goes through the async ORM.
+"""
+import asyncio
+import json
+import weakref
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connection
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+
+from .renderers import FastJSONRenderer
+
+_renderer = FastJSONRenderer()
+_db_slots = weakref.WeakKeyDictionary()   # event loop -> Semaphore
+
+
+def render_json(data):
+    return _renderer.render(data)
+
+
+def json_response(data, status=200):
+    return HttpResponse(render_json(data), status=status, content_type="application/json")
+
+
+class StreamToken(Token):
+    """
+    Short-lived token that only authenticates ``?token=`` on streaming
+    endpoints. URLs end up in access logs, so they never carry an access
+    token; a leaked stream token expires within TELEMETRY_LIVE_TOKEN_LIFETIME
+    and cannot call the API.
+    """
+    token_type = "stream"
+    lifetime = settings.TELEMETRY_LIVE_TOKEN_LIFETIME
+
+
+def parse_json(request):
+    """Decoded JSON body, or raises ValueError."""
+    return json.loads(request.body or b"null")
+
+
+async def authenticate(request, query_token=False):
+    """
+    Return the active user for the request's Bearer token, or None. With
+    ``query_token`` a ``?token=`` StreamToken is accepted too, for clients
+    such as EventSource that cannot set headers.
+    """
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw = auth.get_raw_token(header) if header is not None else None
+    validate = auth.get_validated_token
+    if raw is None and query_token:
+        raw, validate = request.GET.get("token"), StreamToken
+    if not raw:
+        return None
+    try:
+        token = validate(raw)
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        return None
+    user = await get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).afirst()
+    return user if user is not None and user.is_active else None
+
+
+def db_slot():
+    """
+    Semaphore bounding requests that use the database on this event loop
+    (ASYNC_DB_CONCURRENCY). Each in-flight request holds its own
+    connection, so excess requests wait here rather than at PostgreSQL.
+    """
+    loop = asyncio.get_running_loop()
+    slot = _db_slots.get(loop)
+    if slot is None:
+        slot = _db_slots[loop] = asyncio.Semaphore(settings.ASYNC_DB_CONCURRENCY)
+    return slot
+
+
+def _release_connection():
+    # Django only closes it from response.close(), after the slot is released;
+    # skipped inside a transaction (ATOMIC_REQUESTS, TestCase)
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+
+@asynccontextmanager
+async def db_access():
+    """Hold a ``db_slot`` and release this request's connection on exit."""
+    async with db_slot():
+        try:
+            yield
+        finally:
+            await sync_to_async(_release_connection)()
+
+
+def jwt_required(view=None, *, query_token=False):
+    """
+    Authenticate ``view`` with a Bearer token (CSRF does not apply, as in
+    DRF) and run it inside ``db_access``. Streaming views return before
+    their body is produced, so the stream itself holds no slot.
+    """
+    if view is None:
+        return partial(jwt_required, query_token=query_token)
+
+    @csrf_exempt
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        async with db_access():
+            user = await authenticate(request, query_token=query_token)
+            if user is None:
+                return json_response({"detail": "Authentication credentials were not provided or are invalid."}, 401)
+            request.user = user
+            return await view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,16 @@
+from django.urls import path
+from . import async_views
+
+# Async (ASGI) twins of the DeviceViewSet hot paths; same payloads and responses.
+urlpatterns = [
+    path("devices/telemetry/", async_views.bulk_telemetry, name="async-bulk-telemetry"),
+    path("devices/status/", async_views.fleet_status, name="async-fleet-status"),
+    path("devices/summary/", async_views.fleet_summary, name="async-fleet-summary"),
+    path("devices/<int:pk>/telemetry/", async_views.device_telemetry, name="async-device-telemetry"),
+    path("devices/<int:pk>/summary/", async_views.device_summary, name="async-device-summary"),
+    path("devices/<int:pk>/stats/", async_views.device_stats, name="async-device-stats"),
+    path("devices/<int:pk>/monthly_graph/", async_views.device_monthly_graph, name="async-device-monthly-graph"),
+    path("devices/<int:pk>/series/", async_views.device_series, name="async-device-series"),
+    path("live/", async_views.live_stream, name="async-live"),
+    path("live/token/", async_views.live_token, name="async-live-token"),
+]
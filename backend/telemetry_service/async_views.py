@@ -0,0 +1,381 @@
+"""
+Async counterparts of the hot DeviceViewSet endpoints, served under
+/api/async/ (see async_urls.py). Reads go through the async ORM and share
+the aggregate cache with the sync views; ingestion validates inline and
+hands the transactional write to a worker thread. ``live_stream`` pushes
+new readings and running totals as Server-Sent Events (see live.py).
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET, require_http_methods
+from rest_framework.exceptions import NotFound
+
+from .async_api import StreamToken, db_access, jwt_required, json_response, parse_json, render_json
+from .buffer import FULL_MESSAGE, BufferFull, get_buffer, retry_after
+from .ingest import ingest_readings, validate_batch
+from .models import Device, DeviceDailyStats, DeviceStats
+from .pagination import TelemetryKeysetPagination
+from .serializers import TELEMETRY_VALUES, telemetry_columns, telemetry_rows
+from .views import (fleet_cache_args, fleet_payload, fleet_window, month_window, series_payload, series_window,
+                    stats_day, stats_payload, status_filter, status_payload, status_rows, window_bounds)
+from . import archive, caching, downsample, live, rollups, series
+
+NOT_FOUND = {"detail": "Not found."}
+
+
+async def _device(request, pk):
+    return await Device.objects.filter(pk=pk, user=request.user).afirst()
+
+
+def _buffer_full():
+    response = json_response(FULL_MESSAGE, 503)
+    response["Retry-After"] = retry_after()
+    return response
+
+
+async def _ingest(request, rows, default_device=None):
+    if not isinstance(rows, list) or not rows:
+        return json_response({"error": "Expected a non-empty list of readings."}, 400)
+    if len(rows) > settings.TELEMETRY_BULK_MAX_ROWS:
+        return json_response({"error": f"At most {settings.TELEMETRY_BULK_MAX_ROWS} readings per request."}, 400)
+
+    if default_device is not None:
+        device_ids = {default_device}
+    else:
+        device_ids = {pk async for pk in Device.objects.filter(user=request.user).values_list("id", flat=True)}
+    readings, errors = validate_batch(rows, device_ids, default_device)
+
+    atomic = request.GET.get("atomic", "").lower() in ("1", "true", "yes")
+    buffer = get_buffer()
+    if buffer is not None and readings and not (errors and atomic):
+        try:
+            accepted = buffer.submit(readings)
+        except BufferFull:
+            return _buffer_full()
+        return json_response({"accepted": accepted, "rejected": len(errors), "errors": errors}, 202)
+    # ingest runs a transaction plus signal receivers, so it stays sync
+    created = 0 if (errors and atomic) else await sync_to_async(ingest_readings)(readings)
+    return json_response({"created": created, "rejected": len(errors), "errors": errors}, 201 if created else 400)
+
+
+@require_http_methods(["POST"])
+@jwt_required
+async def bulk_telemetry(request):
+    try:
+        data = parse_json(request)
+    except ValueError:
+        return json_response({"error": "Invalid JSON."}, 400)
+    rows = data.get("readings") if isinstance(data, dict) else data
+    return await _ingest(request, rows)
+
+
+@require_http_methods(["GET", "POST"])
+@jwt_required
+async def device_telemetry(request, pk):
+    device = await _device(request, pk)
+    if device is None:
+        return json_response(NOT_FOUND, 404)
+
+    if request.method == "POST":
+        try:
+            data = parse_json(request)
+        except ValueError:
+            return json_response({"error": "Invalid JSON."}, 400)
+        if isinstance(data, list):
+            return await _ingest(request, data, default_device=device.id)
+        readings, errors = validate_batch([data], {device.id}, device.id)
+        if errors:
+            return json_response(errors[0]["errors"], 400)
+        reading = readings[0]
+        buffer = get_buffer()
+        if buffer is not None:
+            try:
+                buffer.submit([reading])
+            except BufferFull:
+                return _buffer_full()
+            return json_response({"device": device.id, "timestamp": reading.timestamp, "energy_kwh": reading.energy_kwh}, 202)
+        await sync_to_async(ingest_readings)([reading])
+        obj = await device.telemetry.aget(timestamp=reading.timestamp)
+        return json_response(
+            {"id": obj.id, "device": device.id, "timestamp": obj.timestamp, "energy_kwh": obj.energy_kwh}, 201,
+        )
+
+    try:
+        start, end = window_bounds(request.GET)
+        max_points, method = downsample.parse(request.GET)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    if max_points:
+        # streams over a server-side cursor, in a worker thread
+        return json_response(await sync_to_async(downsample.device_readings)(device, start, end, max_points, method))
+    qs = device.telemetry.all()
+    if start:
+        qs = qs.filter(timestamp__gte=start)
+    if end:
+        qs = qs.filter(timestamp__lte=end)
+    qs = qs.values_list(*TELEMETRY_VALUES)
+    encode = telemetry_columns if request.GET.get("layout") == "columns" else telemetry_rows
+    paginator = TelemetryKeysetPagination()
+    # archived days (archive.py) are merged in from a worker thread, only when the window reaches them
+    merge = sync_to_async(archive.merge_newest) if archive.overlaps(start) else None
+    if any(p in request.GET for p in (paginator.cursor_query_param, paginator.page_size_query_param)):
+        try:
+            cursor = paginator.get_cursor(request)
+        except NotFound as exc:
+            return json_response({"detail": str(exc.detail)}, 404)
+        rows = [row async for row in paginator.page_queryset(qs, request)]
+        if merge:
+            rows = await merge(device.id, rows, start, end, cursor, paginator.get_page_size(request) + 1)
+        rows, next_url = paginator.finish_page(rows, request, key=lambda row: (row[1], row[0] or 0))
+        return json_response({"next": next_url, "results": encode(rows, device)})
+    rows = [row async for row in qs[:1000]]
+    if merge:
+        rows = await merge(device.id, rows, start, end, limit=1000)
+    return json_response(encode(rows, device))
+
+
+async def _total(device_id, start, end):
+    rows = await rollups.agrouped([device_id], [(start, end)])
+    return sum(rows.values())
+
+
+@require_GET
+@jwt_required
+async def fleet_status(request):
+    try:
+        wanted = status_filter(request.GET)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    rows = [row async for row in status_rows(request.user)]
+    return json_response(status_payload(rows, wanted))
+
+
+@require_GET
+@jwt_required
+async def fleet_summary(request):
+    try:
+        ids, windows, unit = fleet_window(request.GET)
+        max_points, method = downsample.parse(request.GET)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    if not windows:
+        return json_response({"error": "Please provide at least one window."}, 400)
+    devices = Device.objects.filter(user=request.user).order_by("id")
+    if ids is not None:
+        devices = devices.filter(id__in=ids)
+    devices = [device async for device in devices]
+    missing = sorted(set(ids or ()) - {device.id for device in devices})
+    if missing:
+        return json_response({"error": f"Device(s) not found: {', '.join(map(str, missing))}."}, 404)
+
+    device_ids = [device.id for device in devices]
+    bounds = [(start, end) for _, start, end in windows]
+    start, end, extra = fleet_cache_args(windows, unit)
+
+    async def compute():
+        return await rollups.awindowed(device_ids, bounds, unit) if device_ids else {}
+
+    rows = await caching.acached("fleet_summary", request.user.id, device_ids, start, end, compute, extra=extra)
+    return json_response(fleet_payload(devices, windows, unit, rows, max_points, method))
+
+
+@require_GET
+@jwt_required
+async def device_summary(request, pk):
+    device = await _device(request, pk)
+    if device is None:
+        return json_response(NOT_FOUND, 404)
+    try:
+        start, end = window_bounds(request.GET)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    total = await caching.acached(
+        "summary", request.user.id, [device.id], start, end,
+        lambda: _total(device.id, start, end),
+    )
+    return json_response({"device_id": device.id, "device_name": device.name, "total_kwh": round(total, 4)})
+
+
+@require_GET
+@jwt_required
+async def device_stats(request, pk):
+    device = await _device(request, pk)
+    if device is None:
+        return json_response(NOT_FOUND, 404)
+    try:
+        day = stats_day(request.GET)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    lifetime = await DeviceStats.objects.filter(device=device).afirst()
+    daily = await DeviceDailyStats.objects.filter(device=device, bucket=day).afirst()
+    return json_response(stats_payload(device, day, lifetime, daily))
+
+
+async def _daily(device_id, start, end):
+    rows = await rollups.agrouped([device_id], [(start, end)], unit="day", include_end=False)
+    return sorted((bucket, kwh) for (_, _, bucket), kwh in rows.items())
+
+
+@require_GET
+@jwt_required
+async def device_monthly_graph(request, pk):
+    device = await _device(request, pk)
+    if device is None:
+        return json_response(NOT_FOUND, 404)
+    try:
+        month_name, year, month_start, month_end = month_window(request.GET)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    # same cache entry as the sync view: [(day, kwh), ...]
+    daily_data = await caching.acached(
+        "monthly_graph", request.user.id, [device.id], month_start, month_end,
+        lambda: _daily(device.id, month_start, month_end),
+        extra="day",
+    )
+    return json_response({
+        "device_id": device.id,
+        "device_name": device.name,
+        "month": month_name,
+        "year": year,
+        "data": [{"date": day, "total_kwh": round(total, 4)} for day, total in daily_data],
+    })
+
+
+@require_GET
+@jwt_required
+async def device_series(request, pk):
+    device = await _device(request, pk)
+    if device is None:
+        return json_response(NOT_FOUND, 404)
+    try:
+        start, end, granularity, zone = series_window(request.GET, request.user)
+        max_points, method = downsample.parse(request.GET)
+        # the series is one raw SQL statement, run in a worker thread
+        data = await caching.acached(
+            "series", request.user.id, [device.id], start, end,
+            lambda: sync_to_async(series.device_series)([device.id], start, end, granularity, zone),
+            extra=(granularity, zone.key),
+        )
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    return json_response(series_payload(device, granularity, zone, downsample.points(data, max_points, method)))
+
+
+def _sse(event, data):
+    return b"event: " + event.encode() + b"\ndata: " + render_json(data) + b"\n\n"
+
+
+async def _live_totals(device_ids, start):
+    rows = await rollups.agrouped(device_ids, [(start, None)])
+    return {pk: rows.get((0, pk, None), 0.0) for pk in device_ids}
+
+
+async def _resync(subscription, device_ids, start, attempts=3):
+    """
+    Totals since ``start`` to continue ``subscription`` from. A message
+    published while they are read may or may not be counted in them, so if
+    one arrives the queue is dropped and the totals read again. The race is
+    narrowed, not closed: a reading committed just before the read whose
+    publish reaches the queue only after the check is counted twice, and
+    after ``attempts`` busy reads the dropped readings are missing. Both are
+    accepted; the next snapshot (a reconnect or overflow) is exact.
+    """
+    subscription.drain()
+    for _ in range(attempts):
+        totals = await _live_totals(device_ids, start)
+        await asyncio.sleep(0)      # let publishes already handed to the loop land
+        subscription.overflowed = False
+        if not subscription.drain():
+            break
+    return totals
+
+
+def _snapshot(devices, start, totals):
+    return {
+        "start": start,
+        "devices": [{"id": pk, "name": name, "total_kwh": round(totals[pk], 4)} for pk, name in devices],
+    }
+
+
+async def _live_events(subscription, devices, start, totals):
+    try:
+        yield f"retry: {settings.TELEMETRY_LIVE_RETRY_MS}\n\n".encode()
+        yield _sse("snapshot", _snapshot(devices, start, totals))
+        while True:
+            message = await subscription.get(timeout=settings.TELEMETRY_LIVE_HEARTBEAT)
+            if subscription.overflowed:
+                # fell behind: rebuild the totals instead of replaying
+                async with db_access():
+                    totals = await _resync(subscription, list(totals), start)
+                yield _sse("snapshot", _snapshot(devices, start, totals))
+                continue
+            if message is None:
+                yield b": keep-alive\n\n"
+                continue
+            pk = message["device"]
+            fresh = [(ts, kwh) for ts, kwh in message["readings"] if ts >= start]
+            totals[pk] += sum(kwh for _, kwh in fresh)
+            totals[pk] -= sum(kwh for ts, kwh in message.get("replaced", ()) if ts >= start)
+            yield _sse("readings", {
+                "device": pk,
+                "readings": [{"timestamp": ts, "energy_kwh": kwh} for ts, kwh in fresh],
+                "total_kwh": round(totals[pk], 4),
+            })
+    finally:
+        subscription.close()
+
+
+@require_http_methods(["POST"])
+@jwt_required
+async def live_token(request):
+    """
+    A stream-only token for ``live_stream``'s ``?token=``, so the access token
+    never appears in a URL. It is checked on connect only; an EventSource
+    that reconnects after it expired fetches a new one.
+    """
+    token = StreamToken.for_user(request.user)
+    return json_response({"token": str(token), "expires_in": int(StreamToken.lifetime.total_seconds())})
+
+
+@require_GET
+@jwt_required(query_token=True)
+async def live_stream(request):
+    """
+    ``text/event-stream`` of the user's readings as they are committed, with
+    per-device totals since ``start`` (default: midnight UTC today).
+    ``?devices=1,2`` limits the stream; ``?token=`` (from ``live_token``)
+    authenticates EventSource.
+    """
+    qs = Device.objects.filter(user=request.user).order_by("id")
+    if request.GET.get("devices"):
+        try:
+            ids = [int(pk) for pk in request.GET["devices"].split(",")]
+        except ValueError:
+            return json_response({"error": "devices must be a comma-separated list of ids."}, 400)
+        qs = qs.filter(id__in=ids)
+    devices = [row async for row in qs.values_list("id", "name")]
+    if not devices:
+        return json_response(NOT_FOUND, 404)
+    try:
+        start = window_bounds(request.GET)[0]
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    start = start or timezone.now().astimezone(rollups.UTC).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # subscribe before reading totals so no commit is missed; see _resync for the overlap
+    subscription = live.broker().subscribe([live.channel(pk) for pk, _ in devices])
+    try:
+        totals = await _resync(subscription, [pk for pk, _ in devices], start)
+    except BaseException:
+        subscription.close()
+        raise
+    response = StreamingHttpResponse(
+        _live_events(subscription, devices, start, totals), content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,72 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks run in-process through DRF's test client inside a transaction
+that is rolled back at the end, so they can be pointed at any database
+without leaving data behind.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from rest_framework.test import APIClient
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def scratch_transaction():
+    """Run the block in a transaction that is always rolled back."""
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def bench_user(username="bench"):
+    User = get_user_model()
+    return User.objects.create_user(username=username, password="bench")
+
+
+def api_client(user):
+    # "localhost" is accepted by ALLOWED_HOSTS when DEBUG is on
+    client = APIClient(SERVER_NAME="localhost")
+    client.force_authenticate(user)
+    return client
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def timed(fn, repeat=1, setup=None):
+    """
+    Call ``fn`` ``repeat`` times; returns latency stats in milliseconds.
+    ``setup`` runs untimed before every call (e.g. to clear a cache).
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {
+        "runs": repeat,
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "max_ms": round(max(samples), 3),
+    }
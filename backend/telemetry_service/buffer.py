@@ -0,0 +1,353 @@
+"""
+Optional write-behind buffer for telemetry ingestion (TELEMETRY_BUFFER).
+
+When enabled, the ingest endpoints validate readings and queue them here
+instead of writing in the request; the request gets 202 Accepted. A
+background thread per process drains the queue through ``ingest_readings``
+in batches of BATCH_SIZE rows, or every INTERVAL seconds when traffic is
+light, so thousands of small POSTs become a handful of large INSERTs (and
+one rollup/cache/live update per batch). Readings repeated for the same
+device and timestamp while queued are coalesced; the last one wins.
+
+Back-pressure: once MAX_ROWS readings are queued ``submit`` raises
+BufferFull and the endpoints answer 503 with Retry-After.
+
+Failures: only transient database errors (lost connection, server
+restarting) put a batch back at the head of the queue to be retried with
+backoff. Any other error means some reading in the batch can never be
+written - typically its device was deleted while it was queued - so
+readings of devices that no longer exist are dropped and the rest of the
+batch is bisected until the offending readings are isolated; the others
+are written. Dropped readings are written to a ``rejected-*.jsonl`` file in
+SPOOL_DIR (never replayed automatically), or logged when there is none,
+and counted in ``dropped``.
+
+Retries are at-least-once: a batch (or, after bisecting, part of it) can be
+retried after it committed, e.g. when the connection drops while the commit
+is acknowledged. Re-written readings replace the stored ones, which is
+harmless, except for readings landing on the bucket start of a compacted
+day (retention.compact_day), which ingest adds to the stored value; those
+are counted twice, in the stored row itself, so rebuilding rollups does not
+repair it. Buffered readings are normally recent and compaction only touches
+old days, so this takes a late backfill through the buffer meeting a retry.
+
+Durability: the queue is flushed when the process exits normally (gunicorn
+and uvicorn workers run atexit handlers on graceful shutdown). Readings that
+cannot be written then, e.g. because the database is down, are written to
+a spool file in SPOOL_DIR when one is configured, and replayed by the next
+process that starts a buffer, with the same double-count caveat for
+compacted days as retries. A hard kill loses whatever is still queued, at
+most MAX_ROWS readings per worker.
+
+``metrics()`` reports queue depth, throughput and flush latency for this
+process (GET /api/ingest/buffer/ for staff users).
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, connection
+from django.utils.dateparse import parse_datetime
+
+from .ingest import Reading, ingest_readings
+from .models import Device
+
+logger = logging.getLogger(__name__)
+
+FULL_MESSAGE = {"error": "Ingest buffer is full; retry later."}
+# errors worth retrying the same batch for; anything else is a property of the readings
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+class BufferFull(Exception):
+    pass
+
+
+class IngestBuffer:
+    def __init__(self, max_rows, batch_size, interval, spool_dir=None, writer=ingest_readings):
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spool_dir = Path(spool_dir) if spool_dir else None
+        self.writer = writer
+        self._pending = {}          # (device_id, timestamp) -> Reading, in arrival order
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._counters = dict.fromkeys(
+            ("submitted", "coalesced", "rejected", "flushed", "flushes", "failures", "dropped", "spooled", "replayed"),
+            0,
+        )
+        self._flush_ms = {"last": 0.0, "max": 0.0, "total": 0.0}
+
+    # --- producers ---------------------------------------------------------
+
+    def submit(self, readings):
+        """Queue readings; returns how many were accepted or raises BufferFull."""
+        with self._cond:
+            if len(self._pending) + len(readings) > self.max_rows:
+                self._counters["rejected"] += len(readings)
+                raise BufferFull(f"{len(self._pending)} readings already queued")
+            for r in readings:
+                key = (r.device_id, r.timestamp)
+                if key in self._pending:
+                    self._counters["coalesced"] += 1
+                self._pending[key] = r
+            self._counters["submitted"] += len(readings)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_thread()
+        return len(readings)
+
+    def depth(self):
+        return len(self._pending)
+
+    # --- flushing ----------------------------------------------------------
+
+    def _ensure_thread(self):
+        # a worker forked from a process that already had a buffer needs its own thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="telemetry-ingest-buffer", daemon=True)
+            self._thread.start()
+
+    def _take(self, limit):
+        with self._cond:
+            keys = list(islice(self._pending, limit))
+            return [self._pending.pop(key) for key in keys]
+
+    def _requeue(self, batch):
+        with self._cond:
+            pending = {(r.device_id, r.timestamp): r for r in batch}
+            # readings that arrived meanwhile are newer and win
+            pending.update(self._pending)
+            self._pending = pending
+
+    def _write(self, batch):
+        t0 = time.perf_counter()
+        try:
+            self.writer(batch)
+        finally:
+            # the flush thread would otherwise hold its connection forever
+            if not connection.in_atomic_block:
+                close_old_connections()
+        elapsed = (time.perf_counter() - t0) * 1000
+        with self._cond:
+            self._counters["flushed"] += len(batch)
+            self._counters["flushes"] += 1
+            self._flush_ms["last"] = elapsed
+            self._flush_ms["max"] = max(self._flush_ms["max"], elapsed)
+            self._flush_ms["total"] += elapsed
+
+    def _deliver(self, batch):
+        """
+        Write a batch, setting aside readings that can never be written.
+        Transient errors propagate so the caller can retry the whole batch.
+        Re-writing readings that did get stored replaces them, except at the
+        bucket start of a compacted day, where ingest adds to the stored
+        value: a retried reading there is counted twice (see Failures).
+        """
+        known = set(Device.objects.filter(id__in={r.device_id for r in batch}).values_list("id", flat=True))
+        self._drop([r for r in batch if r.device_id not in known], "device no longer exists")
+        self._bisect([r for r in batch if r.device_id in known])
+
+    def _bisect(self, batch):
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception as exc:
+            with self._cond:
+                self._counters["failures"] += 1
+            if len(batch) == 1:
+                self._drop(batch, f"{type(exc).__name__}: {exc}")
+                return
+            middle = len(batch) // 2
+            self._bisect(batch[:middle])
+            self._bisect(batch[middle:])
+
+    def _drop(self, batch, reason):
+        if not batch:
+            return
+        with self._cond:
+            self._counters["dropped"] += len(batch)
+        if self.spool_dir is None:
+            logger.error("Dropping %d buffered readings (%s): %s", len(batch), reason,
+                         "; ".join(json.dumps(_row(r)) for r in batch))
+        else:
+            path = self._spool_file("rejected", batch)
+            logger.error("Dropping %d buffered readings (%s); saved to %s", len(batch), reason, path)
+
+    def _run(self):
+        self._replay_spool()
+        backoff = self.interval
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or len(self._pending) >= self.batch_size, timeout=backoff,
+                )
+                if self._stopping:
+                    return
+            batch = self._take(self.batch_size)
+            if not batch:
+                continue
+            try:
+                self._deliver(batch)
+                backoff = self.interval
+            except TRANSIENT_ERRORS:
+                logger.exception("Flushing %d buffered readings failed; will retry", len(batch))
+                with self._cond:
+                    self._counters["failures"] += 1
+                self._requeue(batch)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if not connection.in_atomic_block:
+                    close_old_connections()
+
+    def flush(self):
+        """Write everything queued from the calling thread; returns rows written or dropped."""
+        written = 0
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return written
+            try:
+                self._deliver(batch)
+            except TRANSIENT_ERRORS:
+                with self._cond:
+                    self._counters["failures"] += 1
+                self._requeue(batch)
+                raise
+            written += len(batch)
+
+    def close(self, timeout=10.0):
+        """Stop the flush thread and drain the queue, spooling what cannot be written."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not flush %d buffered readings on shutdown", self.depth())
+            self._spool(self._take(self.max_rows))
+
+    # --- spool -------------------------------------------------------------
+
+    def _spool_file(self, prefix, batch):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / f"{prefix}-{os.getpid()}-{uuid.uuid4().hex}.jsonl"
+        with open(path, "w") as fh:
+            for r in batch:
+                fh.write(json.dumps(_row(r)) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        return path
+
+    def _spool(self, batch):
+        if not batch:
+            return
+        if self.spool_dir is None:
+            logger.error("Dropping %d buffered readings: no spool directory configured", len(batch))
+            return
+        path = self._spool_file("telemetry", batch)
+        self._counters["spooled"] += len(batch)
+        logger.warning("Spooled %d buffered readings to %s", len(batch), path)
+
+    def _replay_spool(self):
+        if self.spool_dir is None or not self.spool_dir.is_dir():
+            return
+        for path in sorted(self.spool_dir.glob("telemetry-*.jsonl")):
+            claimed = path.with_suffix(f".replaying-{os.getpid()}")
+            try:
+                path.rename(claimed)        # atomic, so only one worker replays a file
+            except OSError:
+                continue
+            with open(claimed) as fh:
+                batch = [
+                    Reading(device_id, parse_datetime(ts), kwh)
+                    for device_id, ts, kwh in map(json.loads, filter(None, map(str.strip, fh)))
+                ]
+            try:
+                for i in range(0, len(batch), self.batch_size):
+                    self._deliver(batch[i:i + self.batch_size])
+            except TRANSIENT_ERRORS:
+                logger.exception("Replaying %s failed; leaving it for the next start", path)
+                claimed.rename(path)
+                return
+            claimed.unlink()
+            self._counters["replayed"] += len(batch)
+
+    # --- metrics -----------------------------------------------------------
+
+    def metrics(self):
+        with self._cond:
+            flushes = self._counters["flushes"]
+            return {
+                "depth": len(self._pending),
+                "max_rows": self.max_rows,
+                "batch_size": self.batch_size,
+                "interval_s": self.interval,
+                **self._counters,
+                "last_flush_ms": round(self._flush_ms["last"], 3),
+                "avg_flush_ms": round(self._flush_ms["total"] / flushes, 3) if flushes else 0.0,
+                "max_flush_ms": round(self._flush_ms["max"], 3),
+            }
+
+
+def _row(reading):
+    return [reading.device_id, reading.timestamp.isoformat(), reading.energy_kwh]
+
+
+_buffer = None
+_buffer_config = None
+_lock = threading.Lock()
+
+
+def get_buffer():
+    """This process's buffer, or None when TELEMETRY_BUFFER is disabled."""
+    global _buffer, _buffer_config
+    config = settings.TELEMETRY_BUFFER
+    if not config["ENABLED"]:
+        return None
+    if _buffer is None or _buffer_config != config:
+        with _lock:
+            if _buffer is None or _buffer_config != config:
+                if _buffer is not None:
+                    _buffer.close()
+                _buffer = IngestBuffer(
+                    max_rows=config["MAX_ROWS"],
+                    batch_size=config["BATCH_SIZE"],
+                    interval=config["INTERVAL"],
+                    spool_dir=config["SPOOL_DIR"],
+                )
+                _buffer_config = dict(config)
+    return _buffer
+
+
+def retry_after():
+    """Retry-After seconds for 503s: roughly one flush interval."""
+    return str(max(1, math.ceil(settings.TELEMETRY_BUFFER["INTERVAL"])))
+
+
+@atexit.register
+def _close_on_exit():
+    if _buffer is not None:
+        _buffer.close()
@@ -0,0 +1,166 @@
+"""
+Result cache for telemetry aggregates (summary, monthly_graph, chat queries).
+
+Cache keys embed version tokens instead of being deleted on write:
+
+* ``v:<device>:<YYYYMM>`` is bumped when a reading for that device lands in
+  that month, so an ingest only invalidates windows that cover it;
+* ``v:<device>:all`` is bumped on every ingest and versions windows
+  without a start;
+* ``v:<device>:epoch`` is bumped when a device's history is rebuilt.
+
+A bump stores a fresh random token rather than incrementing a counter, and
+a version key found missing (never written, or evicted by a culling cache)
+is created with a fresh token too, so a result key can never come back
+into use after an invalidation.
+
+Closed windows (ending in the past) are cached without expiry when the
+cache is shared between processes. A local-memory cache is per worker and
+only sees the invalidations of its own worker's ingests, so there every
+window gets TELEMETRY_CACHE_TIMEOUT, which bounds how long another
+worker's late reading can go unseen. Only computed numbers are cached,
+never device names, so renames need no invalidation.
+"""
+import hashlib
+import uuid
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils import timezone
+
+from .rollups import as_utc
+
+PREFIX = "telemetry"
+
+
+def _cache():
+    return caches[settings.TELEMETRY_CACHE_ALIAS]
+
+
+def _month(dt):
+    dt = as_utc(dt)
+    return date(dt.year, dt.month, 1)
+
+
+def _months(start, end):
+    month, last = _month(start), _month(end)
+    while month <= last:
+        yield month
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _version_keys(device_id, start, end):
+    keys = [f"{PREFIX}:v:{device_id}:epoch"]
+    if start is None:
+        keys.append(f"{PREFIX}:v:{device_id}:all")
+    else:
+        end = end or timezone.now()
+        keys += [f"{PREFIX}:v:{device_id}:{m:%Y%m}" for m in _months(start, max(start, end))]
+    return keys
+
+
+def _token():
+    return uuid.uuid4().hex
+
+
+def _bump(keys):
+    _cache().set_many({key: _token() for key in keys}, timeout=None)
+
+
+def _versions(cache, keys):
+    versions = cache.get_many(keys)
+    missing = [k for k in keys if k not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _token(), timeout=None)
+        # another process may have added the key first; use whichever token won
+        versions.update(cache.get_many(missing))
+    return versions
+
+
+async def _aversions(cache, keys):
+    versions = await cache.aget_many(keys)
+    missing = [k for k in keys if k not in versions]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, _token(), timeout=None)
+        versions.update(await cache.aget_many(missing))
+    return versions
+
+
+def invalidate(pairs):
+    """
+    Invalidate windows covering the given ``(device_id, timestamp)`` pairs.
+    Deferred until commit so readers cannot re-cache pre-commit data.
+    """
+    keys = set()
+    for device_id, ts in pairs:
+        keys.add(f"{PREFIX}:v:{device_id}:all")
+        keys.add(f"{PREFIX}:v:{device_id}:{_month(ts):%Y%m}")
+    if keys:
+        transaction.on_commit(lambda: _bump(sorted(keys)))
+
+
+def invalidate_device(device_id):
+    transaction.on_commit(lambda: forget([device_id]))
+
+
+def forget(device_ids):
+    """Invalidate every cached window of ``device_ids`` right away, without waiting for a commit."""
+    _bump([f"{PREFIX}:v:{device_id}:epoch" for device_id in device_ids])
+
+
+def _result_key(kind, user_id, device_ids, start, end, extra, version_keys, versions):
+    fingerprint = repr((
+        kind, user_id, sorted(device_ids),
+        start.isoformat() if start else None,
+        end.isoformat() if end else None,
+        extra,
+        [versions.get(k) for k in version_keys],
+    ))
+    return f"{PREFIX}:r:{hashlib.sha1(fingerprint.encode()).hexdigest()}"
+
+
+def _timeout(end):
+    closed = end is not None and end < timezone.now()
+    shared = not isinstance(_cache(), (LocMemCache, DummyCache))
+    return None if closed and shared else settings.TELEMETRY_CACHE_TIMEOUT
+
+
+def cached(kind, user_id, device_ids, start, end, compute, extra=None):
+    """
+    Return ``compute()`` for the window, served from cache when no reading
+    covering it has been ingested since it was stored.
+    """
+    cache = _cache()
+    start, end = as_utc(start), as_utc(end)
+    version_keys = [k for d in sorted(device_ids) for k in _version_keys(d, start, end)]
+    versions = _versions(cache, version_keys)
+    key = _result_key(kind, user_id, device_ids, start, end, extra, version_keys, versions)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+
+    value = compute()
+    cache.set(key, value, timeout=_timeout(end))
+    return value
+
+
+async def acached(kind, user_id, device_ids, start, end, compute, extra=None):
+    """``cached`` for async views; ``compute`` returns an awaitable. Shares entries with ``cached``."""
+    cache = _cache()
+    start, end = as_utc(start), as_utc(end)
+    version_keys = [k for d in sorted(device_ids) for k in _version_keys(d, start, end)]
+    versions = await _aversions(cache, version_keys)
+    key = _result_key(kind, user_id, device_ids, start, end, extra, version_keys, versions)
+    hit = await cache.aget(key)
+    if hit is not None:
+        return hit
+
+    value = await compute()
+    await cache.aset(key, value, timeout=_timeout(end))
+    return value
@@ -0,0 +1,189 @@
+"""
+Server-side downsampling for charts (?max_points=N&downsample=lttb|minmax).
+
+``minmax`` keeps the lowest and highest reading of each of N/2 equal time
+bins, so every peak and trough survives. ``lttb`` (Largest-Triangle-Three-
+Buckets, the default) keeps, per bucket, the point spanning the largest
+triangle with its chosen neighbour and the next bucket's average, which
+follows the visual shape of the line more closely.
+
+Raw readings are never loaded whole: ``stream`` reads them from the
+server-side cursor in chunks and folds each chunk, vectorized, into a fixed
+number of min/max bins (4N points for lttb, which then runs on those -
+"MinMaxLTTB"), so memory is bounded by ``max_points`` rather than by the
+window. In-memory series (bucketed series, chat answers) are reduced with
+``points``.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max, Min
+
+from .models import Telemetry, TelemetryDayArchive
+from . import archive
+
+METHODS = ("lttb", "minmax")
+# lttb runs on the min/max of PRESELECT * max_points / 2 bins
+PRESELECT = 4
+
+
+def parse(params):
+    """(max_points, method) from ?max_points=&downsample=; max_points is None when absent."""
+    method = params.get("downsample") or "lttb"
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsample '{method}'. Use one of: {', '.join(METHODS)}.")
+    raw = params.get("max_points")
+    if raw in (None, ""):
+        return None, method
+    limit = settings.TELEMETRY_MAX_POINTS
+    try:
+        max_points = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid max_points '{raw}'.")
+    if not 3 <= max_points <= limit:
+        raise ValueError(f"max_points must be between 3 and {limit}.")
+    return max_points, method
+
+
+def lttb(x, y, n):
+    """Indices of the ``n`` points of (x, y) that LTTB keeps; ``x`` ascending."""
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    # n - 2 buckets over the interior points; the first and last points are always kept
+    edges = np.linspace(1, size - 1, n - 1).astype(np.intp)
+    out = np.empty(n, dtype=np.intp)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt = slice(hi, edges[i + 2]) if i + 3 < n else slice(size - 1, size)
+        cx, cy = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = out[i + 1] = lo + int(area.argmax())
+    return out
+
+
+def _extrema(bins, y):
+    """For each bin present: (bin, index of its minimum, index of its maximum)."""
+    order = np.lexsort((y, bins))
+    ordered = bins[order]
+    first = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    last = np.r_[first[1:] - 1, len(ordered) - 1]
+    return ordered[first], order[first], order[last]
+
+
+def _bins(x, x0, width, count):
+    return np.clip((x - x0) // width, 0, count - 1).astype(np.intp)
+
+
+def minmax(x, y, n):
+    """Indices of the minimum and maximum of (x, y) in each of n/2 equal-width bins of ``x``."""
+    if n >= len(x):
+        return np.arange(len(x))
+    count = max(n // 2, 1)
+    width = (x[-1] - x[0]) / count or 1.0
+    _, lo, hi = _extrema(_bins(x, x[0], width, count), y)
+    return np.unique(np.r_[lo, hi])
+
+
+def points(pairs, max_points, method="lttb"):
+    """Reduce an in-memory [(timestamp, value), ...] list, oldest first, to at most ``max_points``."""
+    if not max_points or len(pairs) <= max_points:
+        return list(pairs)
+    x = np.fromiter((ts.timestamp() for ts, _ in pairs), dtype=np.float64, count=len(pairs))
+    y = np.fromiter((value for _, value in pairs), dtype=np.float64, count=len(pairs))
+    x -= x[0]
+    keep = (lttb if method == "lttb" else minmax)(x, y, max_points)
+    return [pairs[i] for i in keep]
+
+
+class _Bins:
+    """Running min and max per time bin, plus the first and last reading."""
+
+    def __init__(self, start, end, count):
+        self.x0 = start.timestamp()
+        self.count = count
+        self.width = max(end.timestamp() - self.x0, 1e-6) / count
+        self.low = np.full((2, count), np.inf)     # rows: value, timestamp
+        self.high = np.full((2, count), -np.inf)
+        self.ends = []
+        self.seen = 0
+
+    def add(self, x, y):
+        present, lo, hi = _extrema(_bins(x, self.x0, self.width, self.count), y)
+        better = y[lo] < self.low[0, present]
+        self.low[:, present[better]] = y[lo[better]], x[lo[better]]
+        better = y[hi] > self.high[0, present]
+        self.high[:, present[better]] = y[hi[better]], x[hi[better]]
+        if not self.seen:
+            self.ends.append((x[0], y[0]))
+        self.ends[1:] = [(x[-1], y[-1])]
+        self.seen += len(x)
+
+    def result(self, ends):
+        filled = np.isfinite(self.low[0])
+        x = np.r_[self.low[1, filled], self.high[1, filled]]
+        y = np.r_[self.low[0, filled], self.high[0, filled]]
+        if ends:
+            x = np.r_[x, [e[0] for e in self.ends]]
+            y = np.r_[y, [e[1] for e in self.ends]]
+        order = np.argsort(x, kind="stable")
+        x, y = x[order], y[order]
+        unique = np.r_[True, x[1:] != x[:-1]] if len(x) else np.ones(0, dtype=bool)
+        return x[unique], y[unique]
+
+
+def stream(rows, start, end, max_points, method="lttb", chunk_size=None):
+    """
+    Downsample an oldest-first iterable of (timestamp, value) readings in
+    [start, end] to at most ``max_points``. Returns (timestamps, values,
+    number of readings read).
+    """
+    chunk_size = chunk_size or settings.TELEMETRY_EXPORT_CHUNK_SIZE
+    count = max(max_points // 2, 1) if method == "minmax" else max_points * PRESELECT // 2
+    bins = _Bins(start, end, count)
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        x = np.fromiter((ts.timestamp() for ts, _ in chunk), dtype=np.float64, count=len(chunk))
+        y = np.fromiter((value for _, value in chunk), dtype=np.float64, count=len(chunk))
+        bins.add(x, y)
+    x, y = bins.result(ends=method == "lttb")
+    if method == "lttb":
+        keep = lttb(x - bins.x0, y, max_points)
+        x, y = x[keep], y[keep]
+    timestamps = [datetime.fromtimestamp(t, tz=dt_timezone.utc) for t in x.tolist()]
+    return timestamps, y.tolist(), bins.seen
+
+
+def _span(device_id, start, end):
+    """Fill an open window edge with the device's oldest or newest reading, raw or archived."""
+    found = Telemetry.objects.filter(device_id=device_id).aggregate(lo=Min("timestamp"), hi=Max("timestamp"))
+    lo, hi = [found["lo"]], [found["hi"]]
+    if archive.overlaps(start):
+        days = TelemetryDayArchive.objects.filter(device_id=device_id).aggregate(lo=Min("bucket"), hi=Max("bucket"))
+        lo.append(days["lo"])
+        hi.append(days["hi"] and days["hi"] + timedelta(days=1))
+    lo, hi = [t for t in lo if t is not None], [t for t in hi if t is not None]
+    return start or (min(lo) if lo else None), end or (max(hi) if hi else None)
+
+
+def device_readings(device, start, end, max_points, method):
+    """
+    A device's readings in [start, end] (either open), raw and archived,
+    downsampled to at most ``max_points`` in the telemetry columns layout.
+    """
+    payload = {"device": device.id, "device_name": device.name, "method": method,
+               "source_points": 0, "timestamps": [], "kwh": []}
+    lo, hi = _span(device.id, start, end)
+    if lo is None or hi is None or lo > hi:
+        return payload
+    qs = Telemetry.objects.filter(device_id=device.id, timestamp__gte=lo, timestamp__lte=hi)
+    rows = (qs.order_by("timestamp", "id").values_list("timestamp", "energy_kwh")
+            .iterator(chunk_size=settings.TELEMETRY_EXPORT_CHUNK_SIZE))
+    rows = archive.merge_oldest(device.id, rows, lo, hi)
+    timestamps, kwh, seen = stream(rows, lo, hi, max_points, method)
+    payload.update({"source_points": seen, "timestamps": timestamps, "kwh": kwh})
+    return payload
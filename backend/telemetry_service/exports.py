@@ -0,0 +1,39 @@
+"""
+Streaming encoders for telemetry exports.
+
+Each encoder takes an iterator of ``(timestamp, energy_kwh)`` tuples and
+yields text chunks, so the response never holds more than one chunk of
+rows in memory.
+"""
+import json
+from itertools import islice
+
+CHUNK_ROWS = 1000
+
+
+def _chunks(rows, size=CHUNK_ROWS):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_csv(rows):
+    yield "timestamp,energy_kwh\n"
+    for chunk in _chunks(rows):
+        yield "".join(f"{ts.isoformat()},{kwh!r}\n" for ts, kwh in chunk)
+
+
+def encode_ndjson(rows):
+    dumps = json.dumps
+    for chunk in _chunks(rows):
+        yield "".join(dumps({"timestamp": ts.isoformat(), "energy_kwh": kwh}) + "\n" for ts, kwh in chunk)
+
+
+# fmt -> (content type, file extension, encoder)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv", encode_csv),
+    "ndjson": ("application/x-ndjson", "ndjson", encode_ndjson),
+}
@@ -0,0 +1,171 @@
+"""
+Write path for telemetry readings.
+
+Every ingest route (single POST, batch POST, management commands) funnels
+through ``ingest_readings`` so that inserts are always chunked and batched,
+and idempotent thanks to the unique (device, timestamp) constraint.
+
+A reading whose timestamp holds a row written by retention compaction
+(``compacted``, a bucket's summed energy) is added to that row rather than
+replacing it, so the rest of the bucket's energy is kept.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework import serializers
+
+from .models import Telemetry
+from .rollups import as_utc
+from .signals import telemetry_ingested
+
+Reading = namedtuple("Reading", ["device_id", "timestamp", "energy_kwh"])
+
+
+class TelemetryReadingSerializer(serializers.Serializer):
+    """Validates one row of a batch; ``device`` may be implied by the URL."""
+    device = serializers.IntegerField(required=False)
+    timestamp = serializers.DateTimeField()
+    energy_kwh = serializers.FloatField()
+
+
+def validate_batch(rows, device_ids, default_device=None):
+    """
+    Validate a list of raw reading dicts in a single pass.
+
+    ``device_ids`` is the set of devices the caller may write to. Returns
+    ``(readings, errors)`` where ``errors`` is a list of
+    ``{"index": i, "errors": {...}}`` entries for the rejected rows.
+    """
+    child = TelemetryReadingSerializer()
+    readings, errors = [], []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({"index": index, "errors": {"non_field_errors": ["Expected an object."]}})
+            continue
+        try:
+            data = child.run_validation(row)
+        except serializers.ValidationError as exc:
+            errors.append({"index": index, "errors": exc.detail})
+            continue
+        device_id = data.get("device", default_device)
+        if device_id is None:
+            errors.append({"index": index, "errors": {"device": ["This field is required."]}})
+        elif device_id not in device_ids:
+            errors.append({"index": index, "errors": {"device": [f"Unknown device '{device_id}'."]}})
+        else:
+            readings.append(Reading(device_id, data["timestamp"], data["energy_kwh"]))
+    return readings, errors
+
+
+def _dedupe(readings):
+    """Collapse repeated (device, timestamp) pairs, with timestamps in UTC; the last reading wins."""
+    latest = {}
+    for device_id, ts, kwh in readings:
+        ts = as_utc(ts)
+        latest[(device_id, ts)] = Reading(device_id, ts, kwh)
+    return list(latest.values())
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _add_to_compacted(readings, current, compacted):
+    """Readings landing on compacted rows become the row's total plus the reading."""
+    return [
+        Reading(r.device_id, r.timestamp, current[(r.device_id, r.timestamp)] + r.energy_kwh)
+        if (r.device_id, r.timestamp) in compacted else r
+        for r in readings
+    ]
+
+
+def _upsert_postgresql(readings, batch_size):
+    """
+    INSERT ... ON CONFLICT DO NOTHING, then lock the conflicting rows and
+    update those whose value changed (or add to compacted ones). Returns
+    (stored, replaced): readings that were inserted or changed, and the
+    previous values of the changed ones.
+    """
+    table = connection.ops.quote_name(Telemetry._meta.db_table)
+    inserted = set()
+    with connection.cursor() as cursor:
+        for chunk in _chunks(readings, batch_size):
+            cursor.execute(
+                f'INSERT INTO {table} (device_id, "timestamp", energy_kwh) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(chunk))} '
+                f'ON CONFLICT (device_id, "timestamp") DO NOTHING RETURNING device_id, "timestamp"',
+                [v for r in chunk for v in r],
+            )
+            inserted.update(cursor.fetchall())
+        conflicts = [r for r in readings if (r.device_id, r.timestamp) not in inserted]
+
+        changed, replaced = [], []
+        for chunk in _chunks(conflicts, batch_size):
+            cursor.execute(
+                f'SELECT device_id, "timestamp", energy_kwh, compacted FROM {table} '
+                f'WHERE (device_id, "timestamp") IN ({", ".join(["(%s, %s::timestamptz)"] * len(chunk))}) FOR UPDATE',
+                [v for r in chunk for v in (r.device_id, r.timestamp)],
+            )
+            rows = cursor.fetchall()
+            current = {(device_id, ts): kwh for device_id, ts, kwh, _ in rows}
+            chunk = _add_to_compacted(chunk, current, {(device_id, ts) for device_id, ts, _, flag in rows if flag})
+            diff = [r for r in chunk if current.get((r.device_id, r.timestamp), r.energy_kwh) != r.energy_kwh]
+            if not diff:
+                continue
+            cursor.execute(
+                f'UPDATE {table} t SET energy_kwh = v.kwh '
+                f'FROM (VALUES {", ".join(["(%s, %s::timestamptz, %s::double precision)"] * len(diff))}) '
+                f'AS v(device_id, ts, kwh) WHERE t.device_id = v.device_id AND t."timestamp" = v.ts',
+                [v for r in diff for v in r],
+            )
+            changed += diff
+            replaced += [Reading(r.device_id, r.timestamp, current[(r.device_id, r.timestamp)]) for r in diff]
+    stored = [r for r in readings if (r.device_id, r.timestamp) in inserted] + changed
+    return stored, replaced
+
+
+def _upsert_generic(readings, batch_size):
+    """``_upsert_postgresql`` for other backends (SQLite in development), via the ORM."""
+    stored, replaced = [], []
+    for chunk in _chunks(readings, batch_size):
+        rows = Telemetry.objects.filter(
+            device_id__in={r.device_id for r in chunk}, timestamp__in={r.timestamp for r in chunk},
+        ).values_list("id", "device_id", "timestamp", "energy_kwh", "compacted").order_by()
+        existing = {(device_id, ts): (pk, kwh) for pk, device_id, ts, kwh, _ in rows}
+        chunk = _add_to_compacted(chunk, {key: kwh for key, (_, kwh) in existing.items()},
+                                  {(device_id, ts) for _, device_id, ts, _, flag in rows if flag})
+        new = [r for r in chunk if (r.device_id, r.timestamp) not in existing]
+        diff = [r for r in chunk if existing.get((r.device_id, r.timestamp), (None, r.energy_kwh))[1] != r.energy_kwh]
+        Telemetry.objects.bulk_create(
+            [Telemetry(device_id=r.device_id, timestamp=r.timestamp, energy_kwh=r.energy_kwh) for r in new],
+        )
+        Telemetry.objects.bulk_update(
+            [Telemetry(id=existing[(r.device_id, r.timestamp)][0], energy_kwh=r.energy_kwh) for r in diff],
+            ["energy_kwh"],
+        )
+        stored += new + diff
+        replaced += [Reading(r.device_id, r.timestamp, existing[(r.device_id, r.timestamp)][1]) for r in diff]
+    return stored, replaced
+
+
+def ingest_readings(readings, batch_size=None):
+    """
+    Upsert readings on (device, timestamp) in chunks; returns how many
+    distinct readings are now stored. Resending a reading is a no-op and a
+    new value for an existing timestamp replaces the old one, so client
+    retries never double-count (except on compacted rows, which a reading
+    is added to). Derived state (rollups etc.) is updated by
+    ``telemetry_ingested`` receivers from the rows that actually changed.
+    """
+    batch_size = batch_size or settings.TELEMETRY_BULK_BATCH_SIZE
+    readings = _dedupe(readings)
+    if not readings:
+        return 0
+    upsert = _upsert_postgresql if connection.vendor == "postgresql" else _upsert_generic
+    with transaction.atomic():
+        stored, replaced = upsert(readings, batch_size)
+        if stored:
+            telemetry_ingested.send(sender=Telemetry, readings=stored, replaced=replaced)
+    return len(readings)
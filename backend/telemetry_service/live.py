@@ -0,0 +1,128 @@
+"""
+Live telemetry fan-out for the /api/async/live/ Server-Sent Events stream.
+
+Committed readings are published per device on ``device:<id>`` channels by
+a ``telemetry_ingested`` receiver. Each open stream subscribes to the
+channels of its user's devices and keeps running totals from the published
+readings, so a tick costs no database queries.
+
+The broker is pluggable (TELEMETRY_LIVE_BROKER). The default
+``InProcessBroker`` only reaches subscribers in the publishing process,
+which suits a single worker; multi-worker deployments need a broker with
+the same ``publish``/``subscribe``/``has_subscribers`` interface over a
+shared channel such as Redis pub/sub. Messages are plain Python objects,
+so such a broker must serialize them.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .rollups import as_utc
+
+
+def channel(device_id):
+    return f"device:{device_id}"
+
+
+class Subscription:
+    """
+    Bounded queue of messages for one subscriber, bound to its event loop.
+    If the consumer falls behind the queue is emptied and ``overflowed`` is
+    set, telling it to rebuild its state from the database.
+    """
+
+    def __init__(self, broker, channels, maxsize):
+        self.broker = broker
+        self.channels = list(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, message):
+        """Thread-safe: publishers may run in any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:        # the subscriber's loop is gone
+            self.close()
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.drain()
+            self.overflowed = True
+
+    def drain(self):
+        """Drop every queued message; returns whether there were any."""
+        dropped = not self.queue.empty()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        return dropped
+
+    async def get(self, timeout=None):
+        """Next message, or None after ``timeout`` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def subscribe(self, channels, maxsize=None):
+        """Subscribe the running event loop to ``channels``; returns a Subscription."""
+        subscription = Subscription(self, channels, maxsize or settings.TELEMETRY_LIVE_QUEUE_SIZE)
+        with self._lock:
+            for name in subscription.channels:
+                self._subscribers[name].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for name in subscription.channels:
+                subscribers = self._subscribers.get(name)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[name]
+
+    def has_subscribers(self, channel):
+        return channel in self._subscribers
+
+
+@lru_cache(maxsize=None)
+def broker():
+    return import_string(settings.TELEMETRY_LIVE_BROKER)()
+
+
+def publish_readings(readings, replaced=()):
+    """
+    Publish stored readings per device as ``{"device", "readings", "replaced"}``,
+    both lists of (timestamp, kwh); ``replaced`` holds the previous values of
+    readings that were corrected.
+    """
+    hub = broker()
+    by_device = defaultdict(lambda: ([], []))
+    for i, rows in enumerate((readings, replaced)):
+        for r in rows:
+            by_device[r.device_id][i].append((as_utc(r.timestamp), r.energy_kwh))
+    for device_id, (rows, old) in by_device.items():
+        name = channel(device_id)
+        if hub.has_subscribers(name):
+            hub.publish(name, {"device": device_id, "readings": sorted(rows), "replaced": sorted(old)})
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from datetime import timedelta
+from telemetry_service.models import Device, Telemetry, TelemetryDayArchive
+from telemetry_service import archive, retention
+from telemetry_service.rollups import floor_to
+
+
+class Command(BaseCommand):
+    help = "Pack raw telemetry older than TELEMETRY_ARCHIVE['AFTER_DAYS'] into one archive row per device-day"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lookback-days", type=int, default=7,
+                            help="Only revisit this many days behind the archive cutoff (run daily)")
+        parser.add_argument("--full", action="store_true", help="Scan from each device's oldest raw reading")
+        parser.add_argument("--device", type=int, action="append", help="Device id (repeatable); default all")
+        parser.add_argument("--restore", action="store_true",
+                            help="Turn archived days back into raw rows (e.g. before disabling the archive)")
+
+    def handle(self, *args, **opts):
+        devices = Device.objects.order_by("id")
+        if opts["device"]:
+            devices = devices.filter(id__in=opts["device"])
+
+        if opts["restore"]:
+            days = TelemetryDayArchive.objects.filter(device__in=devices).order_by("device_id", "bucket")
+            restored = sum(retention.restore_day(device_id, day)
+                           for device_id, day in days.values_list("device_id", "bucket").iterator())
+            self.stdout.write(self.style.SUCCESS(f"Restored {restored} readings."))
+            return
+
+        cutoff = archive.cutoff()
+        if cutoff is None:
+            raise CommandError("Archiving is disabled; set TELEMETRY_ARCHIVE['AFTER_DAYS'].")
+
+        archived = days = 0
+        for device_id in devices.values_list("id", flat=True).iterator():
+            day = cutoff - timedelta(days=opts["lookback_days"])
+            if opts["full"]:
+                oldest = Telemetry.objects.filter(device_id=device_id).aggregate(t=Min("timestamp"))["t"]
+                if oldest is None:
+                    continue
+                day = floor_to(oldest, "day")
+            while day < cutoff:
+                n = retention.archive_day(device_id, day)
+                archived += n
+                days += bool(n)
+                day += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} readings into {days} device-days."))
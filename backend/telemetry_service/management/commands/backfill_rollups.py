@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from telemetry_service.models import Device
+from telemetry_service import caching, rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild hourly/daily telemetry rollups from raw readings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--device", type=int, action="append", help="Device id (repeatable); default all devices")
+        parser.add_argument("--since", help="ISO datetime; only rebuild buckets from this day on")
+        parser.add_argument("--until", help="ISO datetime; only rebuild buckets before this day")
+
+    def handle(self, *args, **opts):
+        since = parse_datetime(opts["since"]) if opts["since"] else None
+        until = parse_datetime(opts["until"]) if opts["until"] else None
+        if (opts["since"] and since is None) or (opts["until"] and until is None):
+            raise CommandError("--since/--until must be ISO datetimes.")
+
+        devices = Device.objects.order_by("id")
+        if opts["device"]:
+            devices = devices.filter(id__in=opts["device"])
+
+        count = 0
+        for device_id in devices.values_list("id", flat=True).iterator():
+            rollups.rebuild(device_id, since, until)
+            caching.invalidate_device(device_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {count} device(s)."))
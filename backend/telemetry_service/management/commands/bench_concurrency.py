@@ -0,0 +1,240 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from contextlib import contextmanager
+from datetime import timedelta
+from rest_framework_simplejwt.tokens import RefreshToken
+import asyncio
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+from telemetry_service.benchmarks import bench_user, percentile
+from telemetry_service.ingest import Reading, ingest_readings
+from telemetry_service.models import Device
+
+WORKER_CLASSES = {"wsgi": "sync", "asgi": "uvicorn_worker.UvicornWorker"}
+APPS = {"wsgi": "config.wsgi:application", "asgi": "config.asgi:application"}
+QUESTION = "how much energy did my fridge use in the last 7 days"
+
+
+def _endpoint(name, mode, device_id):
+    """(method, path, body) for one request against the sync or async URL."""
+    prefix = "async-" if mode == "asgi" else ""
+    if name == "summary":
+        return "GET", reverse(f"{prefix}device-summary", args=[device_id]), None
+    if name == "telemetry":
+        return "GET", reverse(f"{prefix}device-telemetry", args=[device_id]) + "?page_size=500", None
+    if name == "chat":
+        return "POST", reverse("async-chat-query" if mode == "asgi" else "chat_query"), json.dumps({"question": QUESTION})
+    raise CommandError(f"Unknown endpoint '{name}'")
+
+
+def _request_bytes(method, path, body, token):
+    body = (body or "").encode()
+    head = (
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nAuthorization: Bearer {token}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    )
+    return head.encode() + body
+
+
+async def _read_response(reader):
+    """Read one response; returns (status, keep_alive)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip().lower()
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+        return status, headers.get("connection") != "close"
+    if headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+        return status, headers.get("connection") != "close"
+    await reader.read()
+    return status, False
+
+
+async def _client(port, request, deadline, timeout, latencies, failures):
+    writer = None
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            writer.write(request)
+            status, keep_alive = await asyncio.wait_for(_read_response(reader), timeout)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            failures.append("connection")
+            if writer is not None:
+                writer.close()
+            writer = None
+            continue
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if status != 200:
+            failures.append(status)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _drive(port, request, clients, duration, timeout):
+    latencies, failures = [], []
+    deadline = time.perf_counter() + duration
+    t0 = time.perf_counter()
+    await asyncio.gather(*[
+        _client(port, request, deadline, timeout, latencies, failures) for _ in range(clients)
+    ])
+    return latencies, failures, time.perf_counter() - t0
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test a real gunicorn server with many concurrent clients, comparing sync WSGI workers "
+        "against uvicorn (ASGI) workers on the same endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", default="50,200,400", help="Comma-separated concurrent client counts")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds per client count")
+        parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes per server")
+        parser.add_argument("--threads", type=int, default=1,
+                            help="Threads per WSGI worker (more than 1 switches to gthread)")
+        parser.add_argument("--endpoint", choices=["summary", "telemetry", "chat"], default="summary")
+        parser.add_argument("--modes", default="wsgi,asgi", help="Comma-separated servers to test")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--days", type=int, default=7, help="Days of minute readings for the bench device")
+        parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+
+    def handle(self, *args, **opts):
+        clients = [int(c) for c in opts["clients"].split(",")]
+        modes = opts["modes"].split(",")
+        for mode in modes:
+            if mode not in APPS:
+                raise CommandError(f"Unknown mode '{mode}'; expected wsgi or asgi")
+
+        # the servers run in other processes, so the fixture has to be committed
+        user = bench_user("bench-concurrency")
+        results = []
+        try:
+            device = self.load_fixture(user, opts["days"])
+            token = str(RefreshToken.for_user(user).access_token)
+            for mode in modes:
+                method, path, body = _endpoint(opts["endpoint"], mode, device.id)
+                request = _request_bytes(method, path, body, token)
+                with self.server(mode, opts) as port:
+                    self.wait_ready(port, request, opts["timeout"])
+                    for count in clients:
+                        latencies, failures, elapsed = asyncio.run(
+                            _drive(port, request, count, opts["duration"], opts["timeout"])
+                        )
+                        results.append(self.row(mode, opts["endpoint"], count, latencies, failures, elapsed))
+                        if not opts["json"]:
+                            self.write_row(results[-1])
+        finally:
+            user.delete()
+
+        if opts["json"]:
+            self.stdout.write(json.dumps({
+                "endpoint": opts["endpoint"],
+                "workers": opts["workers"],
+                "threads": opts["threads"],
+                "duration_s": opts["duration"],
+                "results": results,
+            }))
+
+    def load_fixture(self, user, days):
+        device = Device.objects.create(user=user, name="Fridge", slug="fridge")
+        end = timezone.now().replace(second=0, microsecond=0)
+        start = end - timedelta(days=days)
+        ingest_readings([
+            Reading(device.id, start + timedelta(minutes=i), 0.012) for i in range(days * 1440)
+        ])
+        return device
+
+    @contextmanager
+    def server(self, mode, opts):
+        threads = opts["threads"] if mode == "wsgi" else 1
+        worker_class = "gthread" if mode == "wsgi" and threads > 1 else WORKER_CLASSES[mode]
+        env = {
+            **os.environ,
+            "GUNICORN_BIND": f"127.0.0.1:{opts['port']}",
+            "GUNICORN_WORKER_CLASS": worker_class,
+            "GUNICORN_THREADS": str(threads),
+            "GUNICORN_ACCESS_LOG": "",
+            "GUNICORN_LOG_LEVEL": "warning",
+            "GUNICORN_RELOAD": "",
+            "WEB_CONCURRENCY": str(opts["workers"]),
+            # a read-only load test does not mind per-worker caches
+            "GUNICORN_ALLOW_LOCAL_STATE": "1",
+        }
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", APPS[mode], "-c", "gunicorn.conf.py"],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        try:
+            yield opts["port"]
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                self.stderr.write(f"{mode} server did not stop in time; killed")
+
+    def wait_ready(self, port, request, timeout):
+        head, _, body = request.partition(b"\r\n\r\n")
+        method, path = head.split(b" ")[:2]
+        headers = dict(
+            line.split(": ", 1) for line in head.decode().split("\r\n")[1:]
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            try:
+                conn.request(method.decode(), path.decode(), body=body or None, headers=headers)
+                res = conn.getresponse()
+                res.read()
+                if res.status != 200:
+                    raise CommandError(f"Warm-up request returned {res.status}")
+                return
+            except OSError:
+                time.sleep(0.2)
+            finally:
+                conn.close()
+        raise CommandError(f"Server on port {port} did not become ready within {timeout:.0f}s")
+
+    def row(self, mode, endpoint, clients, latencies, failures, elapsed):
+        return {
+            "mode": mode,
+            "endpoint": endpoint,
+            "clients": clients,
+            "requests": len(latencies),
+            "errors": len(failures),
+            "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "max_ms": round(max(latencies, default=0.0), 2),
+        }
+
+    def write_row(self, row):
+        self.stdout.write(
+            f"{row['mode']:<5} {row['clients']:>5} clients  {row['rps']:>8.1f} req/s  "
+            f"p50 {row['p50_ms']:>8.2f} ms  p95 {row['p95_ms']:>8.2f} ms  p99 {row['p99_ms']:>8.2f} ms  "
+            f"{row['errors']} errors"
+        )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+import json
+import time
+from telemetry_service.benchmarks import scratch_transaction, bench_user, api_client
+from telemetry_service.models import Device
+
+
+class Command(BaseCommand):
+    help = "Compare per-reading cost of single-row POSTs against batch ingestion"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--single", type=int, default=200, help="Readings sent one POST at a time")
+        parser.add_argument("--batch", type=int, default=5000, help="Readings sent in one batch POST")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+
+    def handle(self, *args, **opts):
+        with scratch_transaction():
+            user = bench_user("bench-ingest")
+            device = Device.objects.create(user=user, name="Bench", slug="bench")
+            client = api_client(user)
+            url = reverse("device-telemetry", args=[device.id])
+            start = timezone.now().replace(second=0, microsecond=0) - timedelta(days=30)
+
+            t0 = time.perf_counter()
+            for i in range(opts["single"]):
+                ts = start + timedelta(minutes=i)
+                res = client.post(url, {"timestamp": ts.isoformat(), "energy_kwh": 0.01}, format="json")
+                assert res.status_code == 201, res.content
+            single_s = time.perf_counter() - t0
+
+            rows = [
+                {"timestamp": (start + timedelta(days=1, minutes=i)).isoformat(), "energy_kwh": 0.01}
+                for i in range(opts["batch"])
+            ]
+            t0 = time.perf_counter()
+            res = client.post(url, rows, format="json")
+            batch_s = time.perf_counter() - t0
+            assert res.status_code == 201 and res.data["created"] == len(rows), res.content
+
+        single_us = single_s / max(opts["single"], 1) * 1e6
+        batch_us = batch_s / max(opts["batch"], 1) * 1e6
+        result = {
+            "single": {"readings": opts["single"], "seconds": round(single_s, 4), "us_per_reading": round(single_us, 2)},
+            "batch": {"readings": opts["batch"], "seconds": round(batch_s, 4), "us_per_reading": round(batch_us, 2)},
+            "speedup": round(single_us / batch_us, 1) if batch_us else None,
+        }
+        if opts["json"]:
+            self.stdout.write(json.dumps(result))
+            return
+        self.stdout.write(f"single POST: {single_us:,.1f} us/reading ({opts['single']} readings)")
+        self.stdout.write(f"batch POST:  {batch_us:,.1f} us/reading ({opts['batch']} readings)")
+        self.stdout.write(self.style.SUCCESS(f"speedup: {result['speedup']}x"))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+import json
+from rest_framework.renderers import JSONRenderer
+from telemetry_service.benchmarks import timed
+from telemetry_service.models import Device, Telemetry
+from telemetry_service.renderers import FastJSONRenderer
+from telemetry_service.serializers import TelemetrySerializer, telemetry_rows, telemetry_columns
+
+
+class Command(BaseCommand):
+    help = "Benchmark TelemetrySerializer against the tuple/columnar fast path (serialize + render, no DB)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated row counts")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+
+    def handle(self, *args, **opts):
+        device = Device(id=1, name="Fridge", slug="fridge")
+        start = timezone.now().replace(second=0, microsecond=0)
+        drf, fast = JSONRenderer(), FastJSONRenderer()
+
+        results = []
+        for size in [int(s) for s in opts["sizes"].split(",")]:
+            values = [(i, start - timedelta(minutes=i), 0.012 + (i % 7) / 1000) for i in range(size)]
+            objs = [Telemetry(id=pk, device=device, timestamp=ts, energy_kwh=kwh) for pk, ts, kwh in values]
+            cases = {
+                "serializer": lambda: drf.render(TelemetrySerializer(objs, many=True).data),
+                "rows": lambda: fast.render(telemetry_rows(values, device)),
+                "columns": lambda: fast.render(telemetry_columns(values, device)),
+            }
+            row = {"size": size}
+            for name, fn in cases.items():
+                row[name] = timed(fn, opts["repeat"])
+            row["speedup_rows"] = round(row["serializer"]["p50_ms"] / row["rows"]["p50_ms"], 1)
+            row["speedup_columns"] = round(row["serializer"]["p50_ms"] / row["columns"]["p50_ms"], 1)
+            results.append(row)
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(results))
+            return
+        for row in results:
+            self.stdout.write(
+                f"{row['size']:>7} rows  serializer {row['serializer']['p50_ms']:>9.1f} ms  "
+                f"rows {row['rows']['p50_ms']:>8.1f} ms ({row['speedup_rows']}x)  "
+                f"columns {row['columns']['p50_ms']:>8.1f} ms ({row['speedup_columns']}x)"
+            )
@@ -0,0 +1,194 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+import django
+import itertools
+import json
+import platform
+import subprocess
+from chat_service import vocabulary
+from telemetry_service import caching
+from telemetry_service.benchmarks import scratch_transaction, bench_user, api_client, timed
+from telemetry_service.ingest import Reading, ingest_readings
+from telemetry_service.models import Device
+
+DEVICES = [
+    ("fridge", "Fridge", 0.012),
+    ("ac", "AC", 0.2),
+    ("tv", "TV", 0.05),
+    ("washer", "Washing Machine", 0.1),
+    ("router", "Router", 0.005),
+]
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+class Command(BaseCommand):
+    help = "End-to-end API benchmark (ingest, device list, summary, graphs, listing, chat) with JSON output"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1440,10080", help="Comma-separated readings per device")
+        parser.add_argument("--repeat", type=int, default=20, help="Timed runs per case")
+        parser.add_argument("--warmup", type=int, default=2, help="Untimed runs per case")
+        parser.add_argument("--batch", type=int, default=1000, help="Readings per bulk-ingest request")
+        parser.add_argument("--only", help="Comma-separated case names to run")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+        parser.add_argument("--output", help="Also write the JSON report to this file")
+        parser.add_argument("--compare", help="Previous JSON report to compare p50 latencies against")
+        parser.add_argument("--threshold", type=float, default=1.2,
+                            help="p50 ratio above which --compare flags a regression")
+
+    def handle(self, *args, **opts):
+        sizes = [int(s) for s in opts["sizes"].split(",")]
+        only = set(opts["only"].split(",")) if opts["only"] else None
+        results = []
+        for size in sizes:
+            with scratch_transaction():
+                results += self.run_size(size, opts, only)
+
+        report = {
+            "meta": {
+                "revision": _git_revision(),
+                "created": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "repeat": opts["repeat"],
+            },
+            "results": results,
+        }
+        if opts["output"]:
+            with open(opts["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+        if opts["json"]:
+            self.stdout.write(json.dumps(report))
+        else:
+            for row in results:
+                self.stdout.write(
+                    f"{row['size']:>7} {row['case']:<22} p50 {row['p50_ms']:>8.2f} ms  p95 {row['p95_ms']:>8.2f} ms  "
+                    f"{row['rps']:>8.1f} req/s  {row['queries']:>3} queries"
+                )
+        if opts["compare"]:
+            self.compare(opts["compare"], results, opts["threshold"])
+
+    def run_size(self, size, opts, only):
+        user = bench_user(f"bench-{size}")
+        devices = [Device.objects.create(user=user, name=name, slug=slug) for slug, name, _ in DEVICES]
+        end = timezone.now().replace(second=0, microsecond=0)
+        readings = [
+            Reading(device.id, end - timedelta(minutes=i), kwh)
+            for device, (_, _, kwh) in zip(devices, DEVICES)
+            for i in range(size)
+        ]
+        for i in range(0, len(readings), 10000):
+            ingest_readings(readings[i:i + 10000])
+
+        client = api_client(user)
+        fridge = devices[0]
+
+        def cold():
+            # forget only this run's entries: the cache alias may be a shared one serving production
+            caching.forget([d.id for d in devices])
+            vocabulary.forget(user.id)
+
+        # fresh, non-overlapping timestamps for the write cases
+        minutes = itertools.count(size + 1)
+
+        def post_single():
+            ts = end - timedelta(minutes=next(minutes))
+            res = client.post(reverse("device-telemetry", args=[fridge.id]),
+                              {"timestamp": ts.isoformat(), "energy_kwh": 0.01}, format="json")
+            assert res.status_code == 201, res.content
+
+        def post_bulk():
+            rows = [
+                {"device": devices[i % len(devices)].id,
+                 "timestamp": (end - timedelta(minutes=next(minutes))).isoformat(), "energy_kwh": 0.01}
+                for i in range(opts["batch"])
+            ]
+            res = client.post(reverse("device-bulk-telemetry"), {"readings": rows}, format="json")
+            assert res.status_code == 201, res.content
+
+        def get(name, *args, query=""):
+            url = reverse(name, args=args) + query
+
+            def call():
+                res = client.get(url)
+                assert res.status_code == 200, res.content
+            return call
+
+        def chat(question):
+            def call():
+                res = client.post(reverse("chat_query"), {"question": question}, format="json")
+                assert res.status_code == 200, res.content
+            return call
+
+        graph = f"?month={end:%B}&year={end.year}"
+
+        # (name, fn, setup, readings per call); reads run before writes so they see a fixed dataset
+        cases = [
+            ("device_list", get("device-list"), None, 0),
+            ("summary", get("device-summary", fridge.id), None, 0),
+            ("summary_cold", get("device-summary", fridge.id), cold, 0),
+            ("monthly_graph", get("device-monthly-graph", fridge.id, query=graph), None, 0),
+            ("monthly_graph_cold", get("device-monthly-graph", fridge.id, query=graph), cold, 0),
+            ("telemetry_list", get("device-telemetry", fridge.id), None, 0),
+            ("telemetry_page", get("device-telemetry", fridge.id, query="?page_size=1000"), None, 0),
+            ("telemetry_columns", get("device-telemetry", fridge.id, query="?layout=columns"), None, 0),
+            ("chat_total_usage", chat("How much energy did my fridge use today?"), None, 0),
+            ("chat_total_usage_cold", chat("How much energy did my fridge use today?"), cold, 0),
+            ("chat_top_devices", chat("Which of my devices are using the most power today?"), None, 0),
+            ("chat_top_devices_cold", chat("Which of my devices are using the most power today?"), cold, 0),
+            ("ingest_single", post_single, None, 1),
+            ("ingest_bulk", post_bulk, None, opts["batch"]),
+        ]
+        if only:
+            unknown = only - {name for name, *_ in cases}
+            if unknown:
+                raise CommandError(f"Unknown case(s): {', '.join(sorted(unknown))}.")
+
+        results = []
+        for name, fn, setup, per_call in cases:
+            if only and name not in only:
+                continue
+            for _ in range(opts["warmup"]):
+                if setup:
+                    setup()
+                fn()
+            stats = timed(fn, opts["repeat"], setup=setup)
+            if setup:
+                setup()
+            with CaptureQueriesContext(connection) as ctx:
+                fn()
+            row = {"size": size, "case": name, **stats, "queries": len(ctx.captured_queries)}
+            row["rps"] = round(1000 / stats["mean_ms"], 1) if stats["mean_ms"] else None
+            if per_call:
+                row["readings_per_s"] = round(per_call * 1000 / stats["mean_ms"], 1)
+            results.append(row)
+        return results
+
+    def compare(self, path, results, threshold):
+        with open(path) as fh:
+            baseline = {(r["size"], r["case"]): r for r in json.load(fh)["results"]}
+        regressions = 0
+        for row in results:
+            old = baseline.get((row["size"], row["case"]))
+            if not old or not old["p50_ms"]:
+                continue
+            ratio = row["p50_ms"] / old["p50_ms"]
+            flag = ratio > threshold
+            regressions += flag
+            line = (f"{row['size']:>7} {row['case']:<22} p50 {old['p50_ms']:>8.2f} -> {row['p50_ms']:>8.2f} ms "
+                    f"({ratio:.2f}x)  queries {old['queries']} -> {row['queries']}")
+            self.stdout.write(self.style.ERROR(line) if flag else line)
+        if regressions:
+            self.stdout.write(self.style.WARNING(f"{regressions} case(s) slower than {threshold}x baseline."))
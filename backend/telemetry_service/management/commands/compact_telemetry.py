@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from datetime import timedelta
+from telemetry_service.models import Device, Telemetry
+from telemetry_service import retention
+from telemetry_service.rollups import floor_to
+
+
+class Command(BaseCommand):
+    help = "Downsample old raw telemetry according to TELEMETRY_RETENTION (one transaction per device-day)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--raw-days", type=int, help="Override RAW_DAYS")
+        parser.add_argument("--medium-days", type=int, help="Override MEDIUM_DAYS")
+        parser.add_argument("--medium-resolution", choices=["15min", "hour"], help="Override MEDIUM_RESOLUTION")
+        parser.add_argument("--lookback-days", type=int, default=7,
+                            help="Only revisit this many days behind each tier boundary (run daily)")
+        parser.add_argument("--full", action="store_true", help="Scan from each device's oldest reading")
+        parser.add_argument("--device", type=int, action="append", help="Device id (repeatable); default all")
+
+    def handle(self, *args, **opts):
+        try:
+            conf = retention.policy(
+                RAW_DAYS=opts["raw_days"],
+                MEDIUM_DAYS=opts["medium_days"],
+                MEDIUM_RESOLUTION=opts["medium_resolution"],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        devices = Device.objects.order_by("id")
+        if opts["device"]:
+            devices = devices.filter(id__in=opts["device"])
+
+        removed = written = 0
+        for device_id in devices.values_list("id", flat=True).iterator():
+            oldest = None
+            if opts["full"]:
+                oldest = Telemetry.objects.filter(device_id=device_id).aggregate(t=Min("timestamp"))["t"]
+                if oldest is None:
+                    continue
+                oldest = floor_to(oldest, "day")
+            for start, end, step in retention.tiers(timezone.now(), conf):
+                day = oldest if opts["full"] else end - timedelta(days=opts["lookback_days"])
+                if start is not None:
+                    day = max(day, start)
+                while day < end:
+                    r, w = retention.compact_day(device_id, day, step)
+                    removed += r
+                    written += w
+                    day += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Compacted {removed} rows into {written}."))
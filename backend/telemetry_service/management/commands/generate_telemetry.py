@@ -1,9 +1,15 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections
 from django.utils import timezone
-from datetime import timedelta
-import random
+from datetime import timedelta, timezone as dt_timezone
+import io
+import multiprocessing
+import time
+import numpy as np
 from telemetry_service.models import Device, Telemetry
+from telemetry_service import caching, partitions, rollups, stats
 
 User = get_user_model()
 
@@ -15,56 +21,166 @@ DEVICES = [
     ("router", "Router"),
 ]
 
+
+def profile(kind, minute_of_day):
+    """Vectorized per-minute kWh baseline for a device kind."""
+    hour = minute_of_day // 60
+    if kind == "fridge":  # ~0.72 kWh/day
+        return np.full(minute_of_day.shape, 0.012)
+    if kind == "ac":  # higher during day
+        return np.where((hour >= 10) & (hour <= 22), 0.2, 0.05)
+    if kind == "tv":
+        return np.where((hour >= 18) & (hour <= 23), 0.05, 0.01)
+    if kind == "washer":
+        return np.where((hour == 8) & (minute_of_day % 60 < 45), 0.5, 0.0)
+    if kind == "router":
+        return np.full(minute_of_day.shape, 0.005)
+    return np.full(minute_of_day.shape, 0.01)
+
+
+def series_for(kind, grid, resolution, rng):
+    """kWh per interval for one device over the time grid."""
+    minute_of_day = (grid.astype("datetime64[m]").astype(np.int64)) % 1440
+    base = profile(kind, minute_of_day) * resolution
+    jitter = rng.uniform(-0.003, 0.003, size=grid.shape) * resolution
+    return np.round(np.maximum(base + jitter, 0.0), 5)
+
+
+def _copy_rows(device_id, stamps, values):
+    """Stream one device's rows into Telemetry with COPY FROM STDIN."""
+    buf = io.StringIO()
+    buf.write("".join(f"{device_id},{ts},{v}\n" for ts, v in zip(stamps, values.tolist())))
+    buf.seek(0)
+    table = connection.ops.quote_name(Telemetry._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {table} (device_id, "timestamp", energy_kwh) FROM STDIN WITH (FORMAT csv)', buf)
+
+
+def _bulk_rows(device_id, grid, values, batch_size):
+    stamps = [ts.replace(tzinfo=dt_timezone.utc) for ts in grid.astype("datetime64[us]").tolist()]
+    for i in range(0, len(stamps), batch_size):
+        Telemetry.objects.bulk_create(
+            [
+                Telemetry(device_id=device_id, timestamp=ts, energy_kwh=v)
+                for ts, v in zip(stamps[i:i + batch_size], values[i:i + batch_size].tolist())
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def load_devices(job):
+    """Worker entry point: generate, load and roll up a list of (device_id, kind)."""
+    devices, start, end, resolution, method, batch_size, seed = job
+    grid = np.arange(
+        np.datetime64(start.replace(tzinfo=None), "m"),
+        np.datetime64(end.replace(tzinfo=None), "m"),
+        np.timedelta64(resolution, "m"),
+    )
+    stamps = np.datetime_as_string(grid, unit="m").tolist() if method == "copy" else None
+    rng = np.random.default_rng(seed)
+    rows = 0
+    for device_id, kind in devices:
+        values = series_for(kind, grid, resolution, rng)
+        Telemetry.objects.filter(device_id=device_id, timestamp__gte=start, timestamp__lt=end).delete()
+        if method == "copy":
+            _copy_rows(device_id, [f"{s}:00+00" for s in stamps], values)
+        else:
+            _bulk_rows(device_id, grid, values, batch_size)
+        # the loader bypasses ingest, so rebuild the device's rollups and stats for the window
+        rollups.rebuild(device_id, start, end)
+        stats.rebuild(device_id, start, end)
+        caching.invalidate_device(device_id)
+        rows += len(values)
+    return rows
+
+
+def _pool_worker(job):
+    try:
+        return load_devices(job)
+    finally:
+        connection.close()
+
+
 class Command(BaseCommand):
-    help = "Generate 24 hours of 1-min interval telemetry for 5 devices"
+    help = "Generate synthetic per-device telemetry for load testing (NumPy + COPY/bulk_create)"
 
     def add_arguments(self, parser):
-        parser.add_argument("--username", default="admin", help="User to attach devices/telemetry to")
+        parser.add_argument("--username", default="admin", help="User (or username prefix with --users > 1)")
+        parser.add_argument("--users", type=int, default=1, help="Number of users to create")
+        parser.add_argument("--devices-per-user", type=int, default=len(DEVICES))
+        parser.add_argument("--days", type=float, default=1, help="Days of history ending now")
+        parser.add_argument("--resolution", type=int, default=1, help="Minutes between readings")
+        parser.add_argument("--workers", type=int, default=1, help="Parallel loader processes")
+        parser.add_argument("--method", choices=["auto", "copy", "bulk"], default="auto",
+                            help="COPY (PostgreSQL) or bulk_create; auto picks COPY when available")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per bulk_create batch")
+        parser.add_argument("--seed", type=int, default=None)
 
     def handle(self, *args, **opts):
-        username = opts["username"]
-        user, _ = User.objects.get_or_create(username=username, defaults={"email": f"{username}@example.com"})
-        user.set_password("Pass@123")
-        user.save()
-
-        # Create devices if missing
-        devices = []
-        for slug, name in DEVICES:
-            d, _ = Device.objects.get_or_create(user=user, slug=slug, defaults={"name": name})
-            devices.append(d)
-
-        # Generate last 24 hours (UTC)
+        if opts["users"] < 1 or opts["devices_per_user"] < 1 or opts["resolution"] < 1 or opts["days"] <= 0:
+            raise CommandError("--users, --devices-per-user, --resolution and --days must be positive.")
+        method = opts["method"]
+        if method == "auto":
+            method = "copy" if connection.vendor == "postgresql" else "bulk"
+        if method == "copy" and connection.vendor != "postgresql":
+            raise CommandError("--method copy requires PostgreSQL.")
+
+        devices = self.create_devices(opts)
         end = timezone.now().replace(second=0, microsecond=0)
-        start = end - timedelta(hours=24)
-
-        # Delete overlapping telemetry for clean demo
-        Telemetry.objects.filter(device__in=devices, timestamp__gte=start, timestamp__lte=end).delete()
-
-        # per-minute rows
-        cur = start
-        rows = []
-        while cur < end:
-            for d in devices:
-                # simple profiles
-                base = {
-                    "fridge": 0.012,   # ~0.72 kWh/day
-                    "ac": 0.2 if 10 <= cur.hour <= 22 else 0.05,  # higher during day
-                    "tv": 0.05 if 18 <= cur.hour <= 23 else 0.01,
-                    "washer": 0.5 if (cur.hour == 8 and cur.minute < 45) else 0.0,
-                    "router": 0.005,
-                }.get(d.slug, 0.01)
-                jitter = random.uniform(-0.003, 0.003)
-                kwh = max(base + jitter, 0.0)
-                rows.append(Telemetry(device=d, timestamp=cur, energy_kwh=round(kwh, 5)))
-            cur += timedelta(minutes=1)
-
-            # bulk insert in chunks to save memory
-            if len(rows) >= 5000:
-                Telemetry.objects.bulk_create(rows, ignore_conflicts=True)
-                rows = []
-
-        if rows:
-            Telemetry.objects.bulk_create(rows, ignore_conflicts=True) 
-
-        self.stdout.write(self.style.SUCCESS("Generated telemetry for last 24 hours."))
-        self.stdout.write(self.style.SUCCESS("Login with username='admin', password='Pass@123'"))
+        start = end - timedelta(days=opts["days"])
+        if partitions.is_partitioned():
+            partitions.ensure_partitions(start.date(), end.date())
+
+        workers = max(1, min(opts["workers"], len(devices)))
+        seed = opts["seed"] if opts["seed"] is not None else int(time.time())
+        jobs = [
+            (devices[i::workers], start, end, opts["resolution"], method, opts["batch_size"], seed + i)
+            for i in range(workers)
+        ]
+
+        t0 = time.perf_counter()
+        if workers == 1:
+            rows = load_devices(jobs[0])
+        else:
+            connections.close_all()  # children must not share the parent's socket
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                rows = sum(pool.map(_pool_worker, jobs))
+        elapsed = time.perf_counter() - t0
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {rows:,} readings for {len(devices)} devices in {elapsed:.1f}s "
+            f"({rows / elapsed:,.0f} rows/s, {method}, {workers} worker(s))."
+        ))
+        login = opts["username"] if opts["users"] == 1 else f"{opts['username']}-0000"
+        self.stdout.write(self.style.SUCCESS(f"Login with username='{login}', password='Pass@123'"))
+
+    def create_devices(self, opts):
+        """Create (or reuse) users and devices; returns [(device_id, kind), ...]."""
+        password = make_password("Pass@123")  # hash once, not per user
+        names = [opts["username"]] if opts["users"] == 1 else [
+            f"{opts['username']}-{i:04d}" for i in range(opts["users"])
+        ]
+        existing = set(User.objects.filter(username__in=names).values_list("username", flat=True))
+        User.objects.bulk_create([
+            User(username=name, email=f"{name}@example.com", password=password)
+            for name in names if name not in existing
+        ])
+        User.objects.filter(username__in=existing).update(password=password)
+        users = list(User.objects.filter(username__in=names).order_by("id"))
+
+        wanted = []
+        for user in users:
+            for i in range(opts["devices_per_user"]):
+                slug, name = DEVICES[i % len(DEVICES)]
+                suffix = i // len(DEVICES)
+                wanted.append(Device(
+                    user=user,
+                    slug=f"{slug}-{suffix + 1}" if suffix else slug,
+                    name=f"{name} {suffix + 1}" if suffix else name,
+                ))
+        Device.objects.bulk_create(wanted, ignore_conflicts=True)
+        kinds = {slug for slug, _ in DEVICES}
+        return [
+            (device_id, slug.rsplit("-", 1)[0] if slug not in kinds else slug)
+            for device_id, slug in Device.objects.filter(user__in=users).order_by("id").values_list("id", "slug")
+        ]
@@ -0,0 +1,267 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import connection, connections, transaction
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from telemetry_service.models import Device, Telemetry
+from telemetry_service import caching, partitions, rollups, stats
+
+User = get_user_model()
+
+STAGING = "telemetry_import_staging"
+DEVICE_KEYS = ("device", "device_id")
+KWH_KEYS = ("energy_kwh", "kwh")
+COUNTERS = ("read", "rejected", "duplicates", "unknown_device", "inserted", "updated", "skipped")
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="")
+    return open(path, newline="")
+
+
+def _format(path, forced):
+    if forced:
+        return forced
+    name = path[:-3] if path.endswith(".gz") else path
+    return "ndjson" if name.endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+
+def _records(fh, fmt):
+    """Yield raw dicts from a CSV (with header) or NDJSON stream, one at a time."""
+    if fmt == "csv":
+        yield from csv.DictReader(fh)
+    else:
+        for line in fh:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+def _first(record, keys):
+    for key in keys:
+        if record.get(key) not in (None, ""):
+            return record[key]
+    return None
+
+
+def _rows(records, resolve_device, counts):
+    """CSV lines for COPY: ``device_id,timestamp,energy_kwh``; bad records are counted and skipped."""
+    for record in records:
+        counts["read"] += 1
+        try:
+            device_id = resolve_device(_first(record, DEVICE_KEYS))
+            ts = datetime.fromisoformat(str(record["timestamp"]).strip())
+            kwh = float(_first(record, KWH_KEYS))
+        except (TypeError, KeyError, ValueError, AttributeError):
+            counts["rejected"] += 1
+            continue
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=dt_timezone.utc)
+        yield f"{device_id},{ts.isoformat()},{kwh!r}\n"
+
+
+class _CopyStream:
+    """File-like view of a line iterator for ``copy_expert``; stops after ``limit`` lines."""
+
+    def __init__(self, lines, limit):
+        self.lines = islice(lines, limit)
+        self.count = 0
+
+    def read(self, size=-1):
+        out, length = [], 0
+        for line in self.lines:
+            out.append(line)
+            length += len(line)
+            self.count += 1
+            if 0 < size <= length:
+                break
+        return "".join(out)
+
+
+def _device_resolver(user_id, default_device):
+    slugs = {}
+    if user_id is not None:
+        slugs = dict(Device.objects.filter(user_id=user_id).values_list("slug", "id"))
+
+    def resolve(value):
+        if value is None:
+            if default_device is None:
+                raise ValueError("no device")
+            return default_device
+        value = str(value).strip()
+        return int(value) if value.isdigit() else slugs[value]
+    return resolve
+
+
+def _merge(cursor, on_conflict, user_id):
+    """Move the staged chunk into Telemetry; returns counts and per-device time ranges."""
+    table = connection.ops.quote_name(Telemetry._meta.db_table)
+    devices = connection.ops.quote_name(Device._meta.db_table)
+    counts = {}
+    # repeated readings: the first one wins when skipping, the last one when updating,
+    # matching what happens to duplicates that land in different chunks
+    keep = ">" if on_conflict == "update" else "<"
+    cursor.execute(
+        f'DELETE FROM {STAGING} s USING {STAGING} other '
+        f'WHERE other.device_id = s.device_id AND other."timestamp" = s."timestamp" AND other.seq {keep} s.seq'
+    )
+    counts["duplicates"] = cursor.rowcount
+    owner = "AND d.user_id = %s" if user_id is not None else ""
+    cursor.execute(
+        f"DELETE FROM {STAGING} s WHERE NOT EXISTS (SELECT 1 FROM {devices} d WHERE d.id = s.device_id {owner})",
+        [user_id] if user_id is not None else [],
+    )
+    counts["unknown_device"] = cursor.rowcount
+
+    cursor.execute(f'SELECT device_id, min("timestamp"), max("timestamp"), count(*) FROM {STAGING} GROUP BY device_id')
+    rows = cursor.fetchall()
+    ranges = {device_id: (lo, hi) for device_id, lo, hi, _ in rows}
+    staged = sum(n for *_, n in rows)
+    if ranges and partitions.is_partitioned():
+        partitions.ensure_partitions(
+            min(lo for lo, _ in ranges.values()).date(), max(hi for _, hi in ranges.values()).date(),
+        )
+
+    counts["updated"] = 0
+    if on_conflict == "update":
+        # compacted rows hold a whole bucket's energy: add the reading instead of replacing it
+        cursor.execute(
+            f'UPDATE {table} t SET energy_kwh = CASE WHEN t.compacted THEN t.energy_kwh + s.energy_kwh '
+            f'ELSE s.energy_kwh END FROM {STAGING} s '
+            f'WHERE t.device_id = s.device_id AND t."timestamp" = s."timestamp" '
+            f'AND (t.compacted OR t.energy_kwh IS DISTINCT FROM s.energy_kwh)'
+        )
+        counts["updated"] = cursor.rowcount
+    cursor.execute(
+        f'INSERT INTO {table} (device_id, "timestamp", energy_kwh) '
+        f'SELECT device_id, "timestamp", energy_kwh FROM {STAGING} ON CONFLICT (device_id, "timestamp") DO NOTHING'
+    )
+    counts["inserted"] = cursor.rowcount
+    counts["skipped"] = staged - counts["inserted"] - counts["updated"]
+    return counts, ranges
+
+
+def import_file(job):
+    """Worker entry point: stream one file through the staging table in chunks."""
+    path, fmt, default_device, user_id, on_conflict, chunk_rows = job
+    counts = dict.fromkeys(COUNTERS, 0)
+    ranges = {}
+    t0 = time.perf_counter()
+    resolve = _device_resolver(user_id, default_device)
+    with _open(path) as fh, connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS {STAGING} '
+            f'(seq bigserial, device_id bigint, "timestamp" timestamptz, energy_kwh double precision)'
+        )
+        lines = _rows(_records(fh, fmt), resolve, counts)
+        while True:
+            with transaction.atomic():
+                cursor.execute(f"TRUNCATE {STAGING}")
+                stream = _CopyStream(lines, chunk_rows)
+                cursor.copy_expert(
+                    f'COPY {STAGING} (device_id, "timestamp", energy_kwh) FROM STDIN WITH (FORMAT csv)', stream,
+                )
+                if not stream.count:
+                    break
+                chunk_counts, chunk_ranges = _merge(cursor, on_conflict, user_id)
+            for key, value in chunk_counts.items():
+                counts[key] += value
+            for device_id, (lo, hi) in chunk_ranges.items():
+                old = ranges.get(device_id, (lo, hi))
+                ranges[device_id] = (min(old[0], lo), max(old[1], hi))
+        cursor.execute(f"DROP TABLE IF EXISTS {STAGING}")
+
+    # COPY bypasses ingest, so rebuild the touched rollups and stats and drop cached windows
+    for device_id, (lo, hi) in ranges.items():
+        rollups.rebuild(device_id, lo, hi + timedelta(hours=1))
+        stats.rebuild(device_id, lo, hi + timedelta(hours=1))
+        caching.invalidate_device(device_id)
+    return {"file": path, **counts, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def _pool_worker(job):
+    try:
+        return import_file(job)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Import historical telemetry from CSV/NDJSON files (optionally gzipped) with PostgreSQL COPY"
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", help="CSV (with header) or NDJSON files; .gz is decompressed")
+        parser.add_argument("--format", choices=["csv", "ndjson"], help="Override detection by extension")
+        parser.add_argument("--device", type=int, help="Device id for rows without a device column")
+        parser.add_argument("--user", help="Only import into this user's devices; device columns may use slugs")
+        parser.add_argument("--on-conflict", choices=["skip", "update"], default="skip",
+                            help="Keep (skip) or overwrite (update) readings that already exist")
+        parser.add_argument("--workers", type=int, default=1, help="Files imported in parallel")
+        parser.add_argument("--chunk-rows", type=int, default=100000, help="Rows staged per transaction")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+
+    def handle(self, *args, **opts):
+        if connection.vendor != "postgresql":
+            raise CommandError("import_telemetry uses COPY and requires PostgreSQL.")
+        for path in opts["files"]:
+            if not os.path.isfile(path):
+                raise CommandError(f"No such file: {path}")
+        user_id = None
+        if opts["user"]:
+            user_id = User.objects.filter(username=opts["user"]).values_list("id", flat=True).first()
+            if user_id is None:
+                raise CommandError(f"Unknown user '{opts['user']}'.")
+        if opts["device"] is not None and not Device.objects.filter(
+            id=opts["device"], **({"user_id": user_id} if user_id else {})
+        ).exists():
+            raise CommandError(f"Unknown device {opts['device']}.")
+
+        jobs = [
+            (path, _format(path, opts["format"]), opts["device"], user_id, opts["on_conflict"], opts["chunk_rows"])
+            for path in opts["files"]
+        ]
+        workers = max(1, min(opts["workers"], len(jobs)))
+        t0 = time.perf_counter()
+        if workers == 1:
+            results = [import_file(job) for job in jobs]
+        else:
+            connections.close_all()  # children must not share the parent's socket
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                results = []
+                for result in pool.imap_unordered(_pool_worker, jobs):
+                    results.append(result)
+                    if not opts["json"]:
+                        self.write_result(result)
+        elapsed = time.perf_counter() - t0
+
+        totals = {key: sum(r[key] for r in results) for key in COUNTERS}
+        totals.update(seconds=round(elapsed, 3), rows_per_s=round(totals["read"] / elapsed, 1) if elapsed else 0.0)
+        if opts["json"]:
+            self.stdout.write(json.dumps({"files": results, "total": totals, "workers": workers}))
+            return
+        if workers == 1:
+            for result in results:
+                self.write_result(result)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['inserted']:,} new and {totals['updated']:,} updated readings from "
+            f"{totals['read']:,} rows in {elapsed:.1f}s ({totals['rows_per_s']:,.0f} rows/s, {workers} worker(s)); "
+            f"{totals['skipped']:,} already present, {totals['duplicates']:,} duplicates, "
+            f"{totals['rejected'] + totals['unknown_device']:,} rejected."
+        ))
+
+    def write_result(self, result):
+        rate = result["read"] / result["seconds"] if result["seconds"] else 0.0
+        self.stdout.write(
+            f"{result['file']}: {result['read']:,} rows, {result['inserted']:,} inserted, "
+            f"{result['updated']:,} updated, {result['skipped']:,} skipped, "
+            f"{result['rejected'] + result['unknown_device']:,} rejected ({rate:,.0f} rows/s)"
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from telemetry_service import partitions
+
+
+class Command(BaseCommand):
+    help = "Create upcoming monthly telemetry partitions and drop expired ones (PostgreSQL)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=3, help="Months to pre-create beyond the current one")
+        parser.add_argument("--retain-months", type=int, help="Drop partitions older than this many whole months")
+        parser.add_argument("--list", action="store_true", help="Only list attached partitions")
+
+    def handle(self, *args, **opts):
+        if not partitions.is_partitioned():
+            raise CommandError("Telemetry is not partitioned (PostgreSQL with migration 0003 required).")
+
+        if opts["list"]:
+            for month, name in partitions.list_partitions():
+                self.stdout.write(f"{month:%Y-%m}  {name}")
+            return
+
+        this_month = partitions.month_start(timezone.now().date())
+        created = partitions.ensure_partitions(this_month, partitions.add_months(this_month, opts["ahead"]))
+        for name in created:
+            self.stdout.write(f"created {name}")
+
+        if opts["retain_months"] is not None:
+            if opts["retain_months"] < 1:
+                raise CommandError("--retain-months must be at least 1.")
+            cutoff = partitions.add_months(this_month, -opts["retain_months"])
+            for name in partitions.drop_partitions_before(cutoff):
+                self.stdout.write(f"dropped {name}")
+
+        self.stdout.write(self.style.SUCCESS("Partitions up to date."))
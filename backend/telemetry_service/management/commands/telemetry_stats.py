@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from telemetry_service.models import Device
+from telemetry_service import stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-device reading statistics, or check them against a full recompute"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--device", type=int, action="append", help="Device id (repeatable); default all devices")
+        parser.add_argument("--rebuild", action="store_true", help="Recompute daily and lifetime stats from readings")
+        parser.add_argument("--check", action="store_true",
+                            help="Compare stored stats with a full recompute; exits non-zero on differences")
+        parser.add_argument("--limit", type=int, default=20, help="Differences to print per device with --check")
+
+    def handle(self, *args, **opts):
+        if not (opts["rebuild"] or opts["check"]):
+            raise CommandError("Pass --rebuild and/or --check.")
+        devices = Device.objects.order_by("id")
+        if opts["device"]:
+            devices = devices.filter(id__in=opts["device"])
+
+        count = bad = 0
+        for device_id in devices.values_list("id", flat=True).iterator():
+            count += 1
+            if opts["rebuild"]:
+                stats.rebuild(device_id)
+            if opts["check"]:
+                found = stats.check(device_id)
+                bad += bool(found)
+                for diff in found[:opts["limit"]]:
+                    where = diff["scope"] if diff["bucket"] is None else f"{diff['scope']} {diff['bucket']:%Y-%m-%d}"
+                    self.stdout.write(f"device {device_id} {where} {diff['field']}: "
+                                      f"stored {diff['stored']!r}, expected {diff['expected']!r}")
+        if bad:
+            raise CommandError(f"Stats differ from a full recompute for {bad} of {count} device(s).")
+        verb = "Rebuilt" if opts["rebuild"] else "Checked"
+        self.stdout.write(self.style.SUCCESS(f"{verb} stats for {count} device(s)."))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+import json
+from telemetry_service import storage
+
+
+def _mb(n):
+    return f"{n / 2**20:,.1f} MB"
+
+
+class Command(BaseCommand):
+    help = "Report Telemetry storage size and switch between the standard and compact layouts (PostgreSQL)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--layout", choices=storage.LAYOUTS, help="Switch to this layout")
+        parser.add_argument("--measure", action="store_true",
+                            help="Also time representative queries (before and after a switch)")
+        parser.add_argument("--device", type=int, help="Device id for the per-device query (default: any)")
+        parser.add_argument("--pages-per-range", type=int, default=32, help="BRIN pages_per_range")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+
+    def handle(self, *args, **opts):
+        if connection.vendor != "postgresql":
+            raise CommandError("telemetry_storage requires PostgreSQL.")
+
+        report = {"before": self.snapshot(opts)}
+        if opts["layout"]:
+            storage.apply_layout(opts["layout"], pages_per_range=opts["pages_per_range"])
+            report["after"] = self.snapshot(opts)
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(report))
+            return
+        for stage, snap in report.items():
+            self.write_snapshot(stage if len(report) > 1 else "current", snap)
+        if "after" in report:
+            before, after = report["before"]["sizes"], report["after"]["sizes"]
+            saved = before["heap_bytes"] + before["index_bytes"] - after["heap_bytes"] - after["index_bytes"]
+            self.stdout.write(self.style.SUCCESS(
+                f"Switched to the {report['after']['layout']} layout; total size changed by {_mb(-saved)}."
+            ))
+
+    def snapshot(self, opts):
+        snap = {"layout": storage.layout(), "sizes": storage.sizes()}
+        if opts["measure"]:
+            snap["queries"] = storage.measure(device_id=opts["device"])
+        return snap
+
+    def write_snapshot(self, stage, snap):
+        sizes = snap["sizes"]
+        self.stdout.write(
+            f"{stage}: {snap['layout']} layout, ~{sizes['rows']:,} rows, heap {_mb(sizes['heap_bytes'])}, "
+            f"indexes {_mb(sizes['index_bytes'])}, {sizes['bytes_per_row'] or 0:,.1f} bytes/row"
+        )
+        for name, size in sorted(sizes["indexes"].items()):
+            self.stdout.write(f"  {name}: {_mb(size)}")
+        for name, result in snap.get("queries", {}).items():
+            self.stdout.write(f"  {name}: {result['ms']:.3f} ms ({', '.join(result['scans'])})")
@@ -0,0 +1,65 @@
+# Generated by Django 5.2 on 2026-10-18 17:08
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+
+
+def backfill_rollups(apps, schema_editor):
+    Telemetry = apps.get_model('telemetry_service', 'Telemetry')
+    Hourly = apps.get_model('telemetry_service', 'TelemetryHourly')
+    Daily = apps.get_model('telemetry_service', 'TelemetryDaily')
+    utc = datetime.timezone.utc
+    for model, trunc in ((Hourly, TruncHour), (Daily, TruncDay)):
+        rows = (Telemetry.objects.annotate(b=trunc('timestamp', tzinfo=utc))
+                .values('device_id', 'b').order_by()
+                .annotate(total=Sum('energy_kwh'), n=Count('id')))
+        batch = []
+        for r in rows.iterator(chunk_size=1000):
+            batch.append(model(device_id=r['device_id'], bucket=r['b'], total_kwh=r['total'], readings=r['n']))
+            if len(batch) >= 1000:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry_service', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelemetryDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('total_kwh', models.FloatField(default=0.0)),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily', to='telemetry_service.device')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'constraints': [models.UniqueConstraint(fields=('device', 'bucket'), name='telemetry_daily_device_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TelemetryHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('total_kwh', models.FloatField(default=0.0)),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly', to='telemetry_service.device')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'constraints': [models.UniqueConstraint(fields=('device', 'bucket'), name='telemetry_hourly_device_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
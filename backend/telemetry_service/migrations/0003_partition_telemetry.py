@@ -0,0 +1,107 @@
+"""
+Convert telemetry_service_telemetry into a monthly RANGE-partitioned table.
+
+PostgreSQL only; other backends keep the plain table. The primary key
+becomes (id, timestamp) because PostgreSQL requires the partition key in
+every unique constraint; Django still treats ``id`` as the primary key.
+Index and constraint names are preserved so later schema migrations can
+find them.
+"""
+from datetime import date
+
+from django.db import migrations
+
+TABLE = 'telemetry_service_telemetry'
+MONTHS_AHEAD = 3
+
+
+def _add_months(d, n):
+    months = d.year * 12 + d.month - 1 + n
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def _definitions(cursor, table):
+    """Return (index defs, foreign key defs, primary key name) for ``table``."""
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [table])
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'f')", [table])
+    constraints = cursor.fetchall()
+    pkey = next(name for name, kind, _ in constraints if kind == 'p')
+    fkeys = [(name, definition) for name, kind, definition in constraints if kind == 'f']
+    return [(name, d) for name, d in indexes if name != pkey], fkeys, pkey
+
+
+def _rebuild(schema_editor, partitioned):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    qn = schema_editor.connection.ops.quote_name
+    new = f'{TABLE}_new'
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {qn(TABLE)} IN ACCESS EXCLUSIVE MODE')
+        indexes, fkeys, pkey = _definitions(cursor, TABLE)
+        cursor.execute(f'SELECT min("timestamp"), max("timestamp") FROM {qn(TABLE)}')
+        lo, hi = cursor.fetchone()
+
+        columns = (
+            'id bigint GENERATED BY DEFAULT AS IDENTITY, '
+            '"timestamp" timestamp with time zone NOT NULL, '
+            'energy_kwh double precision NOT NULL, '
+            'device_id bigint NOT NULL'
+        )
+        if partitioned:
+            cursor.execute(f'CREATE TABLE {qn(new)} ({columns}) PARTITION BY RANGE ("timestamp")')
+            today = date.today()
+            month = date(lo.year, lo.month, 1) if lo else date(today.year, today.month, 1)
+            newest = max(hi.date(), today) if hi else today
+            last = _add_months(date(newest.year, newest.month, 1), MONTHS_AHEAD)
+            while month <= last:
+                upper = _add_months(month, 1)
+                cursor.execute(
+                    f'CREATE TABLE {qn(f"{TABLE}_p{month.year:04d}{month.month:02d}")} '
+                    f"PARTITION OF {qn(new)} FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+                )
+                month = upper
+            cursor.execute(f'CREATE TABLE {qn(f"{TABLE}_default")} PARTITION OF {qn(new)} DEFAULT')
+        else:
+            cursor.execute(f'CREATE TABLE {qn(new)} ({columns})')
+
+        cursor.execute(
+            f'INSERT INTO {qn(new)} (id, "timestamp", energy_kwh, device_id) OVERRIDING SYSTEM VALUE '
+            f'SELECT id, "timestamp", energy_kwh, device_id FROM {qn(TABLE)}'
+        )
+        cursor.execute(f'DROP TABLE {qn(TABLE)}')
+        cursor.execute(f'ALTER TABLE {qn(new)} RENAME TO {qn(TABLE)}')
+        cursor.execute(f'ALTER SEQUENCE {qn(f"{new}_id_seq")} RENAME TO {qn(f"{TABLE}_id_seq")}')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT max(id) FROM {qn(TABLE)}), 0) + 1, false)",
+            [TABLE],
+        )
+
+        key = '(id, "timestamp")' if partitioned else '(id)'
+        cursor.execute(f'ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(pkey)} PRIMARY KEY {key}')
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in fkeys:
+            cursor.execute(f'ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(name)} {definition}')
+
+
+def partition(apps, schema_editor):
+    _rebuild(schema_editor, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    _rebuild(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry_service', '0002_telemetry_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,84 @@
+"""
+Make (device, timestamp) unique on Telemetry.
+
+Existing duplicates are removed first, a batch of devices per transaction,
+keeping the earliest row (lowest id) of each group; the hourly and daily
+rollups of every affected device-day are then recomputed, since each
+duplicate had been counted in them. The unique constraint's index then
+replaces the plain (device, timestamp) index. On the partitioned table the
+constraint is valid because it includes the partition key.
+
+The migration is not atomic so each batch commits on its own; re-running it
+after an interruption simply continues.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, Exists, OuterRef, Sum
+from django.db.models.functions import TruncDay, TruncHour
+
+UTC = dt_timezone.utc
+DEVICES_PER_BATCH = 200
+DELETE_CHUNK = 5000
+
+
+def _rebuild_day(apps, alias, device_id, day):
+    Telemetry = apps.get_model('telemetry_service', 'Telemetry')
+    end = day + timedelta(days=1)
+    raw = Telemetry.objects.using(alias).filter(device_id=device_id, timestamp__gte=day, timestamp__lt=end)
+    for name, trunc in (('TelemetryHourly', TruncHour), ('TelemetryDaily', TruncDay)):
+        model = apps.get_model('telemetry_service', name)
+        model.objects.using(alias).filter(device_id=device_id, bucket__gte=day, bucket__lt=end).delete()
+        rows = (raw.annotate(b=trunc('timestamp', tzinfo=UTC)).values('b').order_by()
+                .annotate(total=Sum('energy_kwh'), n=Count('id')))
+        model.objects.using(alias).bulk_create(
+            [model(device_id=device_id, bucket=r['b'], total_kwh=r['total'], readings=r['n']) for r in rows]
+        )
+
+
+def dedupe(apps, schema_editor):
+    Device = apps.get_model('telemetry_service', 'Device')
+    Telemetry = apps.get_model('telemetry_service', 'Telemetry')
+    alias = schema_editor.connection.alias
+    ids = list(Device.objects.using(alias).order_by('id').values_list('id', flat=True))
+    for i in range(0, len(ids), DEVICES_PER_BATCH):
+        batch = ids[i:i + DEVICES_PER_BATCH]
+        earlier = Telemetry.objects.filter(
+            device_id=OuterRef('device_id'), timestamp=OuterRef('timestamp'), id__lt=OuterRef('id'),
+        )
+        with transaction.atomic(using=alias):
+            dupes = list(
+                Telemetry.objects.using(alias)
+                .filter(device_id__gte=batch[0], device_id__lte=batch[-1])
+                .filter(Exists(earlier))
+                .values_list('id', 'device_id', 'timestamp')
+            )
+            if not dupes:
+                continue
+            for j in range(0, len(dupes), DELETE_CHUNK):
+                chunk = [pk for pk, _, _ in dupes[j:j + DELETE_CHUNK]]
+                Telemetry.objects.using(alias).filter(id__in=chunk).delete()
+            days = {(device_id, ts.astimezone(UTC).replace(hour=0, minute=0, second=0, microsecond=0))
+                    for _, device_id, ts in dupes}
+            for device_id, day in sorted(days):
+                _rebuild_day(apps, alias, device_id, day)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('telemetry_service', '0003_partition_telemetry'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='telemetry',
+            constraint=models.UniqueConstraint(fields=('device', 'timestamp'), name='telemetry_device_timestamp'),
+        ),
+        migrations.RemoveIndex(
+            model_name='telemetry',
+            name='telemetry_s_device__59b376_idx',
+        ),
+    ]
@@ -0,0 +1,50 @@
+"""
+Drop the single-column device_id and timestamp indexes on Telemetry.
+
+The unique (device, timestamp) index from 0004 leads with device_id, so it
+serves every device lookup (including cascade deletes), and nothing scans
+raw telemetry by time alone. Only the indexes are dropped: letting Django
+alter the ForeignKey would also drop and re-add the constraint, which
+revalidates every row.
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+
+INDEXES = [
+    'telemetry_service_telemetry_device_id_6cb5c975',
+    'telemetry_service_telemetry_timestamp_31e354fd',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry_service', '0004_telemetry_device_timestamp_unique'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    [f'DROP INDEX IF EXISTS "{name}"' for name in INDEXES],
+                    [
+                        f'CREATE INDEX IF NOT EXISTS "{INDEXES[0]}" ON "telemetry_service_telemetry" ("device_id")',
+                        f'CREATE INDEX IF NOT EXISTS "{INDEXES[1]}" ON "telemetry_service_telemetry" ("timestamp")',
+                    ],
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='telemetry',
+                    name='device',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                                            related_name='telemetry', to='telemetry_service.device'),
+                ),
+                migrations.AlterField(
+                    model_name='telemetry',
+                    name='timestamp',
+                    field=models.DateTimeField(),
+                ),
+            ],
+        ),
+    ]
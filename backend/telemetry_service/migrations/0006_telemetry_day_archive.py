@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 17:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry_service', '0005_telemetry_drop_redundant_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelemetryDayArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('total_kwh', models.FloatField(default=0.0)),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('values', models.BinaryField()),
+                ('compressed', models.BooleanField(default=False)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='telemetry_service.device')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'constraints': [models.UniqueConstraint(fields=('device', 'bucket'), name='telemetry_archive_device_bucket')],
+            },
+        ),
+    ]
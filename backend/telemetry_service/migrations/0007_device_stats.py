@@ -0,0 +1,135 @@
+# Generated by Django 5.2 on 2026-10-18 18:13
+
+import datetime
+import heapq
+import zlib
+
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+
+MINUTE_SECONDS = 60
+
+
+def _readings(Telemetry, Archive, device_id):
+    """(timestamp, kwh) of one device, raw and archived, oldest first; raw wins a shared minute."""
+    raw = (Telemetry.objects.filter(device_id=device_id).order_by('timestamp')
+           .values_list('timestamp', 'energy_kwh').iterator(chunk_size=5000))
+
+    def archived():
+        for row in Archive.objects.filter(device_id=device_id).order_by('bucket').iterator(chunk_size=31):
+            data = bytes(row.values)
+            values = np.frombuffer(zlib.decompress(data) if row.compressed else data, dtype='<f4')
+            for slot in np.flatnonzero(~np.isnan(values)):
+                yield row.bucket + datetime.timedelta(seconds=int(slot) * MINUTE_SECONDS), 1, float(values[slot])
+
+    last = None
+    for ts, archived_row, kwh in heapq.merge(((ts, 0, kwh) for ts, kwh in raw), archived()):
+        if archived_row and ts == last:
+            continue
+        last = ts
+        yield ts, kwh
+
+
+def _merge(a, b):
+    n = a['readings'] + b['readings']
+    delta = b['mean_kwh'] - a['mean_kwh']
+    peak = b if b['max_kwh'] > a['max_kwh'] else a
+    return {
+        'readings': n, 'total_kwh': a['total_kwh'] + b['total_kwh'],
+        'mean_kwh': a['mean_kwh'] + delta * b['readings'] / n,
+        'm2': a['m2'] + b['m2'] + delta * delta * a['readings'] * b['readings'] / n,
+        'min_kwh': min(a['min_kwh'], b['min_kwh']), 'max_kwh': peak['max_kwh'], 'peak_at': peak['peak_at'],
+        'last_at': b['last_at'], 'last_kwh': b['last_kwh'],
+    }
+
+
+def backfill_stats(apps, schema_editor):
+    Device = apps.get_model('telemetry_service', 'Device')
+    Telemetry = apps.get_model('telemetry_service', 'Telemetry')
+    Archive = apps.get_model('telemetry_service', 'TelemetryDayArchive')
+    Stats = apps.get_model('telemetry_service', 'DeviceStats')
+    DailyStats = apps.get_model('telemetry_service', 'DeviceDailyStats')
+    utc = datetime.timezone.utc
+    for device_id in Device.objects.order_by('id').values_list('id', flat=True).iterator():
+        days, day, cur = [], None, None
+        for ts, kwh in _readings(Telemetry, Archive, device_id):
+            bucket = ts.astimezone(utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            if bucket != day:
+                if cur:
+                    days.append(DailyStats(device_id=device_id, bucket=day, **cur))
+                day = bucket
+                cur = {'readings': 0, 'total_kwh': 0.0, 'mean_kwh': 0.0, 'm2': 0.0,
+                       'min_kwh': kwh, 'max_kwh': kwh, 'peak_at': ts}
+            # Welford's update
+            cur['readings'] += 1
+            delta = kwh - cur['mean_kwh']
+            cur['mean_kwh'] += delta / cur['readings']
+            cur['m2'] += delta * (kwh - cur['mean_kwh'])
+            cur['total_kwh'] += kwh
+            cur['min_kwh'] = min(cur['min_kwh'], kwh)
+            if kwh > cur['max_kwh']:
+                cur['max_kwh'], cur['peak_at'] = kwh, ts
+            cur['last_at'], cur['last_kwh'] = ts, kwh
+        if cur:
+            days.append(DailyStats(device_id=device_id, bucket=day, **cur))
+        if not days:
+            continue
+        DailyStats.objects.bulk_create(days, batch_size=1000)
+        fields = ('readings', 'total_kwh', 'mean_kwh', 'm2', 'min_kwh', 'max_kwh', 'peak_at', 'last_at', 'last_kwh')
+        total = None
+        for row in days:
+            stats = {f: getattr(row, f) for f in fields}
+            total = stats if total is None else _merge(total, stats)
+        Stats.objects.create(device_id=device_id, **total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry_service', '0006_telemetry_day_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('readings', models.PositiveBigIntegerField(default=0)),
+                ('total_kwh', models.FloatField(default=0.0)),
+                ('mean_kwh', models.FloatField(default=0.0)),
+                ('m2', models.FloatField(default=0.0)),
+                ('min_kwh', models.FloatField()),
+                ('max_kwh', models.FloatField()),
+                ('peak_at', models.DateTimeField()),
+                ('last_at', models.DateTimeField()),
+                ('last_kwh', models.FloatField()),
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='telemetry_service.device')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DeviceDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('readings', models.PositiveBigIntegerField(default=0)),
+                ('total_kwh', models.FloatField(default=0.0)),
+                ('mean_kwh', models.FloatField(default=0.0)),
+                ('m2', models.FloatField(default=0.0)),
+                ('min_kwh', models.FloatField()),
+                ('max_kwh', models.FloatField()),
+                ('peak_at', models.DateTimeField()),
+                ('last_at', models.DateTimeField()),
+                ('last_kwh', models.FloatField()),
+                ('bucket', models.DateTimeField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='telemetry_service.device')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'constraints': [models.UniqueConstraint(fields=('device', 'bucket'), name='telemetry_daily_stats_device_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
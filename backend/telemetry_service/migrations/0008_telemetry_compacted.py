@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry_service', '0007_device_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telemetry',
+            name='compacted',
+            field=models.BooleanField(db_default=False, default=False),
+        ),
+    ]
@@ -13,12 +13,96 @@ class Device(models.Model):
         return f"{self.name} ({self.user.username})"
 
 class Telemetry(models.Model):
-    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="telemetry")
-    timestamp = models.DateTimeField(db_index=True)
+    # no single-column indexes: the unique (device, timestamp) index serves device
+    # lookups, and time-only scans are pruned by partition (see storage.py for BRIN)
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="telemetry", db_index=False)
+    timestamp = models.DateTimeField()
     energy_kwh = models.FloatField()
+    # set on the rows retention compaction writes: they hold a whole bucket's energy,
+    # so a late reading at the bucket start is added to them instead of replacing them
+    compacted = models.BooleanField(default=False, db_default=False)
 
     class Meta:
-        indexes = [
-            models.Index(fields=["device", "timestamp"]),
+        # one reading per device and instant; its index also serves (device, timestamp) range scans
+        constraints = [
+            models.UniqueConstraint(fields=["device", "timestamp"], name="telemetry_device_timestamp"),
         ]
         ordering = ["-timestamp"]
+
+
+class TelemetryHourly(models.Model):
+    """Per-device energy total for one UTC hour, maintained on ingest (see rollups.py)."""
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="hourly")
+    bucket = models.DateTimeField()
+    total_kwh = models.FloatField(default=0.0)
+    readings = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["device", "bucket"], name="telemetry_hourly_device_bucket"),
+        ]
+        ordering = ["bucket"]
+
+
+class TelemetryDaily(models.Model):
+    """Per-device energy total for one UTC day, maintained from TelemetryHourly."""
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="daily")
+    bucket = models.DateTimeField()
+    total_kwh = models.FloatField(default=0.0)
+    readings = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["device", "bucket"], name="telemetry_daily_device_bucket"),
+        ]
+        ordering = ["bucket"]
+
+
+class TelemetryDayArchive(models.Model):
+    """One archived device-day: per-minute float32 readings packed into ``values`` (see archive.py)."""
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="archive")
+    bucket = models.DateTimeField()
+    total_kwh = models.FloatField(default=0.0)
+    readings = models.PositiveIntegerField(default=0)
+    values = models.BinaryField()
+    compressed = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["device", "bucket"], name="telemetry_archive_device_bucket"),
+        ]
+        ordering = ["bucket"]
+
+
+class ReadingStats(models.Model):
+    """Running statistics over a device's readings, maintained on ingest (see stats.py)."""
+    readings = models.PositiveBigIntegerField(default=0)
+    total_kwh = models.FloatField(default=0.0)
+    mean_kwh = models.FloatField(default=0.0)
+    # Welford's sum of squared deviations from the mean; variance is m2 / readings
+    m2 = models.FloatField(default=0.0)
+    min_kwh = models.FloatField()
+    max_kwh = models.FloatField()
+    peak_at = models.DateTimeField()
+    last_at = models.DateTimeField()
+    last_kwh = models.FloatField()
+
+    class Meta:
+        abstract = True
+
+
+class DeviceStats(ReadingStats):
+    """Lifetime reading statistics for one device."""
+    device = models.OneToOneField(Device, on_delete=models.CASCADE, related_name="stats")
+
+
+class DeviceDailyStats(ReadingStats):
+    """Reading statistics for one device and UTC day."""
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="daily_stats")
+    bucket = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["device", "bucket"], name="telemetry_daily_stats_device_bucket"),
+        ]
+        ordering = ["bucket"]
@@ -0,0 +1,80 @@
+import base64
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+
+class TelemetryKeysetPagination:
+    """
+    Keyset pagination over (timestamp, id), newest first.
+
+    Unlike offset pagination every page is an index range scan on
+    (device, timestamp), so deep pages cost the same as the first one.
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    @staticmethod
+    def params(request):
+        # DRF requests expose query_params; plain (async) Django requests only GET
+        return getattr(request, "query_params", request.GET)
+
+    def get_page_size(self, request):
+        try:
+            size = int(self.params(request).get(self.page_size_query_param, settings.TELEMETRY_PAGE_SIZE))
+        except ValueError:
+            size = settings.TELEMETRY_PAGE_SIZE
+        return max(1, min(size, settings.TELEMETRY_MAX_PAGE_SIZE))
+
+    def encode_cursor(self, timestamp, pk):
+        raw = f"{timestamp.isoformat()}|{pk}".encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            ts, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            timestamp, pk = parse_datetime(ts), int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, pk
+
+    def get_cursor(self, request):
+        """The decoded (timestamp, id) cursor of the request, or None on the first page."""
+        cursor = self.params(request).get(self.cursor_query_param)
+        return self.decode_cursor(cursor) if cursor else None
+
+    def page_queryset(self, queryset, request):
+        """The queryset slice for the requested page, plus one row to detect a next page."""
+        size = self.get_page_size(request)
+        cursor = self.get_cursor(request)
+        queryset = queryset.order_by("-timestamp", "-id")
+        if cursor:
+            timestamp, pk = cursor
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+        return queryset[:size + 1]
+
+    def paginate_queryset(self, queryset, request, key=lambda row: (row.timestamp, row.id)):
+        """
+        Return (rows, next_url); ``next_url`` is None on the last page.
+        ``key`` maps a fetched row to its (timestamp, id) pair.
+        """
+        return self.finish_page(list(self.page_queryset(queryset, request)), request, key)
+
+    async def apaginate_queryset(self, queryset, request, key=lambda row: (row.timestamp, row.id)):
+        rows = [row async for row in self.page_queryset(queryset, request)]
+        return self.finish_page(rows, request, key)
+
+    def finish_page(self, rows, request, key):
+        size = self.get_page_size(request)
+        if len(rows) <= size:
+            return rows, None
+        rows = rows[:size]
+        url = request.build_absolute_uri()
+        next_url = replace_query_param(url, self.cursor_query_param, self.encode_cursor(*key(rows[-1])))
+        return rows, next_url
@@ -0,0 +1,152 @@
+"""
+Monthly range partitions of the Telemetry table (PostgreSQL only).
+
+Migration 0003 turns ``telemetry_service_telemetry`` into a table
+partitioned by RANGE ("timestamp") with one child per calendar month named
+``<table>_pYYYYMM`` plus a ``<table>_default`` catch-all. These helpers keep
+future partitions ahead of ingest and make retention a partition drop.
+
+Dropping a month bypasses ingest, so the hourly/daily rollups, reading
+statistics and cached windows of the devices it held are rebuilt in the
+same transaction; afterwards they describe only what is still stored (raw
+rows plus archived days), as ``rollups.rebuild`` and ``stats.check`` expect.
+"""
+import re
+from datetime import date, datetime
+
+from django.db import connection, transaction
+
+from .models import Telemetry
+from . import caching, rollups, stats
+
+TABLE = Telemetry._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_RE = re.compile(rf"^{re.escape(TABLE)}_p(\d{{4}})(\d{{2}})$")
+
+
+def month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def add_months(d, n):
+    months = d.year * 12 + d.month - 1 + n
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month.year:04d}{month.month:02d}"
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)",
+            [TABLE],
+        )
+        return cursor.fetchone()[0]
+
+
+def list_partitions():
+    """Return [(month, name), ...] of attached monthly partitions, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    months = []
+    for name in names:
+        m = PARTITION_RE.match(name)
+        if m:
+            months.append((date(int(m.group(1)), int(m.group(2)), 1), name))
+    return sorted(months)
+
+
+def create_partition(month):
+    """
+    Create the partition for ``month`` if it is missing. Rows that already
+    landed in the default partition for that month are moved into it.
+    Returns True if a partition was created.
+    """
+    month = month_start(month)
+    name = partition_name(month)
+    lo, hi = month.isoformat(), add_months(month, 1).isoformat()
+    qn = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if cursor.fetchone()[0]:
+            return False
+        # concurrent creators (e.g. parallel imports) lock the parent and the
+        # default partition in different orders and deadlock; take turns
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [TABLE])
+        # to_regclass reads the catalog cache, which can miss a partition the
+        # lock holder just committed; pg_tables uses a fresh snapshot
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = current_schema() AND tablename = %s)",
+                       [name])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {qn(DEFAULT_PARTITION)} "
+            f"WHERE \"timestamp\" >= %s::timestamptz AND \"timestamp\" < %s::timestamptz)",
+            [lo, hi],
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                f"CREATE TABLE {qn(name)} PARTITION OF {qn(TABLE)} "
+                f"FOR VALUES FROM ('{lo}') TO ('{hi}')"
+            )
+            return True
+        # Stray rows in the default partition would make the new range
+        # overlap it, so build the child standalone, move them, then attach.
+        cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {qn(DEFAULT_PARTITION)} "
+            f"WHERE \"timestamp\" >= %s::timestamptz AND \"timestamp\" < %s::timestamptz RETURNING *) "
+            f"INSERT INTO {qn(name)} SELECT * FROM moved",
+            [lo, hi],
+        )
+        cursor.execute(
+            f"ALTER TABLE {qn(TABLE)} ATTACH PARTITION {qn(name)} "
+            f"FOR VALUES FROM ('{lo}') TO ('{hi}')"
+        )
+    return True
+
+
+def ensure_partitions(first, last):
+    """Create every missing monthly partition from ``first`` to ``last`` inclusive."""
+    created = []
+    month, last = month_start(first), month_start(last)
+    while month <= last:
+        if create_partition(month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def drop_partitions_before(cutoff):
+    """
+    Detach and drop whole months that end on or before ``cutoff``'s month
+    start, rebuilding the rollups and stats of the devices they held over
+    that month and invalidating their cached windows.
+    """
+    cutoff = month_start(cutoff)
+    qn = connection.ops.quote_name
+    dropped = []
+    for month, name in list_partitions():
+        if add_months(month, 1) > cutoff:
+            break
+        lo, hi = (datetime(m.year, m.month, 1, tzinfo=rollups.UTC) for m in (month, add_months(month, 1)))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT device_id FROM {qn(name)}")
+            device_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"ALTER TABLE {qn(TABLE)} DETACH PARTITION {qn(name)}")
+            cursor.execute(f"DROP TABLE {qn(name)}")
+            for device_id in device_ids:
+                rollups.rebuild(device_id, lo, hi)
+                stats.rebuild(device_id, lo, hi)
+            caching.invalidate([(device_id, lo) for device_id in device_ids])
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .ingest import Reading
+from .models import Telemetry
+from .signals import telemetry_ingested
+from . import caching, live, rollups, stats
+
+
+@receiver(post_save, sender=Telemetry)
+def telemetry_saved(sender, instance, created, raw=False, **kwargs):
+    """Route single-row saves (API POST, admin, shell) through the ingest signal."""
+    if created and not raw:
+        telemetry_ingested.send(
+            sender=Telemetry,
+            readings=[Reading(instance.device_id, instance.timestamp, instance.energy_kwh)],
+        )
+
+
+@receiver(telemetry_ingested)
+def update_rollups(sender, readings, replaced=(), **kwargs):
+    rollups.apply_readings(readings, replaced)
+
+
+@receiver(telemetry_ingested)
+def update_stats(sender, readings, replaced=(), **kwargs):
+    stats.apply_readings(readings, replaced)
+
+
+@receiver(telemetry_ingested)
+def invalidate_cached_windows(sender, readings, **kwargs):
+    caching.invalidate((r.device_id, r.timestamp) for r in readings)
+
+
+@receiver(telemetry_ingested)
+def publish_live_readings(sender, readings, replaced=(), **kwargs):
+    transaction.on_commit(lambda: live.publish_readings(readings, replaced))
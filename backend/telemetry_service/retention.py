@@ -0,0 +1,154 @@
+"""
+Retention tiers for raw telemetry, and archiving of cold device-days.
+
+Old per-minute readings are compacted in place: every bucket of the tier's
+resolution is replaced by a single Telemetry row at the bucket start that
+carries the bucket's summed energy, flagged ``compacted`` so that a late
+reading at that timestamp is added to it by ingest. Totals over windows aligned to the
+tier's resolution are therefore unchanged (an inclusive ``end`` exactly on
+a bucket start picks up that whole bucket), and the hourly/daily rollups,
+which compaction never touches, keep serving device totals, monthly_graph
+and chat series exactly.
+
+Past TELEMETRY_ARCHIVE["AFTER_DAYS"], ``archive_day`` moves a device-day's
+raw rows into one packed TelemetryDayArchive row (see archive.py);
+``restore_day`` turns it back into raw rows.
+
+Reading statistics (stats.py) describe the stored readings, so every day
+that is compacted, archived or restored has them recomputed.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import Telemetry, TelemetryDayArchive
+from . import archive, caching, stats
+from .rollups import as_utc, floor_to, rebuild
+
+RESOLUTIONS = {
+    "15min": timedelta(minutes=15),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+
+def policy(**overrides):
+    """Effective retention policy: settings.TELEMETRY_RETENTION plus overrides."""
+    conf = dict(settings.TELEMETRY_RETENTION)
+    conf.update({k: v for k, v in overrides.items() if v is not None})
+    if conf["MEDIUM_RESOLUTION"] not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution '{conf['MEDIUM_RESOLUTION']}'.")
+    if conf["MEDIUM_DAYS"] < conf["RAW_DAYS"]:
+        raise ValueError("MEDIUM_DAYS must be >= RAW_DAYS.")
+    return conf
+
+
+def tiers(now, conf):
+    """Return [(start, end, step), ...]: day-aligned windows and their resolution."""
+    today = floor_to(as_utc(now), "day")
+    raw_cutoff = today - timedelta(days=conf["RAW_DAYS"])
+    medium_cutoff = today - timedelta(days=conf["MEDIUM_DAYS"])
+    return [
+        (medium_cutoff, raw_cutoff, RESOLUTIONS[conf["MEDIUM_RESOLUTION"]]),
+        (None, medium_cutoff, RESOLUTIONS["day"]),
+    ]
+
+
+def compact_day(device_id, day, step):
+    """
+    Compact one device-day into ``step`` buckets in a single transaction.
+    Buckets that already hold one row at their start are left alone (only
+    flagged ``compacted``), so the operation is idempotent and late readings
+    are merged on the next run. Returns (rows_removed, rows_written).
+    """
+    with transaction.atomic():
+        qs = Telemetry.objects.filter(device_id=device_id, timestamp__gte=day, timestamp__lt=day + timedelta(days=1))
+        rows = qs.values_list("id", "timestamp", "energy_kwh", "compacted").order_by()
+        buckets = defaultdict(list)
+        for pk, ts, kwh, flag in rows:
+            offset = (as_utc(ts) - day) // step
+            buckets[day + offset * step].append((pk, ts, kwh, flag))
+
+        stale, fresh, unflagged = [], [], []
+        for bucket, members in buckets.items():
+            if len(members) == 1 and members[0][1] == bucket:
+                if not members[0][3]:
+                    unflagged.append(members[0][0])
+                continue
+            stale += [pk for pk, *_ in members]
+            fresh.append(Telemetry(device_id=device_id, timestamp=bucket, compacted=True,
+                                   energy_kwh=sum(kwh for _, _, kwh, _ in members)))
+        if unflagged:
+            qs.filter(id__in=unflagged).update(compacted=True)
+        if stale:
+            # delete first so a reading exactly at a bucket start is replaced, not duplicated
+            qs.filter(id__in=stale).delete()
+            Telemetry.objects.bulk_create(fresh)
+            # stats describe the stored readings, which are now one per bucket
+            stats.rebuild(device_id, day, day + timedelta(days=1))
+            caching.invalidate([(device_id, day)])
+    return len(stale), len(fresh)
+
+
+def archive_day(device_id, day):
+    """
+    Pack one device-day's raw rows into its archive row in a single
+    transaction and delete them. Raw rows for a day that is already archived
+    (late readings) replace the archived values of their minutes, and the
+    day's rollups are rebuilt from the result. Returns rows archived.
+    """
+    day = floor_to(as_utc(day), "day")
+    with transaction.atomic():
+        qs = Telemetry.objects.filter(device_id=device_id, timestamp__gte=day, timestamp__lt=day + timedelta(days=1))
+        rows = list(qs.values_list("timestamp", "energy_kwh").order_by())
+        if not rows:
+            return 0
+        slots = np.array([(as_utc(ts) - day) // archive.MINUTE for ts, _ in rows])
+        fresh = np.zeros(archive.SLOTS)
+        np.add.at(fresh, slots, [kwh for _, kwh in rows])
+        touched = np.zeros(archive.SLOTS, dtype=bool)
+        touched[slots] = True
+
+        existing = TelemetryDayArchive.objects.select_for_update().filter(device_id=device_id, bucket=day).first()
+        merged = existing is not None
+        if merged:
+            values = archive.decode(existing).astype(np.float64)
+            shadowed = touched & ~np.isnan(values)
+            total = existing.total_kwh - float(values[shadowed].sum()) + float(fresh.sum())
+            count = existing.readings - int(shadowed.sum()) + len(rows)
+            values[touched] = fresh[touched]
+        else:
+            values = np.where(touched, fresh, np.nan)
+            existing = TelemetryDayArchive(device_id=device_id, bucket=day)
+            total, count = float(fresh.sum()), len(rows)
+        existing.values, existing.compressed = archive.encode(values)
+        existing.total_kwh, existing.readings = total, count
+        existing.save()
+        qs.delete()
+        if merged:
+            # the late rows were added to the rollups on top of the values they replace
+            rebuild(device_id, day, day + timedelta(days=1))
+        # archived values are float32 minutes, so the day's stats follow them
+        stats.rebuild(device_id, day, day + timedelta(days=1))
+        caching.invalidate([(device_id, day)])
+    return len(rows)
+
+
+def restore_day(device_id, day):
+    """Turn an archived device-day back into raw rows; returns rows restored."""
+    day = floor_to(as_utc(day), "day")
+    with transaction.atomic():
+        row = TelemetryDayArchive.objects.select_for_update().filter(device_id=device_id, bucket=day).first()
+        if row is None:
+            return 0
+        readings = [Telemetry(device_id=device_id, timestamp=ts, energy_kwh=kwh) for ts, kwh in archive.readings(row)]
+        # raw rows that arrived after archiving are newer and win
+        Telemetry.objects.bulk_create(readings, batch_size=1000, ignore_conflicts=True)
+        row.delete()
+        rebuild(device_id, day, day + timedelta(days=1))
+        stats.rebuild(device_id, day, day + timedelta(days=1))
+        caching.invalidate([(device_id, day)])
+    return len(readings)
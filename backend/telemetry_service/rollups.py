@@ -0,0 +1,404 @@
+"""
+Hourly and daily per-device rollups of Telemetry.
+
+Rollups are maintained incrementally: every stored reading adds its energy
+to the hour and day bucket it falls in, so late and out-of-order readings
+land in the right place without re-scanning raw rows. Range reads use whole
+buckets from the rollup tables and only touch raw rows at partial edges,
+plus the archived readings of those edges once their days are archived
+(archive.py).
+"""
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from django.db.models import Count, DateTimeField, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import Telemetry, TelemetryDaily, TelemetryDayArchive, TelemetryHourly
+from . import archive
+
+UTC = dt_timezone.utc
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+UNITS = {"hour": (HOUR, TelemetryHourly, TruncHour), "day": (DAY, TelemetryDaily, TruncDay)}
+
+
+def as_utc(dt):
+    if dt is None:
+        return None
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, UTC)
+    return dt.astimezone(UTC)
+
+
+def floor_to(dt, unit):
+    dt = dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0) if unit == "day" else dt
+
+
+def ceil_to(dt, unit):
+    floor = floor_to(dt, unit)
+    return floor if floor == dt else floor + UNITS[unit][0]
+
+
+# --- Maintenance ----------------------------------------------------------
+
+def _bucket_deltas(readings, unit, replaced=()):
+    deltas = defaultdict(lambda: [0.0, 0])
+    for rows, sign in ((readings, 1), (replaced, -1)):
+        for r in rows:
+            key = (r.device_id, floor_to(as_utc(r.timestamp), unit))
+            deltas[key][0] += sign * r.energy_kwh
+            deltas[key][1] += sign
+    return deltas
+
+
+def _add_to_buckets(model, deltas, chunk_size=200):
+    """Add (kwh, count) deltas to rollup rows, creating missing buckets."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} (device_id, bucket, total_kwh, readings) VALUES {{values}} "
+        f"ON CONFLICT (device_id, bucket) DO UPDATE SET "
+        f"total_kwh = {table}.total_kwh + EXCLUDED.total_kwh, "
+        f"readings = {table}.readings + EXCLUDED.readings"
+    )
+    items = sorted(deltas.items())
+    with connection.cursor() as cursor:
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i:i + chunk_size]
+            params = []
+            for (device_id, bucket), (kwh, count) in chunk:
+                params += [device_id, bucket, kwh, count]
+            cursor.execute(sql.format(values=", ".join(["(%s, %s, %s, %s)"] * len(chunk))), params)
+
+
+def apply_readings(readings, replaced=()):
+    """
+    Fold newly stored readings into the hourly and daily rollups. Readings
+    that overwrote earlier values come with those in ``replaced``, which are
+    taken back out, so a correction adds new - old.
+    """
+    if not readings:
+        return
+    with transaction.atomic():
+        _add_to_buckets(TelemetryHourly, _bucket_deltas(readings, "hour", replaced))
+        _add_to_buckets(TelemetryDaily, _bucket_deltas(readings, "day", replaced))
+
+
+def rebuild(device_id, start=None, end=None, chunk=timedelta(days=31)):
+    """
+    Recompute rollups for one device from raw telemetry and archived days
+    over [start, end). Used by the backfill command and after bulk loads
+    that bypass ingest.
+    """
+    raw = Telemetry.objects.filter(device_id=device_id)
+    if start is None or end is None:
+        bounds = raw.order_by().aggregate(lo=Min("timestamp"), hi=Max("timestamp"))
+        days = TelemetryDayArchive.objects.filter(device_id=device_id).aggregate(lo=Min("bucket"), hi=Max("bucket"))
+        if days["lo"] is not None:
+            bounds["lo"] = min(filter(None, (bounds["lo"], days["lo"])))
+            bounds["hi"] = max(filter(None, (bounds["hi"], days["hi"] + DAY - HOUR)))
+        if bounds["lo"] is None:
+            for model in (TelemetryHourly, TelemetryDaily):
+                stale = model.objects.filter(device_id=device_id)
+                if start is not None:
+                    stale = stale.filter(bucket__gte=floor_to(as_utc(start), "day"))
+                if end is not None:
+                    stale = stale.filter(bucket__lt=ceil_to(as_utc(end), "day"))
+                stale.delete()
+            return
+        start = start or bounds["lo"]
+        end = end or bounds["hi"] + HOUR
+    start, end = floor_to(as_utc(start), "day"), ceil_to(as_utc(end), "day")
+
+    cur = start
+    while cur < end:
+        stop = min(cur + chunk, end)
+        with transaction.atomic():
+            for unit in ("hour", "day"):
+                _, model, trunc = UNITS[unit]
+                rows = (raw.filter(timestamp__gte=cur, timestamp__lt=stop)
+                        .annotate(b=trunc("timestamp", tzinfo=UTC))
+                        .values_list("b").order_by()
+                        .annotate(total=Sum("energy_kwh"), n=Count("id")))
+                buckets = archive.bucket_totals(device_id, cur, stop, unit)
+                for bucket, total, n in rows:
+                    kwh, count = buckets.get(bucket, (0.0, 0))
+                    buckets[bucket] = [kwh + total, count + n]
+                model.objects.filter(device_id=device_id, bucket__gte=cur, bucket__lt=stop).delete()
+                model.objects.bulk_create(
+                    [model(device_id=device_id, bucket=b, total_kwh=kwh, readings=n) for b, (kwh, n) in buckets.items()],
+                    batch_size=1000,
+                )
+        cur = stop
+
+
+# --- Range reads ----------------------------------------------------------
+
+def plan_range(start, end, include_end=True, coarsest="day"):
+    """
+    Split [start, end] into pieces answerable from each source, using
+    buckets no coarser than ``coarsest``.
+
+    Returns {"raw": [...], "hour": [...], "day": [...]} where every piece is
+    ``(lo, hi, hi_inclusive)``; ``None`` bounds are open-ended.
+    """
+    start, end = as_utc(start), as_utc(end)
+    pieces = {"raw": [], "hour": [], "day": []}
+    if start is not None and end is not None and start > end:
+        return pieces
+
+    h0 = ceil_to(start, "hour") if start is not None else None
+    h1 = floor_to(end, "hour") if end is not None else None
+    if h0 is not None and h1 is not None and h0 >= h1:
+        pieces["raw"].append((start, end, include_end))
+        return pieces
+    if start is not None and start < h0:
+        pieces["raw"].append((start, h0, False))
+    if end is not None and (end > h1 or include_end):
+        pieces["raw"].append((h1, end, include_end))
+
+    d0 = ceil_to(h0, "day") if h0 is not None else None
+    d1 = floor_to(h1, "day") if h1 is not None else None
+    if coarsest == "hour" or (d0 is not None and d1 is not None and d0 >= d1):
+        pieces["hour"].append((h0, h1, False))
+        return pieces
+    if h0 is not None and h0 < d0:
+        pieces["hour"].append((h0, d0, False))
+    pieces["day"].append((d0, d1, False))
+    if h1 is not None and d1 < h1:
+        pieces["hour"].append((d1, h1, False))
+    return pieces
+
+
+def _range_q(field, pieces):
+    q = Q()
+    for lo, hi, inclusive in pieces:
+        part = Q()
+        if lo is not None:
+            part &= Q(**{f"{field}__gte": lo})
+        if hi is not None:
+            part &= Q(**{f"{field}__lte" if inclusive else f"{field}__lt": hi})
+        q |= part
+    return q
+
+
+def _sources(devices, start, end, include_end, coarsest="day"):
+    """Yield (queryset, time field, energy field) for each non-empty piece."""
+    pieces = plan_range(start, end, include_end, coarsest)
+    if pieces["raw"]:
+        yield Telemetry.objects.filter(_range_q("timestamp", pieces["raw"]), device__in=devices), "timestamp", "energy_kwh"
+    for unit in ("hour", "day"):
+        if pieces[unit]:
+            model = UNITS[unit][1]
+            yield model.objects.filter(_range_q("bucket", pieces[unit]), device__in=devices), "bucket", "total_kwh"
+
+
+def _archived_pieces(start, end, include_end):
+    """The raw edge pieces of the window that can fall on archived days."""
+    return [p for p in plan_range(start, end, include_end)["raw"] if archive.overlaps(p[0])]
+
+
+def _archived(devices, start, end, include_end):
+    """[(device_id, timestamp, kwh), ...] of archived readings on the window's raw edges."""
+    pieces = _archived_pieces(start, end, include_end)
+    return archive.edge_readings(devices, pieces) if pieces else []
+
+
+def totals_by_device(devices, start=None, end=None, include_end=True):
+    """Return {device_id: total_kwh} for devices with any energy in the window."""
+    totals = defaultdict(float)
+    for qs, _, energy in _sources(devices, start, end, include_end):
+        for row in qs.values("device_id").order_by().annotate(total=Sum(energy)):
+            totals[row["device_id"]] += row["total"] or 0.0
+    for device_id, _, kwh in _archived(devices, start, end, include_end):
+        totals[device_id] += kwh
+    return dict(totals)
+
+
+def total_kwh(devices, start=None, end=None, include_end=True):
+    total = 0.0
+    for qs, _, energy in _sources(devices, start, end, include_end):
+        total += qs.order_by().aggregate(total=Sum(energy))["total"] or 0.0
+    return total + sum(kwh for _, _, kwh in _archived(devices, start, end, include_end))
+
+
+def series(devices, start=None, end=None, unit="hour", include_end=True):
+    """Return [(bucket_start, kwh), ...] for the window, grouped by hour or day."""
+    trunc = UNITS[unit][2]
+    buckets = defaultdict(float)
+    for qs, field, energy in _sources(devices, start, end, include_end, coarsest=unit):
+        if qs.model is UNITS[unit][1]:
+            rows = qs.values_list("bucket").order_by().annotate(total=Sum(energy))
+        else:
+            rows = (qs.annotate(b=trunc(field, tzinfo=UTC))
+                    .values_list("b").order_by()
+                    .annotate(total=Sum(energy)))
+        for bucket, kwh in rows:
+            buckets[bucket] += kwh or 0.0
+    for _, ts, kwh in _archived(devices, start, end, include_end):
+        buckets[floor_to(ts, unit)] += kwh
+    return sorted(buckets.items())
+
+
+def _grouped_query(devices, windows, unit, include_end):
+    parts = []
+    for w, (start, end) in enumerate(windows):
+        for qs, field, energy in _sources(devices, start, end, include_end, coarsest=unit or "day"):
+            if unit is None:
+                bucket = Value(None, output_field=DateTimeField())
+            elif qs.model is UNITS[unit][1]:
+                bucket = F("bucket")
+            else:
+                bucket = UNITS[unit][2](field, tzinfo=UTC)
+            parts.append(
+                qs.order_by().annotate(w=Value(w), dev=F("device_id"), b=bucket)
+                .values("w", "dev", "b").annotate(kwh=Sum(energy))
+                .values_list("w", "dev", "b", "kwh")
+            )
+    if not parts:
+        return None
+    return parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+
+
+def _fold(rows):
+    totals = defaultdict(float)
+    for w, device_id, bucket, kwh in rows:
+        totals[(w, device_id, bucket)] += kwh or 0.0
+    return dict(totals)
+
+
+def _archived_grouped(devices, windows, unit, include_end):
+    """``grouped`` rows for the archived readings on each window's raw edges."""
+    return [
+        (w, device_id, floor_to(ts, unit) if unit else None, kwh)
+        for w, (start, end) in enumerate(windows)
+        for device_id, ts, kwh in _archived(devices, start, end, include_end)
+    ]
+
+
+def grouped(devices, windows, unit=None, include_end=True):
+    """
+    Sum energy per (window index, device, bucket) for several windows in a
+    single round-trip: each source piece of each window becomes one grouped
+    SELECT and the pieces are combined with UNION ALL.
+
+    ``windows`` is a list of (start, end); ``unit`` is None (one total per
+    window and device), "hour" or "day". Returns {(w, device_id, bucket): kwh}
+    with ``bucket`` None when no unit is given.
+    """
+    query = _grouped_query(devices, windows, unit, include_end)
+    rows = list(query) if query is not None else []
+    return _fold(rows + _archived_grouped(devices, windows, unit, include_end))
+
+
+async def agrouped(devices, windows, unit=None, include_end=True):
+    """``grouped`` for async views, fetched through the async ORM."""
+    query = _grouped_query(devices, windows, unit, include_end)
+    rows = [row async for row in query] if query is not None else []
+    if any(_archived_pieces(start, end, include_end) for start, end in windows):
+        rows += await sync_to_async(_archived_grouped)(devices, windows, unit, include_end)
+    return _fold(rows)
+
+
+# --- Several windows in one scan ------------------------------------------
+
+def _covers(window, lo, hi):
+    start, end = window
+    return (start is None or (lo is not None and start <= lo)) and (end is None or (hi is not None and hi <= end))
+
+
+def _window_q(field, start, end):
+    q = Q()
+    if start is not None:
+        q &= Q(**{f"{field}__gte": start})
+    if end is not None:
+        q &= Q(**{f"{field}__lt": end})
+    return q
+
+
+def _split(windows, unit):
+    """
+    Source pieces for the union of half-open ``windows``, split at every
+    window edge so each rollup bucket lies wholly inside or outside each one.
+    """
+    edges = sorted({t for window in windows for t in window if t is not None})
+    edges = ([None] if any(s is None for s, _ in windows) else []) + edges
+    edges += [None] if any(e is None for _, e in windows) else []
+    pieces = {"raw": [], "hour": [], "day": []}
+    for lo, hi in zip(edges, edges[1:]):
+        if any(_covers(window, lo, hi) for window in windows):
+            for source, found in plan_range(lo, hi, include_end=False, coarsest=unit or "day").items():
+                pieces[source] += found
+    return pieces
+
+
+def _windowed_query(devices, windows, unit):
+    pieces = _split(windows, unit)
+    parts = []
+    for source in ("raw", "hour", "day"):
+        if not pieces[source]:
+            continue
+        model, field, energy = ((Telemetry, "timestamp", "energy_kwh") if source == "raw"
+                                else (UNITS[source][1], "bucket", "total_kwh"))
+        if unit is None:
+            bucket = Value(None, output_field=DateTimeField())
+        elif model is UNITS[unit][1]:
+            bucket = F("bucket")
+        else:
+            bucket = UNITS[unit][2](field, tzinfo=UTC)
+        sums = {}
+        for w, (start, end) in enumerate(windows):
+            q = _window_q(field, start, end)
+            sums[f"w{w}"] = Sum(energy, filter=q) if q else Sum(energy)
+        parts.append(
+            model.objects.filter(_range_q(field, pieces[source]), device__in=devices)
+            .order_by().annotate(dev=F("device_id"), b=bucket)
+            .values("dev", "b").annotate(**sums)
+            .values_list("dev", "b", *sums)
+        )
+    if not parts:
+        return None, pieces["raw"]
+    return (parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]), pieces["raw"]
+
+
+def _windowed_archived(devices, windows, unit, raw):
+    rows = []
+    pieces = [p for p in raw if archive.overlaps(p[0])]
+    for device_id, ts, kwh in archive.edge_readings(devices, pieces) if pieces else ():
+        rows.append((device_id, floor_to(ts, unit) if unit else None,
+                     *(kwh if (s is None or s <= ts) and (e is None or ts < e) else None for s, e in windows)))
+    return rows
+
+
+def _fold_windows(rows):
+    totals = defaultdict(float)
+    for device_id, bucket, *sums in rows:
+        for w, kwh in enumerate(sums):
+            if kwh is not None:
+                totals[(w, device_id, bucket)] += kwh
+    return dict(totals)
+
+
+def windowed(devices, windows, unit=None):
+    """
+    ``grouped`` for half-open [start, end) windows that may overlap (today,
+    this week, this month): every source is scanned once over the union of
+    the windows, split at their edges, and one conditional SUM per window
+    picks its rows. Returns {(w, device_id, bucket): kwh}.
+    """
+    query, raw = _windowed_query(devices, windows, unit)
+    rows = list(query) if query is not None else []
+    return _fold_windows(rows + _windowed_archived(devices, windows, unit, raw))
+
+
+async def awindowed(devices, windows, unit=None):
+    """``windowed`` for async views, fetched through the async ORM."""
+    query, raw = _windowed_query(devices, windows, unit)
+    rows = [row async for row in query] if query is not None else []
+    if any(archive.overlaps(p[0]) for p in raw):
+        rows += await sync_to_async(_windowed_archived)(devices, windows, unit, raw)
+    return _fold_windows(rows)
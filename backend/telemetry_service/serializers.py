@@ -1,15 +1,24 @@
 from rest_framework import serializers
 from .models import Device, Telemetry
-from django.db.models import Sum
+from . import rollups
 class DeviceSerializer(serializers.ModelSerializer):
     total_kwh = serializers.SerializerMethodField()
     class Meta:
         model = Device
         fields = ("id", "name", "slug", "total_kwh")
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get("include_total", True):
+            self.fields.pop("total_kwh")
+
     def get_total_kwh(self, obj):
-        # Aggregate total energy for the device
-        return round(obj.telemetry.aggregate(total=Sum("energy_kwh"))["total"] or 0.0, 4)
+        # Lists annotate the total in one query (DeviceViewSet.get_queryset);
+        # fall back to the daily rollups for freshly created instances.
+        total = getattr(obj, "total_kwh", None)
+        if total is None:
+            total = rollups.total_kwh([obj.pk])
+        return round(total or 0.0, 4)
 
 class TelemetrySerializer(serializers.ModelSerializer):
     device_name = serializers.CharField(source="device.name", read_only=True)
@@ -17,3 +26,27 @@ class TelemetrySerializer(serializers.ModelSerializer):
         model = Telemetry
         fields = ("id", "device", "timestamp", "energy_kwh", "device_name")
         read_only_fields = ("id",)
+        # writes are upserts (ingest_readings), so a repeated timestamp is not an error
+        validators = []
+
+
+# --- Fast read path -------------------------------------------------------
+# Telemetry GETs build responses straight from values_list tuples instead of
+# running TelemetrySerializer per row; the output keys match it exactly.
+
+TELEMETRY_VALUES = ("id", "timestamp", "energy_kwh")
+
+
+def telemetry_rows(values, device):
+    """[(id, timestamp, energy_kwh), ...] -> list of TelemetrySerializer-shaped dicts."""
+    device_id, device_name = device.id, device.name
+    return [
+        {"id": pk, "device": device_id, "timestamp": ts, "energy_kwh": kwh, "device_name": device_name}
+        for pk, ts, kwh in values
+    ]
+
+
+def telemetry_columns(values, device):
+    """Columnar layout: one array per field, device fields once."""
+    ids, timestamps, kwh = (list(col) for col in zip(*values)) if values else ([], [], [])
+    return {"device": device.id, "device_name": device.name, "ids": ids, "timestamps": timestamps, "kwh": kwh}
@@ -0,0 +1,167 @@
+"""
+Energy series over arbitrary buckets in the user's time zone (GET .../series/).
+
+Buckets are half-open [lo, hi) instants whose edges are wall-clock
+boundaries in an IANA zone: 15-minute and hourly buckets step in absolute
+time, days, ISO weeks (from Monday) and months step in local time, so a
+local day is 23 or 25 hours long across a DST change. The requested range
+is widened to whole buckets.
+
+On PostgreSQL one statement builds the bucket edges with generate_series,
+so empty buckets come back as zero, and sums the finest source that fits
+with sargable range predicates: the hourly rollups when every edge falls on
+a UTC hour, otherwise raw telemetry (15-minute buckets, or zones such as
+Asia/Kolkata whose midnight is not on a UTC hour). Other backends bucket
+the same edges in Python. Archived days (archive.py) are covered by the
+rollups; the raw path adds their readings separately.
+"""
+from bisect import bisect_right
+from datetime import timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Telemetry, TelemetryHourly
+from . import archive
+
+UTC = dt_timezone.utc
+# name -> (PostgreSQL interval, steps in local wall-clock time)
+GRANULARITIES = {
+    "15m": ("15 minutes", False),
+    "hour": ("1 hour", False),
+    "day": ("1 day", True),
+    "week": ("7 days", True),
+    "month": ("1 month", True),
+}
+
+
+def get_zone(name):
+    """ZoneInfo for an IANA name; raises ValueError for unknown names."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone '{name}'.")
+
+
+def _floor(local, granularity):
+    if granularity == "15m":
+        return local.replace(minute=local.minute - local.minute % 15, second=0, microsecond=0)
+    local = local.replace(minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return local
+    local = local.replace(hour=0)
+    if granularity == "week":
+        return local - timedelta(days=local.weekday())
+    return local.replace(day=1) if granularity == "month" else local
+
+
+def _step(local, granularity):
+    if granularity == "month":
+        months = local.year * 12 + local.month
+        return local.replace(year=months // 12, month=months % 12 + 1)
+    return local + (timedelta(days=7) if granularity == "week" else timedelta(days=1))
+
+
+def edges(start, end, granularity, zone):
+    """[(lo, hi), ...] UTC bucket edges covering [start, end) in ``zone``."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}'. Use one of: {', '.join(GRANULARITIES)}.")
+    limit = settings.TELEMETRY_SERIES_MAX_BUCKETS
+    out = []
+    if GRANULARITIES[granularity][1]:
+        local = _floor(start.astimezone(zone).replace(tzinfo=None), granularity)
+        lo = local.replace(tzinfo=zone).astimezone(UTC)
+        while lo < end:
+            local = _step(local, granularity)
+            hi = local.replace(tzinfo=zone).astimezone(UTC)
+            out.append((lo, hi))
+            lo = hi
+            if len(out) > limit:
+                break
+    else:
+        step = timedelta(minutes=15) if granularity == "15m" else timedelta(hours=1)
+        lo = _floor(start.astimezone(zone), granularity).astimezone(UTC)
+        count = -(-(end - lo) // step)
+        out = [(lo + i * step, lo + (i + 1) * step) for i in range(min(count, limit + 1))]
+    if len(out) > limit:
+        raise ValueError(f"At most {limit} buckets per request; narrow the range or use a coarser granularity.")
+    return out
+
+
+def _on_hours(bounds):
+    return all(t.minute == 0 and t.second == 0 and t.microsecond == 0 for lo, hi in bounds for t in (lo, hi))
+
+
+def _source(hourly):
+    if hourly:
+        return TelemetryHourly._meta.db_table, "bucket", "total_kwh"
+    return Telemetry._meta.db_table, '"timestamp"', "energy_kwh"
+
+
+def _sql_series(devices, bounds, granularity, zone, hourly):
+    qn = connection.ops.quote_name
+    table, ts, kwh = _source(hourly)
+    interval, calendar = GRANULARITIES[granularity]
+    first, last = bounds[0][0], bounds[-1][0]
+    if calendar:
+        # local wall-clock starts, converted with PostgreSQL's own zone rules
+        series = (
+            "SELECT b AT TIME ZONE %(tz)s AS lo, (b + %(step)s::interval) AT TIME ZONE %(tz)s AS hi "
+            "FROM generate_series(%(first)s::timestamp, %(last)s::timestamp, %(step)s::interval) AS b"
+        )
+        first = first.astimezone(zone).replace(tzinfo=None)
+        last = last.astimezone(zone).replace(tzinfo=None)
+    else:
+        series = (
+            "SELECT b AS lo, b + %(step)s::interval AS hi "
+            "FROM generate_series(%(first)s::timestamptz, %(last)s::timestamptz, %(step)s::interval) AS b"
+        )
+    sql = (
+        f"WITH buckets AS ({series}), "
+        f"src AS (SELECT {ts} AS ts, {kwh} AS kwh FROM {qn(table)} "
+        f"WHERE device_id = ANY(%(devices)s) AND {ts} >= %(lo)s AND {ts} < %(hi)s) "
+        f"SELECT buckets.lo, coalesce(sum(src.kwh), 0) FROM buckets "
+        f"LEFT JOIN src ON src.ts >= buckets.lo AND src.ts < buckets.hi "
+        f"GROUP BY buckets.lo ORDER BY buckets.lo"
+    )
+    params = {
+        "tz": zone.key, "step": interval, "first": first, "last": last,
+        "devices": list(devices), "lo": bounds[0][0], "hi": bounds[-1][1],
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [[lo, kwh] for lo, kwh in cursor.fetchall()]
+
+
+def _python_series(devices, bounds, hourly):
+    model = TelemetryHourly if hourly else Telemetry
+    field, energy = ("bucket", "total_kwh") if hourly else ("timestamp", "energy_kwh")
+    rows = model.objects.filter(**{
+        "device__in": devices, f"{field}__gte": bounds[0][0], f"{field}__lt": bounds[-1][1],
+    }).values_list(field, energy).order_by()
+    out = [[lo, 0.0] for lo, _ in bounds]
+    starts = [lo for lo, _ in bounds]
+    for ts, kwh in rows:
+        out[bisect_right(starts, ts) - 1][1] += kwh
+    return out
+
+
+def device_series(devices, start, end, granularity, zone):
+    """
+    Return [(bucket start in ``zone``, kwh), ...] for every bucket covering
+    [start, end), empty buckets included.
+    """
+    bounds = edges(start, end, granularity, zone)
+    if not bounds:
+        return []
+    hourly = granularity != "15m" and _on_hours(bounds)
+    if connection.vendor == "postgresql":
+        out = _sql_series(devices, bounds, granularity, zone, hourly)
+    else:
+        out = _python_series(devices, bounds, hourly)
+    if not hourly and archive.overlaps(bounds[0][0]):
+        starts = [lo for lo, _ in out]
+        for _, ts, kwh in archive.edge_readings(devices, [(bounds[0][0], bounds[-1][1], False)]):
+            out[bisect_right(starts, ts) - 1][1] += kwh
+    return [(lo.astimezone(zone), kwh) for lo, kwh in out]
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent inside the storing transaction after readings are written.
+# Arguments: readings (list of ingest.Reading that were inserted or changed)
+# and replaced (the previous values of the changed ones; often empty)
+telemetry_ingested = Signal()
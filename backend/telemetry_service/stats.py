@@ -0,0 +1,285 @@
+"""
+Per-device running statistics over readings, per UTC day and lifetime.
+
+DeviceDailyStats and DeviceStats hold count, sum, min/max (with the time
+of the peak), Welford mean and M2 (variance = M2 / count) and the latest
+reading, so "average reading", "peak minute", "last reading" and "is it
+drawing more than usual" are answered from one row instead of a scan.
+
+Each ingested batch is summarized per device-day and folded into both
+scopes with one upsert per table, whose ON CONFLICT clause merges the
+batch into the stored row with Chan's parallel form of Welford's update;
+concurrent writers therefore merge instead of overwriting each other.
+Corrections cannot be un-merged exactly (min and max are not reversible),
+so the days they touch are recomputed from raw and archived readings and
+the lifetime row is re-derived from the daily rows, which merge exactly.
+Bulk loads, compaction and archiving call ``rebuild`` like they do for
+the rollups; ``check`` compares stored rows against a full recompute.
+"""
+import math
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from .models import DeviceDailyStats, DeviceStats, Telemetry, TelemetryDayArchive
+from . import archive
+from .rollups import as_utc, ceil_to, floor_to
+
+FIELDS = ("readings", "total_kwh", "mean_kwh", "m2", "min_kwh", "max_kwh", "peak_at", "last_at", "last_kwh")
+Stats = namedtuple("Stats", FIELDS)
+DAY = timedelta(days=1)
+# "more than usual" means a day's mean is this many standard errors above the lifetime mean
+USUAL_Z = 2.0
+
+
+def summarize(rows):
+    """Stats for [(timestamp, kwh), ...]; ties for the peak go to the earliest reading."""
+    rows = sorted(rows)
+    values = np.fromiter((kwh for _, kwh in rows), dtype=np.float64, count=len(rows))
+    mean = float(values.mean())
+    peak = int(values.argmax())
+    return Stats(len(rows), float(values.sum()), mean, float(((values - mean) ** 2).sum()),
+                 float(values.min()), float(values[peak]), rows[peak][0], rows[-1][0], rows[-1][1])
+
+
+def merge(a, b):
+    """Combine two Stats (either may be None) with Chan's parallel Welford update."""
+    if a is None or b is None:
+        return a or b
+    n = a.readings + b.readings
+    delta = b.mean_kwh - a.mean_kwh
+    peak = b if (b.max_kwh, a.peak_at) > (a.max_kwh, b.peak_at) else a
+    last = b if b.last_at >= a.last_at else a
+    return Stats(n, a.total_kwh + b.total_kwh, a.mean_kwh + delta * b.readings / n,
+                 a.m2 + b.m2 + delta * delta * a.readings * b.readings / n,
+                 min(a.min_kwh, b.min_kwh), peak.max_kwh, peak.peak_at, last.last_at, last.last_kwh)
+
+
+def _upsert_sql(model, keys):
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = (*keys, *FIELDS)
+    merged = {
+        "readings": "{t}.readings + EXCLUDED.readings",
+        "total_kwh": "{t}.total_kwh + EXCLUDED.total_kwh",
+        "mean_kwh": "{t}.mean_kwh + (EXCLUDED.mean_kwh - {t}.mean_kwh) * EXCLUDED.readings "
+                    "/ ({t}.readings + EXCLUDED.readings)",
+        "m2": "{t}.m2 + EXCLUDED.m2 + (EXCLUDED.mean_kwh - {t}.mean_kwh) * (EXCLUDED.mean_kwh - {t}.mean_kwh) "
+              "* {t}.readings * EXCLUDED.readings / ({t}.readings + EXCLUDED.readings)",
+        "min_kwh": "CASE WHEN EXCLUDED.min_kwh < {t}.min_kwh THEN EXCLUDED.min_kwh ELSE {t}.min_kwh END",
+    }
+    newer_peak = ("EXCLUDED.max_kwh > {t}.max_kwh OR "
+                  "(EXCLUDED.max_kwh = {t}.max_kwh AND EXCLUDED.peak_at < {t}.peak_at)")
+    for field in ("max_kwh", "peak_at"):
+        merged[field] = f"CASE WHEN {newer_peak} THEN EXCLUDED.{field} ELSE {{t}}.{field} END"
+    for field in ("last_at", "last_kwh"):
+        merged[field] = f"CASE WHEN EXCLUDED.last_at >= {{t}}.last_at THEN EXCLUDED.{field} ELSE {{t}}.{field} END"
+    updates = ", ".join(f"{field} = {expr.format(t=table)}" for field, expr in merged.items())
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES {{values}} "
+            f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"), len(columns)
+
+
+def _upsert(model, keys, items, chunk_size=200):
+    """Merge {key tuple: Stats} into ``model`` rows, creating missing ones."""
+    sql, width = _upsert_sql(model, keys)
+    adapt = connection.ops.adapt_datetimefield_value
+    items = sorted(items.items())
+    with connection.cursor() as cursor:
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i:i + chunk_size]
+            params = []
+            for key, s in chunk:
+                params += [adapt(v) if hasattr(v, "tzinfo") else v for v in (*key, *s)]
+            row = "(" + ", ".join(["%s"] * width) + ")"
+            cursor.execute(sql.format(values=", ".join([row] * len(chunk))), params)
+
+
+def apply_readings(readings, replaced=()):
+    """
+    Fold newly stored readings into the daily and lifetime stats. Days with
+    corrected readings (``replaced``) are recomputed instead.
+    """
+    corrected = {(r.device_id, r.timestamp) for r in replaced}
+    days = defaultdict(list)
+    for r in readings:
+        if (r.device_id, r.timestamp) not in corrected:
+            days[(r.device_id, floor_to(as_utc(r.timestamp), "day"))].append((as_utc(r.timestamp), r.energy_kwh))
+    daily = {key: summarize(rows) for key, rows in days.items()}
+    lifetime = {}
+    for (device_id, _), s in sorted(daily.items()):
+        lifetime[(device_id,)] = merge(lifetime.get((device_id,)), s)
+    stale = defaultdict(set)
+    for r in replaced:
+        stale[r.device_id].add(floor_to(as_utc(r.timestamp), "day"))
+    with transaction.atomic():
+        _upsert(DeviceDailyStats, ("device_id", "bucket"), daily)
+        _upsert(DeviceStats, ("device_id",), lifetime)
+        for device_id, touched in sorted(stale.items()):
+            for day in sorted(touched):
+                _write_days(device_id, day, day + DAY)
+            _write_lifetime(device_id)
+
+
+# --- Recompute --------------------------------------------------------------
+
+def _bounds(device_id):
+    raw = Telemetry.objects.filter(device_id=device_id).aggregate(lo=Min("timestamp"), hi=Max("timestamp"))
+    days = TelemetryDayArchive.objects.filter(device_id=device_id).aggregate(lo=Min("bucket"), hi=Max("bucket"))
+    lo = [t for t in (raw["lo"], days["lo"]) if t is not None]
+    hi = [t for t in (raw["hi"], days["hi"]) if t is not None]
+    return (floor_to(as_utc(min(lo)), "day"), floor_to(as_utc(max(hi)), "day") + DAY) if lo else (None, None)
+
+
+def recompute(device_id, start=None, end=None, chunk=timedelta(days=31)):
+    """Yield (day, Stats) from raw and archived readings for the UTC days in [start, end), a month at a time."""
+    if start is None or end is None:
+        lo, hi = _bounds(device_id)
+        if lo is None:
+            return
+        start, end = start or lo, end or hi
+    cur, end = floor_to(as_utc(start), "day"), ceil_to(as_utc(end), "day")
+    while cur < end:
+        stop = min(cur + chunk, end)
+        days = defaultdict(list)
+        rows = (Telemetry.objects.filter(device_id=device_id, timestamp__gte=cur, timestamp__lt=stop)
+                .values_list("timestamp", "energy_kwh").order_by())
+        for ts, kwh in rows.iterator():
+            days[floor_to(as_utc(ts), "day")].append((as_utc(ts), kwh))
+        for row in TelemetryDayArchive.objects.filter(device_id=device_id, bucket__gte=cur, bucket__lt=stop):
+            shadowed = {ts for ts, _ in days[row.bucket]}
+            days[row.bucket] += [(ts, kwh) for ts, kwh in archive.readings(row) if ts not in shadowed]
+        for day in sorted(days):
+            if days[day]:
+                yield day, summarize(days[day])
+        cur = stop
+
+
+def _write_days(device_id, start, end):
+    fresh = [DeviceDailyStats(device_id=device_id, bucket=day, **s._asdict()) for day, s in recompute(device_id, start, end)]
+    DeviceDailyStats.objects.filter(device_id=device_id, bucket__gte=start, bucket__lt=end).delete()
+    DeviceDailyStats.objects.bulk_create(fresh, batch_size=1000)
+
+
+def _as_stats(row):
+    return Stats(*(getattr(row, f) for f in FIELDS))
+
+
+def _from_rows(rows):
+    total = None
+    for row in rows:
+        total = merge(total, _as_stats(row))
+    return total
+
+
+def _write_lifetime(device_id):
+    total = _from_rows(DeviceDailyStats.objects.filter(device_id=device_id).order_by("bucket").iterator())
+    if total is None:
+        DeviceStats.objects.filter(device_id=device_id).delete()
+    else:
+        DeviceStats.objects.update_or_create(device_id=device_id, defaults=total._asdict())
+
+
+def rebuild(device_id, start=None, end=None):
+    """
+    Recompute a device's daily stats over the UTC days in [start, end)
+    (all of them by default) and its lifetime stats from the daily rows.
+    """
+    with transaction.atomic():
+        if start is None or end is None:
+            lo, hi = _bounds(device_id)
+            start = start or lo
+            end = end or hi
+        if start is not None and end is not None:
+            start, end = floor_to(as_utc(start), "day"), ceil_to(as_utc(end), "day")
+            _write_days(device_id, start, end)
+        else:
+            DeviceDailyStats.objects.filter(device_id=device_id).delete()
+        _write_lifetime(device_id)
+
+
+def _differences(scope, bucket, stored, expected):
+    found = []
+    for field in FIELDS:
+        a = getattr(stored, field) if stored is not None else None
+        b = getattr(expected, field) if expected is not None else None
+        same = (a == b if a is None or b is None or not isinstance(a, float)
+                else math.isclose(a, b, rel_tol=1e-6, abs_tol=1e-9))
+        if not same:
+            found.append({"scope": scope, "bucket": bucket, "field": field, "stored": a, "expected": b})
+    return found
+
+
+def check(device_id):
+    """Compare the stored stats of a device with a full recompute; returns the differences."""
+    stored = {row.bucket: _as_stats(row)
+              for row in DeviceDailyStats.objects.filter(device_id=device_id)}
+    expected = dict(recompute(device_id))
+    found = []
+    for day in sorted(set(stored) | set(expected)):
+        found += _differences("day", day, stored.get(day), expected.get(day))
+    lifetime = DeviceStats.objects.filter(device_id=device_id).first()
+    total = None
+    for day in sorted(expected):
+        total = merge(total, expected[day])
+    found += _differences("lifetime", None, lifetime and Stats(*(getattr(lifetime, f) for f in FIELDS)), total)
+    return found
+
+
+# --- Reads ------------------------------------------------------------------
+
+def describe(stats):
+    """Payload for a stats row or Stats (None passes through)."""
+    if stats is None:
+        return None
+    return {
+        "readings": stats.readings,
+        "total_kwh": round(stats.total_kwh, 4),
+        "mean_kwh": round(stats.mean_kwh, 6),
+        "stddev_kwh": round(math.sqrt(stats.m2 / stats.readings), 6) if stats.readings else 0.0,
+        "min_kwh": stats.min_kwh,
+        "max_kwh": stats.max_kwh,
+        "peak_at": stats.peak_at,
+        "last_at": stats.last_at,
+        "last_kwh": stats.last_kwh,
+    }
+
+
+def usual(day, lifetime):
+    """Compare a day's mean reading with the lifetime mean (None without both)."""
+    if day is None or lifetime is None or not lifetime.readings:
+        return None
+    stddev = math.sqrt(lifetime.m2 / lifetime.readings)
+    error = stddev / math.sqrt(day.readings) if day.readings else 0.0
+    z = (day.mean_kwh - lifetime.mean_kwh) / error if error else 0.0
+    return {
+        "mean_kwh": round(day.mean_kwh, 6),
+        "usual_mean_kwh": round(lifetime.mean_kwh, 6),
+        "ratio": round(day.mean_kwh / lifetime.mean_kwh, 3) if lifetime.mean_kwh else None,
+        "z_score": round(z, 2),
+        "above_usual": z > USUAL_Z,
+    }
+
+
+def lifetime_stats(device_ids):
+    """{device_id: DeviceStats} in one query."""
+    return {row.device_id: row for row in DeviceStats.objects.filter(device_id__in=device_ids)}
+
+
+def window_stats(device_ids, start=None, end=None):
+    """
+    {device_id: Stats} merged from the daily rows of the UTC days that
+    [start, end) touches; the lifetime rows when the window is unbounded.
+    """
+    if start is None and end is None:
+        return lifetime_stats(device_ids)
+    qs = DeviceDailyStats.objects.filter(device_id__in=device_ids).order_by("device_id", "bucket")
+    if start is not None:
+        qs = qs.filter(bucket__gte=floor_to(as_utc(start), "day"))
+    if end is not None:
+        qs = qs.filter(bucket__lt=as_utc(end))
+    found = {}
+    for row in qs:
+        found[row.device_id] = merge(found.get(row.device_id), _as_stats(row))
+    return found
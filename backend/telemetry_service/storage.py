@@ -0,0 +1,212 @@
+"""
+Optional compact storage layout for the Telemetry table (PostgreSQL only).
+
+A reading row is already narrow (four 8-byte columns and a flag), so what grows
+with hundreds of millions of rows is mostly index. Migration 0005 drops the
+single-column indexes the unique (device, timestamp) index makes redundant;
+the ``compact`` layout, applied with ``manage.py telemetry_storage``, goes
+further:
+
+* the unique (device, timestamp) constraint is rebuilt with
+  ``INCLUDE (energy_kwh)``, so range sums over a device's readings run as
+  index-only scans instead of visiting the heap, and
+* a BRIN index on ``timestamp`` serves fleet-wide time-window scans over
+  append-only data for a few pages per partition.
+
+The ``standard`` layout reverts both. The constraint keeps its name and key
+columns either way, so ``ON CONFLICT (device_id, "timestamp")`` upserts and
+later Django migrations are unaffected.
+
+On the partitioned table each partition's new unique index is built with
+CREATE INDEX CONCURRENTLY and promoted to a constraint first; the parent
+constraint then attaches them, so writes are only blocked for the final
+swap. Index-only scans need an up-to-date visibility map, which is why the
+layout change ends with VACUUM (ANALYZE).
+"""
+import json
+import statistics
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Telemetry
+from .partitions import is_partitioned
+
+TABLE = Telemetry._meta.db_table
+CONSTRAINT = "telemetry_device_timestamp"
+BRIN_INDEX = "telemetry_timestamp_brin"
+LAYOUTS = ("standard", "compact")
+
+
+def _scalar(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    return cursor.fetchone()[0]
+
+
+def leaf_tables():
+    """The table itself, or its partitions when it is partitioned."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relid::regclass::text FROM pg_partition_tree(%s) WHERE isleaf", [TABLE])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _covering(cursor):
+    return _scalar(
+        cursor,
+        "SELECT i.indnatts > i.indnkeyatts FROM pg_constraint c JOIN pg_index i ON i.indexrelid = c.conindid "
+        "WHERE c.conrelid = %s::regclass AND c.conname = %s",
+        [TABLE, CONSTRAINT],
+    )
+
+
+def layout():
+    """Return "compact" or "standard", or "mixed" if a change was interrupted."""
+    with connection.cursor() as cursor:
+        covering = _covering(cursor)
+        brin = _scalar(cursor, "SELECT to_regclass(%s) IS NOT NULL", [BRIN_INDEX])
+    if covering and brin:
+        return "compact"
+    return "standard" if not (covering or brin) else "mixed"
+
+
+def sizes():
+    """Heap and per-index bytes summed over all partitions, plus the row estimate."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT coalesce(sum(pg_table_size(relid)), 0), coalesce(sum(greatest(c.reltuples, 0)), 0) "
+            "FROM pg_partition_tree(%s) t JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf",
+            [TABLE],
+        )
+        heap, rows = map(int, cursor.fetchone())
+        cursor.execute(
+            "SELECT i.indexrelid::regclass::text FROM pg_index i WHERE i.indrelid = %s::regclass", [TABLE],
+        )
+        indexes = {}
+        for (name,) in cursor.fetchall():
+            indexes[name] = int(_scalar(
+                cursor,
+                "SELECT coalesce(sum(pg_relation_size(relid)), 0) FROM pg_partition_tree(%s::regclass)", [name],
+            ))
+    index_total = sum(indexes.values())
+    return {
+        "rows": rows,
+        "heap_bytes": heap,
+        "index_bytes": index_total,
+        "indexes": indexes,
+        "bytes_per_row": round((heap + index_total) / rows, 1) if rows else None,
+    }
+
+
+def _plan_nodes(plan):
+    nodes = [plan["Node Type"]]
+    for child in plan.get("Plans", ()):
+        nodes += _plan_nodes(child)
+    return nodes
+
+
+def measure(device_id=None, runs=3, now=None):
+    """
+    Time two representative raw-telemetry queries with EXPLAIN ANALYZE: one
+    device's 30-day sum and a fleet-wide count over the last hour. Returns
+    {name: {"ms": median execution ms, "scans": sorted scan node types}}.
+    """
+    qn = connection.ops.quote_name
+    now = now or timezone.now()
+    with connection.cursor() as cursor:
+        if device_id is None:
+            cursor.execute(f"SELECT device_id FROM {qn(TABLE)} LIMIT 1")
+            row = cursor.fetchone()
+            device_id = row[0] if row else 0
+        queries = {
+            "device_30d_sum": (
+                f'SELECT sum(energy_kwh) FROM {qn(TABLE)} '
+                f'WHERE device_id = %s AND "timestamp" >= %s AND "timestamp" < %s',
+                [device_id, now - timedelta(days=30), now],
+            ),
+            "fleet_1h_count": (
+                f'SELECT count(*), sum(energy_kwh) FROM {qn(TABLE)} WHERE "timestamp" >= %s AND "timestamp" < %s',
+                [now - timedelta(hours=1), now],
+            ),
+        }
+        results = {}
+        for name, (sql, params) in queries.items():
+            timings, scans = [], set()
+            for _ in range(runs):
+                cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+                explained = cursor.fetchone()[0]
+                if isinstance(explained, str):
+                    explained = json.loads(explained)
+                timings.append(explained[0]["Execution Time"])
+                scans.update(n for n in _plan_nodes(explained[0]["Plan"]) if "Scan" in n)
+            results[name] = {"ms": round(statistics.median(timings), 3), "scans": sorted(scans)}
+    return results
+
+
+def _rebuild_constraint(covering):
+    qn = connection.ops.quote_name
+    include = " INCLUDE (energy_kwh)" if covering else ""
+    suffix = "dts_cov" if covering else "dts"
+    partitioned = is_partitioned()
+    with connection.cursor() as cursor:
+        for leaf in leaf_tables():
+            name = f"{leaf}_{suffix}"
+            if _scalar(cursor, "SELECT EXISTS (SELECT 1 FROM pg_constraint "
+                               "WHERE conname = %s AND conrelid = %s::regclass)", [name, leaf]):
+                continue                # built by an interrupted earlier run
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {qn(name)}")
+            cursor.execute(
+                f'CREATE UNIQUE INDEX CONCURRENTLY {qn(name)} ON {qn(leaf)} (device_id, "timestamp"){include}'
+            )
+            if partitioned:
+                # a partition constraint (not just an index) is what the parent's ADD CONSTRAINT attaches
+                cursor.execute(f"ALTER TABLE {qn(leaf)} ADD CONSTRAINT {qn(name)} UNIQUE USING INDEX {qn(name)}")
+        with transaction.atomic():
+            cursor.execute(f"ALTER TABLE {qn(TABLE)} DROP CONSTRAINT {qn(CONSTRAINT)}")
+            if partitioned:
+                cursor.execute(
+                    f'ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(CONSTRAINT)} UNIQUE (device_id, "timestamp"){include}'
+                )
+            else:
+                index = qn(f"{TABLE}_{suffix}")
+                cursor.execute(f"ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(CONSTRAINT)} UNIQUE USING INDEX {index}")
+
+
+def _create_brin(pages_per_range):
+    qn = connection.ops.quote_name
+    options = f'USING brin ("timestamp") WITH (pages_per_range = {int(pages_per_range)})'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX IF EXISTS {qn(BRIN_INDEX)}")
+        if not is_partitioned():
+            cursor.execute(f"CREATE INDEX CONCURRENTLY {qn(BRIN_INDEX)} ON {qn(TABLE)} {options}")
+            return
+        # an invalid parent index is ignored by the planner until every partition is attached
+        cursor.execute(f"CREATE INDEX {qn(BRIN_INDEX)} ON ONLY {qn(TABLE)} {options}")
+        for leaf in leaf_tables():
+            name = f"{leaf}_ts_brin"
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {qn(name)}")
+            cursor.execute(f"CREATE INDEX CONCURRENTLY {qn(name)} ON {qn(leaf)} {options}")
+            cursor.execute(f"ALTER INDEX {qn(BRIN_INDEX)} ATTACH PARTITION {qn(name)}")
+
+
+def apply_layout(name, pages_per_range=32):
+    """
+    Switch the Telemetry table to the ``standard`` or ``compact`` layout.
+    Must run outside a transaction (CREATE INDEX CONCURRENTLY, VACUUM).
+    """
+    if name not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{name}'.")
+    if connection.in_atomic_block:
+        raise ValueError("Changing the storage layout cannot run inside a transaction.")
+    compact = name == "compact"
+    with connection.cursor() as cursor:
+        covering = _covering(cursor)
+    if covering != compact:
+        _rebuild_constraint(compact)
+    if compact:
+        _create_brin(pages_per_range)
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(BRIN_INDEX)}")
+    with connection.cursor() as cursor:
+        cursor.execute(f"VACUUM (ANALYZE) {connection.ops.quote_name(TABLE)}")
@@ -3,9 +3,24 @@ from django.urls import reverse
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Device, Telemetry
+from .models import Device, DeviceStats, Telemetry, TelemetryHourly, TelemetryDaily, TelemetryDayArchive
+from .ingest import Reading, ingest_readings
+from .buffer import BufferFull, IngestBuffer, get_buffer
+from . import async_views, caching, downsample, live, rollups, partitions, stats, storage
+from django.db import IntegrityError, OperationalError, connection
+from unittest import mock, skipUnless
+from django.test import TransactionTestCase, override_settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from tempfile import TemporaryDirectory
+import asyncio
+from asgiref.sync import sync_to_async
+import gzip
+import json
+import os
 
 User = get_user_model()
 
@@ -15,6 +30,7 @@ def auth_header(user):
 
 class TelemetryAPITests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username="u1", password="p1")
         self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
 
@@ -29,3 +45,978 @@ class TelemetryAPITests(APITestCase):
         res2 = self.client.get(sum_url, **auth_header(self.user))
         self.assertEqual(res2.status_code, 200)
         self.assertIn("total_kwh", res2.data)
+
+    def test_batch_ingest_reports_row_errors(self):
+        url = reverse("device-telemetry", args=[self.device.id])
+        now = timezone.now()
+        rows = [{"timestamp": (now - timedelta(minutes=i)).isoformat(), "energy_kwh": 0.01} for i in range(50)]
+        rows.append({"timestamp": "not-a-date", "energy_kwh": 0.01})
+        res = self.client.post(url, rows, format="json", **auth_header(self.user))
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data["created"], 50)
+        self.assertEqual(res.data["errors"][0]["index"], 50)
+        self.assertEqual(Telemetry.objects.filter(device=self.device).count(), 50)
+
+        res = self.client.post(url + "?atomic=true", rows, format="json", **auth_header(self.user))
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(Telemetry.objects.filter(device=self.device).count(), 50)
+
+    def test_bulk_ingest_across_devices(self):
+        tv = Device.objects.create(user=self.user, name="TV", slug="tv")
+        other = User.objects.create_user(username="u2", password="p2")
+        foreign = Device.objects.create(user=other, name="Fridge", slug="fridge")
+        now = timezone.now().isoformat()
+        payload = {"readings": [
+            {"device": self.device.id, "timestamp": now, "energy_kwh": 0.02},
+            {"device": tv.id, "timestamp": now, "energy_kwh": 0.05},
+            {"device": foreign.id, "timestamp": now, "energy_kwh": 0.05},
+        ]}
+        res = self.client.post(reverse("device-bulk-telemetry"), payload, format="json", **auth_header(self.user))
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data["created"], 2)
+        self.assertEqual(res.data["errors"][0]["index"], 2)
+        self.assertFalse(Telemetry.objects.filter(device=foreign).exists())
+
+    def test_device_list_query_count_is_constant(self):
+        url = reverse("device-list")
+        now = timezone.now()
+        ingest_readings([Reading(self.device.id, now - timedelta(minutes=i), 0.5) for i in range(10)])
+        with self.assertNumQueries(2):  # JWT user lookup + device list
+            res = self.client.get(url, **auth_header(self.user))
+        self.assertEqual(res.data[0]["total_kwh"], 5.0)
+
+        for i in range(10):
+            d = Device.objects.create(user=self.user, name=f"Plug {i}", slug=f"plug-{i}")
+            ingest_readings([Reading(d.id, now, 0.1)])
+        with self.assertNumQueries(2):
+            res = self.client.get(url, **auth_header(self.user))
+        self.assertEqual(len(res.data), 11)
+
+        res = self.client.get(url + "?include_total=false", **auth_header(self.user))
+        self.assertNotIn("total_kwh", res.data[0])
+
+    def test_cursor_pagination_walks_every_row(self):
+        url = reverse("device-telemetry", args=[self.device.id])
+        now = timezone.now()
+        ingest_readings([Reading(self.device.id, now - timedelta(minutes=i), 0.01) for i in range(25)])
+        seen, next_url = [], url + "?page_size=10"
+        while next_url:
+            res = self.client.get(next_url, **auth_header(self.user))
+            self.assertEqual(res.status_code, 200)
+            seen += [row["id"] for row in res.data["results"]]
+            next_url = res.data["next"]
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(set(seen), set(Telemetry.objects.values_list("id", flat=True)))
+
+        res = self.client.get(url + "?layout=columns", **auth_header(self.user))
+        self.assertEqual(len(res.data["timestamps"]), 25)
+        self.assertEqual(res.data["device_name"], "Fridge")
+
+    def test_streaming_export(self):
+        now = timezone.now()
+        ingest_readings([Reading(self.device.id, now - timedelta(minutes=i), 0.25) for i in range(30)])
+        url = reverse("device-telemetry-export", args=[self.device.id])
+        res = self.client.get(url, **auth_header(self.user))
+        self.assertEqual(res.status_code, 200)
+        lines = b"".join(res.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "timestamp,energy_kwh")
+        self.assertEqual(len(lines), 31)
+        self.assertLess(lines[1], lines[-1])
+
+        res = self.client.get(url + "?fmt=ndjson", **auth_header(self.user))
+        self.assertEqual(len(b"".join(res.streaming_content).splitlines()), 30)
+
+        listing = reverse("device-telemetry", args=[self.device.id])
+        for target in (url, listing):
+            for bad in ("garbage", "2025-13-01T00:00:00"):
+                res = self.client.get(target, {"start": bad}, **auth_header(self.user))
+                self.assertEqual(res.status_code, 400, (target, bad))
+
+    @override_settings(ALLOWED_HOSTS=["localhost"])
+    def test_benchmark_reports_json(self):
+        cache.set("telemetry:unrelated", 1)
+        out = StringIO()
+        call_command("benchmark", "--sizes", "20", "--repeat", "1", "--warmup", "0", "--batch", "5",
+                     "--json", stdout=out)
+        report = json.loads(out.getvalue())
+        cases = {row["case"]: row for row in report["results"]}
+        self.assertIn("chat_top_devices", cases)
+        self.assertEqual(cases["ingest_bulk"]["runs"], 1)
+        self.assertGreater(cases["device_list"]["queries"], 0)
+        self.assertFalse(Device.objects.filter(user__username="bench-20").exists())
+        # cold cases only invalidate the benchmark's own entries
+        self.assertEqual(cache.get("telemetry:unrelated"), 1)
+
+
+class RollupTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        self.base = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=3)
+        # three days of 10-minute readings, ingested newest first to exercise out-of-order buckets
+        readings = [
+            Reading(self.device.id, self.base + timedelta(minutes=10 * i), 0.01 * (i % 7))
+            for i in range(3 * 144)
+        ]
+        ingest_readings(list(reversed(readings)))
+
+    def raw_total(self, start, end):
+        qs = Telemetry.objects.filter(device=self.device, timestamp__gte=start, timestamp__lte=end)
+        return sum(qs.values_list("energy_kwh", flat=True))
+
+    def test_range_totals_match_raw(self):
+        windows = [
+            (self.base, self.base + timedelta(days=3)),
+            (self.base + timedelta(hours=5, minutes=7), self.base + timedelta(days=2, hours=1, minutes=30)),
+            (self.base + timedelta(minutes=15), self.base + timedelta(minutes=45)),
+            (self.base + timedelta(hours=23), self.base + timedelta(days=1, hours=1)),
+        ]
+        for start, end in windows:
+            self.assertAlmostEqual(rollups.total_kwh([self.device.id], start, end), self.raw_total(start, end))
+
+        late = self.base + timedelta(days=1, hours=3, minutes=1)
+        Telemetry.objects.create(device=self.device, timestamp=late, energy_kwh=1.5)
+        start, end = self.base, self.base + timedelta(days=3)
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id], start, end), self.raw_total(start, end))
+
+    def test_reingest_is_idempotent_and_corrections_adjust_rollups(self):
+        start, end = self.base, self.base + timedelta(days=3)
+        count, total = Telemetry.objects.count(), rollups.total_kwh([self.device.id], start, end)
+        ts = self.base + timedelta(minutes=10 * 50)
+        old = Telemetry.objects.get(device=self.device, timestamp=ts).energy_kwh
+        url = reverse("device-telemetry", args=[self.device.id])
+        for _ in range(2):
+            res = self.client.post(url, {"timestamp": ts.isoformat(), "energy_kwh": old},
+                                   format="json", **auth_header(self.user))
+            self.assertEqual(res.status_code, 201)
+        self.assertEqual(Telemetry.objects.count(), count)
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id], start, end), total)
+
+        ingest_readings([Reading(self.device.id, ts, old + 2.0), Reading(self.device.id, ts, old + 1.0)])
+        self.assertEqual(Telemetry.objects.count(), count)
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id], start, end), total + 1.0)
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id], start, end), self.raw_total(start, end))
+
+    def test_daily_series_and_backfill(self):
+        start, end = self.base, self.base + timedelta(days=3)
+        incremental = rollups.series([self.device.id], start, end, unit="day", include_end=False)
+        self.assertEqual(len(incremental), 3)
+        TelemetryHourly.objects.all().delete()
+        TelemetryDaily.objects.all().delete()
+        call_command("backfill_rollups", stdout=StringIO())
+        rebuilt = rollups.series([self.device.id], start, end, unit="day", include_end=False)
+        self.assertEqual([d for d, _ in rebuilt], [d for d, _ in incremental])
+        for (_, a), (_, b) in zip(rebuilt, incremental):
+            self.assertAlmostEqual(a, b)
+
+    def test_generator_loads_rows_and_rollups(self):
+        call_command("generate_telemetry", "--username", "load", "--users", "2", "--devices-per-user", "6",
+                     "--days", "0.25", "--resolution", "5", "--seed", "1", stdout=StringIO())
+        devices = Device.objects.filter(user__username__startswith="load-")
+        self.assertEqual(devices.count(), 12)
+        self.assertTrue(devices.filter(slug="fridge-2").exists())
+        self.assertEqual(Telemetry.objects.filter(device__in=devices).count(), 12 * 72)
+        ids = list(devices.values_list("id", flat=True))
+        raw = sum(Telemetry.objects.filter(device__in=devices).values_list("energy_kwh", flat=True))
+        self.assertAlmostEqual(rollups.total_kwh(ids, None, timezone.now()), raw)
+
+
+@skipUnless(connection.vendor == "postgresql", "partitioning is PostgreSQL-only")
+class PartitionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+
+    def test_partition_lifecycle(self):
+        self.assertTrue(partitions.is_partitioned())
+        old = timezone.now().replace(day=15) - timedelta(days=800)
+        ingest_readings([Reading(self.device.id, old, 1.0), Reading(self.device.id, timezone.now(), 0.5)])
+        url = reverse("device-summary", args=[self.device.id])
+        self.assertEqual(self.client.get(url, **auth_header(self.user)).data["total_kwh"], 1.5)
+        name = partitions.partition_name(old.date())
+
+        # the row lands in the default partition until its month exists
+        self.assertTrue(partitions.create_partition(old.date()))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM "{name}"')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        # range filters prune to the matching partition
+        qs = Telemetry.objects.filter(timestamp__gte=old - timedelta(days=1), timestamp__lte=old + timedelta(days=1))
+        plan = qs.explain()
+        self.assertIn(name, plan)
+        self.assertNotIn(partitions.DEFAULT_PARTITION, plan)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dropped = partitions.drop_partitions_before(partitions.add_months(old.date(), 1))
+        self.assertIn(name, dropped)
+        self.assertFalse(Telemetry.objects.filter(timestamp=old).exists())
+        # rollups, stats and cached totals forget the dropped month
+        self.assertEqual(self.client.get(url, **auth_header(self.user)).data["total_kwh"], 0.5)
+        self.assertEqual(DeviceStats.objects.get(device=self.device).readings, 1)
+        self.assertEqual(stats.check(self.device.id), [])
+        rollups.rebuild(self.device.id)
+        self.assertEqual(rollups.total_kwh([self.device.id]), 0.5)
+
+
+@skipUnless(connection.vendor == "postgresql", "storage layouts are PostgreSQL-only")
+class StorageLayoutTests(TransactionTestCase):
+    # CREATE INDEX CONCURRENTLY and VACUUM cannot run inside the test transaction
+
+    def tearDown(self):
+        storage.apply_layout("standard")
+
+    def test_compact_layout_round_trip(self):
+        user = User.objects.create_user(username="u1", password="p1")
+        device = Device.objects.create(user=user, name="Fridge", slug="fridge")
+        now = timezone.now()
+        ingest_readings([Reading(device.id, now - timedelta(minutes=i), 0.5) for i in range(50)])
+
+        out = StringIO()
+        call_command("telemetry_storage", "--layout", "compact", "--measure", "--device", str(device.id),
+                     "--json", stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["before"]["layout"], "standard")
+        self.assertEqual(report["after"]["layout"], "compact")
+        self.assertIn(storage.BRIN_INDEX, report["after"]["sizes"]["indexes"])
+        self.assertIn("device_30d_sum", report["after"]["queries"])
+
+        # upserts still find the (now covering) unique constraint
+        ingest_readings([Reading(device.id, now, 1.5), Reading(device.id, now + timedelta(minutes=1), 0.5)])
+        self.assertEqual(Telemetry.objects.count(), 51)
+        self.assertAlmostEqual(rollups.total_kwh([device.id], None, now + timedelta(minutes=1)), 26.5)
+
+        storage.apply_layout("standard")
+        self.assertEqual(storage.layout(), "standard")
+
+
+class RetentionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.medium_day = today - timedelta(days=120)
+        self.old_day = today - timedelta(days=400)
+        readings = []
+        for day in (self.medium_day, self.old_day):
+            readings += [Reading(self.device.id, day + timedelta(minutes=i), 0.001 * (i % 11)) for i in range(1440)]
+        ingest_readings(readings)
+
+    def totals(self):
+        url = reverse("device-summary", args=[self.device.id])
+        day = self.medium_day
+        windows = [
+            "",
+            f"?start={day.isoformat()}&end={(day + timedelta(hours=6, seconds=-1)).isoformat()}",
+            f"?start={self.old_day.isoformat()}&end={(self.old_day + timedelta(days=1)).isoformat()}",
+        ]
+        return [
+            self.client.get(url + w.replace("+", "%2B"), **auth_header(self.user)).data["total_kwh"]
+            for w in windows
+        ]
+
+    def test_compaction_preserves_totals(self):
+        before = self.totals()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("compact_telemetry", "--full", stdout=StringIO())
+        self.assertEqual(Telemetry.objects.filter(timestamp__gte=self.medium_day).count(), 96)
+        self.assertEqual(Telemetry.objects.filter(timestamp__lt=self.medium_day).count(), 1)
+        self.assertEqual(self.totals(), before)
+        self.assertEqual(stats.check(self.device.id), [])
+        self.assertEqual(DeviceStats.objects.get(device=self.device).readings, 97)
+
+        # a second run is a no-op
+        out = StringIO()
+        call_command("compact_telemetry", "--full", stdout=out)
+        self.assertIn("Compacted 0 rows", out.getvalue())
+
+    def test_late_reading_at_a_compacted_bucket_start_is_added(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("compact_telemetry", "--full", stdout=StringIO())
+        bucket = Telemetry.objects.get(device=self.device, timestamp=self.medium_day)
+        self.assertTrue(bucket.compacted)
+        before = self.totals()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_readings([Reading(self.device.id, self.medium_day, 0.5)])
+        bucket.refresh_from_db()
+        self.assertAlmostEqual(bucket.energy_kwh, sum(0.001 * (i % 11) for i in range(15)) + 0.5)
+        self.assertEqual([round(t, 6) for t in self.totals()],
+                         [round(before[0] + 0.5, 6), round(before[1] + 0.5, 6), round(before[2], 6)])
+        self.assertAlmostEqual(
+            rollups.total_kwh([self.device.id]),
+            sum(Telemetry.objects.filter(device=self.device).values_list("energy_kwh", flat=True)),
+        )
+        self.assertEqual(stats.check(self.device.id), [])
+
+
+@override_settings(TELEMETRY_ARCHIVE={"AFTER_DAYS": 2, "COMPRESS": True})
+class ArchiveTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.base = today - timedelta(days=5)
+        self.readings = [Reading(self.device.id, self.base + timedelta(minutes=7 * i), 0.01 * (i % 9)) for i in range(600)]
+        ingest_readings(self.readings + [Reading(self.device.id, today, 1.0)])
+        self.windows = [
+            (None, None),
+            (self.base + timedelta(hours=5, minutes=3), self.base + timedelta(days=2, hours=1, minutes=30)),
+            (self.base + timedelta(minutes=15), self.base + timedelta(minutes=45)),
+        ]
+
+    def totals(self):
+        ids = [self.device.id]
+        totals = [rollups.total_kwh(ids, start, end) for start, end in self.windows]
+        totals += [sum(rollups.grouped(ids, self.windows[1:], unit="hour").values())]
+        return totals
+
+    def listing(self):
+        url = reverse("device-telemetry", args=[self.device.id]) + "?page_size=100"
+        seen = []
+        while url:
+            res = self.client.get(url, **auth_header(self.user))
+            seen += [(row["timestamp"], row["energy_kwh"]) for row in res.data["results"]]
+            url = res.data["next"]
+        return seen
+
+    def test_archive_round_trip_keeps_reads_transparent(self):
+        before, listed = self.totals(), self.listing()
+        call_command("archive_telemetry", "--full", stdout=StringIO())
+        self.assertEqual(Telemetry.objects.count(), 1)
+        self.assertEqual(TelemetryDayArchive.objects.count(), 3)
+        for a, b in zip(self.totals(), before):
+            self.assertAlmostEqual(a, b, places=5)
+        after = self.listing()
+        self.assertEqual([ts for ts, _ in after], [ts for ts, _ in listed])
+        for (_, a), (_, b) in zip(after, listed):
+            self.assertAlmostEqual(a, b, places=6)
+        export = reverse("device-telemetry-export", args=[self.device.id])
+        lines = b"".join(self.client.get(export, **auth_header(self.user)).streaming_content).splitlines()
+        self.assertEqual(len(lines), 602)
+
+        # a late correction is folded into the archive (and rollups) on the next run
+        ts = self.readings[10].timestamp
+        ingest_readings([Reading(self.device.id, ts, 5.0)])
+        call_command("archive_telemetry", "--full", stdout=StringIO())
+        self.assertEqual(Telemetry.objects.count(), 1)
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id]), before[0] + 5.0 - self.readings[10].energy_kwh,
+                               places=5)
+
+        TelemetryHourly.objects.all().delete()
+        TelemetryDaily.objects.all().delete()
+        call_command("backfill_rollups", stdout=StringIO())
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id]), before[0] + 5.0 - self.readings[10].energy_kwh,
+                               places=5)
+
+        call_command("archive_telemetry", "--restore", stdout=StringIO())
+        self.assertFalse(TelemetryDayArchive.objects.exists())
+        self.assertEqual(Telemetry.objects.count(), 601)
+        self.assertAlmostEqual(Telemetry.objects.get(timestamp=ts).energy_kwh, 5.0)
+        self.assertEqual(stats.check(self.device.id), [])
+
+
+class SeriesTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1", time_zone="Europe/Berlin")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        # hourly 1 kWh readings around the 2025-03-30 switch to summer time in Berlin
+        first = datetime(2025, 3, 28, 23, tzinfo=dt_timezone.utc)
+        ingest_readings([Reading(self.device.id, first + timedelta(hours=i), 1.0) for i in range(72)])
+        self.url = reverse("device-series", args=[self.device.id])
+
+    def series(self, **params):
+        res = self.client.get(self.url, params, **auth_header(self.user))
+        self.assertEqual(res.status_code, 200, res.data)
+        return [(row["start"].isoformat(), row["total_kwh"]) for row in res.data["data"]]
+
+    def test_local_days_follow_dst_and_gaps_are_filled(self):
+        self.assertEqual(self.series(start="2025-03-29", end="2025-04-03"), [
+            ("2025-03-29T00:00:00+01:00", 24.0),
+            ("2025-03-30T00:00:00+01:00", 23.0),
+            ("2025-03-31T00:00:00+02:00", 24.0),
+            ("2025-04-01T00:00:00+02:00", 1.0),
+            ("2025-04-02T00:00:00+02:00", 0.0),
+        ])
+        self.assertEqual([kwh for _, kwh in self.series(start="2025-03-01", end="2025-05-01", granularity="month")],
+                         [71.0, 1.0])
+        self.assertEqual([kwh for _, kwh in self.series(start="2025-03-26", end="2025-04-02", granularity="week")],
+                         [47.0, 25.0])
+
+    def test_fine_buckets_and_unaligned_zones_read_raw_rows(self):
+        self.assertEqual(self.series(start="2025-03-30T00:00:00Z", end="2025-03-30T01:00:00Z", granularity="15m"),
+                         [("2025-03-30T01:00:00+01:00", 1.0), ("2025-03-30T01:15:00+01:00", 0.0),
+                          ("2025-03-30T01:30:00+01:00", 0.0), ("2025-03-30T01:45:00+01:00", 0.0)])
+        # Kolkata midnight is 18:30 UTC, so hourly rollups cannot answer it
+        self.assertEqual(self.series(start="2025-03-30", end="2025-03-31", tz="Asia/Kolkata"),
+                         [("2025-03-30T00:00:00+05:30", 24.0)])
+        self.assertEqual(len(self.series(start="2025-03-30", end="2025-03-31", granularity="hour")), 23)
+
+    def test_invalid_parameters_and_time_zone_preference(self):
+        for params in ({"start": "2025-03-30", "granularity": "year"}, {"start": "2025-03-30", "tz": "Mars/Base"},
+                       {"end": "2025-03-30"}, {"start": "2025-03-30", "end": "2025-03-29"},
+                       {"start": "2020-01-01", "granularity": "15m"}):
+            self.assertEqual(self.client.get(self.url, params, **auth_header(self.user)).status_code, 400)
+
+        me = reverse("user-me")
+        res = self.client.patch(me, {"time_zone": "Asia/Kolkata"}, format="json", **auth_header(self.user))
+        self.assertEqual(res.data["time_zone"], "Asia/Kolkata")
+        self.assertEqual(self.client.patch(me, {"time_zone": "Nowhere"}, format="json",
+                                           **auth_header(self.user)).status_code, 400)
+        self.assertEqual(self.series(start="2025-03-30", end="2025-03-31")[0][0], "2025-03-30T00:00:00+05:30")
+
+
+class DownsampleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        self.start = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+        # ten hours of per-minute readings with one spike
+        self.values = [0.01 + 0.005 * (i % 7) for i in range(600)]
+        self.values[333] = 2.5
+        ingest_readings([Reading(self.device.id, self.start + timedelta(minutes=i), v)
+                         for i, v in enumerate(self.values)])
+
+    def test_stream_and_points_keep_peaks_within_max_points(self):
+        rows = [(self.start + timedelta(minutes=i), v) for i, v in enumerate(self.values)]
+        end = rows[-1][0]
+        for method in downsample.METHODS:
+            timestamps, kwh, seen = downsample.stream(iter(rows), self.start, end, 20, method, chunk_size=37)
+            self.assertEqual(seen, 600)
+            self.assertLessEqual(len(kwh), 20)
+            self.assertEqual(timestamps, sorted(timestamps))
+            self.assertIn((rows[333][0], 2.5), list(zip(timestamps, kwh)))
+            kept = downsample.points(rows, 20, method)
+            self.assertLessEqual(len(kept), 20)
+            self.assertIn(rows[333], kept)
+        self.assertEqual(downsample.points(rows[:5], 20), rows[:5])
+
+    def test_endpoints_accept_max_points(self):
+        url = reverse("device-telemetry", args=[self.device.id])
+        res = self.client.get(url, {"max_points": 50}, **auth_header(self.user))
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual((res.data["method"], res.data["source_points"]), ("lttb", 600))
+        self.assertLessEqual(len(res.data["kwh"]), 50)
+        self.assertEqual((res.data["timestamps"][0], res.data["timestamps"][-1]),
+                         (self.start, self.start + timedelta(minutes=599)))
+        self.assertEqual(max(res.data["kwh"]), 2.5)
+
+        res = self.client.get(url, {"max_points": 10, "downsample": "minmax",
+                                    "start": (self.start + timedelta(hours=5)).isoformat()}, **auth_header(self.user))
+        self.assertEqual(res.data["source_points"], 300)
+        self.assertLessEqual(len(res.data["kwh"]), 10)
+        self.assertEqual(max(res.data["kwh"]), 2.5)
+
+        for params in ({"max_points": 2}, {"max_points": "many"}, {"max_points": 10, "downsample": "avg"}):
+            self.assertEqual(self.client.get(url, params, **auth_header(self.user)).status_code, 400)
+
+        series = reverse("device-series", args=[self.device.id])
+        res = self.client.get(series, {"start": "2025-03-01T00:00:00Z", "end": "2025-03-01T10:00:00Z",
+                                       "granularity": "15m", "tz": "UTC", "max_points": 8}, **auth_header(self.user))
+        self.assertEqual(len(res.data["data"]), 8)
+        self.assertEqual(max(row["total_kwh"] for row in res.data["data"]), round(sum(self.values[330:345]), 4))
+
+
+class FleetSummaryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.fridge = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        self.tv = Device.objects.create(user=self.user, name="TV", slug="tv")
+        other = User.objects.create_user(username="u2", password="p2")
+        self.foreign = Device.objects.create(user=other, name="Other", slug="other")
+        self.today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        old = self.today - timedelta(days=40)
+        ingest_readings([
+            Reading(self.fridge.id, self.today + timedelta(minutes=10), 1.0),
+            Reading(self.fridge.id, self.today + timedelta(minutes=70), 2.0),
+            Reading(self.tv.id, self.today + timedelta(minutes=10), 0.5),
+            Reading(self.tv.id, self.today - timedelta(hours=3), 3.0),
+            Reading(self.fridge.id, old + timedelta(minutes=20), 4.0),
+            Reading(self.fridge.id, old + timedelta(minutes=40), 5.0),
+            Reading(self.foreign.id, self.today + timedelta(minutes=10), 9.0),
+        ])
+        self.url = reverse("device-fleet-summary")
+
+    def get(self, **params):
+        res = self.client.get(self.url, params, **auth_header(self.user))
+        self.assertEqual(res.status_code, 200, res.data)
+        return res.data
+
+    def test_windows_match_per_device_totals_in_one_query(self):
+        old = self.today - timedelta(days=40)
+        with self.assertNumQueries(3):      # user, devices, one grouped read
+            data = self.get(windows="today,yesterday,week,month",
+                            start=(old + timedelta(minutes=30)).isoformat(), end=(old + timedelta(days=1)).isoformat())
+        self.assertEqual([w["name"] for w in data["windows"]], ["today", "yesterday", "week", "month", "custom"])
+        self.assertEqual([d["slug"] for d in data["devices"]], ["fridge", "tv"])
+        for device in data["devices"]:
+            for w in data["windows"]:
+                expected = rollups.total_kwh([device["id"]], w["start"], w["end"], include_end=False)
+                self.assertAlmostEqual(device["windows"][w["name"]]["total_kwh"], expected)
+        fridge = data["devices"][0]["windows"]
+        self.assertEqual(fridge["today"]["total_kwh"], 3.0)
+        self.assertEqual(fridge["today"]["peak"], {"bucket": self.today + timedelta(hours=1), "total_kwh": 2.0})
+        self.assertEqual([p["total_kwh"] for p in fridge["today"]["series"]], [1.0, 2.0])
+        self.assertEqual(fridge["custom"]["total_kwh"], 5.0)
+        self.assertEqual(data["windows"][0]["total_kwh"], 3.5)
+        self.assertEqual(data["devices"][1]["windows"]["yesterday"]["total_kwh"], 3.0)
+
+        data = self.get(devices=str(self.tv.id), unit="day")
+        self.assertEqual([d["slug"] for d in data["devices"]], ["tv"])
+        self.assertEqual(data["devices"][0]["windows"]["today"]["series"], [{"bucket": self.today, "total_kwh": 0.5}])
+
+    def test_invalid_parameters(self):
+        for params, status in (({"devices": str(self.foreign.id)}, 404), ({"devices": "fridge"}, 400),
+                               ({"unit": "minute"}, 400), ({"windows": "decade"}, 400), ({"windows": ""}, 400),
+                               ({"start": "2025-03-02T00:00:00Z", "end": "2025-03-01T00:00:00Z"}, 400)):
+            self.assertEqual(self.client.get(self.url, params, **auth_header(self.user)).status_code, status)
+
+
+class StatsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        self.today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.readings = [Reading(self.device.id, self.today - timedelta(days=1, minutes=-i), 0.01 * (i % 5 + 1))
+                         for i in range(100)]
+        self.readings += [Reading(self.device.id, self.today + timedelta(minutes=i), 0.05) for i in range(30)]
+
+    def test_incremental_stats_match_recompute(self):
+        # out of order, in several batches, with a resend and a correction
+        ingest_readings(self.readings[100:])
+        ingest_readings(self.readings[50:100])
+        ingest_readings(self.readings[:60])
+        ingest_readings([Reading(self.device.id, self.readings[7].timestamp, 0.9)])
+        values = [r.energy_kwh for r in self.readings]
+        values[7] = 0.9
+        row = DeviceStats.objects.get(device=self.device)
+        self.assertEqual(row.readings, 130)
+        self.assertAlmostEqual(row.mean_kwh, sum(values) / 130)
+        mean = sum(values) / 130
+        self.assertAlmostEqual(row.m2, sum((v - mean) ** 2 for v in values))
+        self.assertEqual((row.max_kwh, row.peak_at), (0.9, self.readings[7].timestamp))
+        self.assertEqual((row.last_at, row.last_kwh), (self.readings[-1].timestamp, 0.05))
+        self.assertEqual(stats.check(self.device.id), [])
+
+        url = reverse("device-stats", args=[self.device.id])
+        res = self.client.get(url, **auth_header(self.user))
+        self.assertEqual((res.data["day"]["readings"], res.data["day"]["stddev_kwh"]), (30, 0.0))
+        self.assertEqual(res.data["lifetime"]["readings"], 130)
+        self.assertFalse(res.data["usual"]["above_usual"])
+        yesterday = (self.today - timedelta(days=1)).date().isoformat()
+        res = self.client.get(url, {"date": yesterday}, **auth_header(self.user))
+        self.assertEqual(res.data["day"]["max_kwh"], 0.9)
+        self.assertEqual(self.client.get(url, {"date": "soon"}, **auth_header(self.user)).status_code, 400)
+
+    def test_rebuild_and_check_commands(self):
+        ingest_readings(self.readings)
+        DeviceStats.objects.filter(device=self.device).update(readings=1, max_kwh=7.0)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("telemetry_stats", "--check", stdout=out)
+        self.assertIn("lifetime readings: stored 1, expected 130", out.getvalue())
+        call_command("telemetry_stats", "--rebuild", "--check", stdout=StringIO())
+        self.assertEqual(DeviceStats.objects.get(device=self.device).max_kwh, 0.05)
+
+
+@override_settings(TELEMETRY_STATUS={"STALE_AFTER": 600, "OFFLINE_AFTER": 3600})
+class FleetStatusTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="u1", password="p1")
+        now = timezone.now()
+        self.devices = [Device.objects.create(user=self.user, name=name, slug=name.lower())
+                        for name in ("Fridge", "TV", "Heater", "Pump")]
+        ingest_readings([
+            Reading(self.devices[0].id, now - timedelta(minutes=1), 0.2),
+            Reading(self.devices[0].id, now - timedelta(minutes=2), 0.1),
+            Reading(self.devices[1].id, now - timedelta(minutes=30), 0.3),
+            Reading(self.devices[2].id, now - timedelta(hours=5), 0.4),
+        ])
+        other = User.objects.create_user(username="u2", password="p2")
+        Device.objects.create(user=other, name="Other", slug="other")
+        self.url = reverse("device-fleet-status")
+
+    def test_status_of_every_device_in_one_query(self):
+        with self.assertNumQueries(2):      # user, devices joined with their stats
+            res = self.client.get(self.url, **auth_header(self.user))
+        self.assertEqual([(d["slug"], d["status"]) for d in res.data["devices"]],
+                         [("fridge", "online"), ("tv", "stale"), ("heater", "offline"), ("pump", "never")])
+        self.assertEqual(res.data["devices"][0]["last_kwh"], 0.2)
+        self.assertAlmostEqual(res.data["devices"][1]["age_seconds"], 1800, delta=60)
+        self.assertEqual(res.data["counts"], {"online": 1, "stale": 1, "offline": 1, "never": 1})
+
+        res = self.client.get(self.url, {"status": "stale,never"}, **auth_header(self.user))
+        self.assertEqual([d["slug"] for d in res.data["devices"]], ["tv", "pump"])
+        self.assertEqual(self.client.get(self.url, {"status": "asleep"}, **auth_header(self.user)).status_code, 400)
+
+
+class CacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        self.now = timezone.now()
+        self.past = (self.now - timedelta(days=62)).replace(day=10)
+        ingest_readings([
+            Reading(self.device.id, self.past, 1.0),
+            Reading(self.device.id, self.now - timedelta(minutes=5), 2.0),
+        ])
+
+    def summary(self, start, end):
+        url = reverse("device-summary", args=[self.device.id])
+        query = f"?start={start.isoformat()}&end={end.isoformat()}".replace("+", "%2B")
+        return self.client.get(url + query, **auth_header(self.user)).data["total_kwh"]
+
+    def test_ingest_invalidates_only_covering_windows(self):
+        past_window = (self.past - timedelta(days=1), self.past + timedelta(days=1))
+        open_window = (self.now - timedelta(hours=1), self.now + timedelta(hours=1))
+        self.assertEqual(self.summary(*past_window), 1.0)
+        self.assertEqual(self.summary(*open_window), 2.0)
+
+        with self.assertNumQueries(2):  # JWT user + get_object; the total is cached
+            self.assertEqual(self.summary(*past_window), 1.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_readings([Reading(self.device.id, self.now, 0.5)])
+        self.assertEqual(self.summary(*open_window), 2.5)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.summary(*past_window), 1.0)
+
+    def test_summary_rejects_invalid_bounds_and_reads_naive_ones_as_utc(self):
+        url = reverse("device-summary", args=[self.device.id])
+        for query in ({"start": "garbage"}, {"end": "2025-13-01T00:00:00"}):
+            res = self.client.get(url, query, **auth_header(self.user))
+            self.assertEqual(res.status_code, 400, query)
+        naive = (self.past - timedelta(days=1)).replace(tzinfo=None)
+        window = {"start": naive.isoformat(), "end": (naive + timedelta(days=2)).isoformat()}
+        self.assertEqual(self.client.get(url, window, **auth_header(self.user)).data["total_kwh"], 1.0)
+
+    def test_evicted_versions_never_serve_stale_results(self):
+        past_window = (self.past - timedelta(days=1), self.past + timedelta(days=1))
+        self.assertEqual(self.summary(*past_window), 1.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_readings([Reading(self.device.id, self.past + timedelta(hours=1), 0.5)])
+        self.assertEqual(self.summary(*past_window), 1.5)
+
+        # a culling cache drops the month's version key: the old result must not come back
+        cache.delete(f"telemetry:v:{self.device.id}:{self.past:%Y%m}")
+        self.assertEqual(self.summary(*past_window), 1.5)
+
+    def test_closed_windows_expire_unless_the_cache_is_shared(self):
+        past = self.now - timedelta(days=1)
+        self.assertEqual(caching._timeout(past), 300)
+        with TemporaryDirectory() as location, override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": location},
+        }):
+            self.assertIsNone(caching._timeout(past))
+            self.assertEqual(caching._timeout(self.now + timedelta(hours=1)), 300)
+
+
+class AsyncAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        self.now = timezone.now()
+        ingest_readings([Reading(self.device.id, self.now - timedelta(minutes=i), 0.5) for i in range(12)])
+        self.headers = {"Authorization": auth_header(self.user)["HTTP_AUTHORIZATION"]}
+
+    async def test_async_reads_match_sync_views(self):
+        url = reverse("async-device-summary", args=[self.device.id])
+        res = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["total_kwh"], 6.0)
+        self.assertEqual((await self.async_client.get(url)).status_code, 401)
+        self.assertEqual((await self.async_client.get(url, {"start": "garbage"}, headers=self.headers)).status_code, 400)
+
+        url = reverse("async-device-monthly-graph", args=[self.device.id])
+        res = await self.async_client.get(url, {"month": f"{self.now:%B}", "year": self.now.year}, headers=self.headers)
+        self.assertEqual(sum(d["total_kwh"] for d in res.json()["data"]), 6.0)
+
+        url = reverse("async-device-telemetry", args=[self.device.id])
+        res = await self.async_client.get(url, {"page_size": 5}, headers=self.headers)
+        page = res.json()
+        self.assertEqual(len(page["results"]), 5)
+        self.assertIsNotNone(page["next"])
+        res = await self.async_client.get(url, {"max_points": 3}, headers=self.headers)
+        self.assertLessEqual(len(res.json()["kwh"]), 3)
+        for bad in ("garbage", "2025-13-01T00:00:00"):
+            self.assertEqual((await self.async_client.get(url, {"start": bad}, headers=self.headers)).status_code, 400)
+
+        res = await self.async_client.get(reverse("async-fleet-status"), headers=self.headers)
+        self.assertEqual(res.json()["devices"][0]["status"], "online")
+
+        url = reverse("async-device-stats", args=[self.device.id])
+        res = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(res.json()["lifetime"]["readings"], 12)
+
+        url = reverse("async-fleet-summary")
+        res = await self.async_client.get(url, {"windows": "today,month"}, headers=self.headers)
+        sync = await sync_to_async(self.client.get)(reverse("device-fleet-summary"), {"windows": "today,month"},
+                                                   **auth_header(self.user))
+        self.assertEqual(res.json()["devices"][0]["windows"]["today"]["total_kwh"],
+                         sync.data["devices"][0]["windows"]["today"]["total_kwh"])
+
+        url = reverse("async-device-series", args=[self.device.id])
+        res = await self.async_client.get(url, {"start": (self.now - timedelta(days=1)).isoformat(), "granularity": "hour"},
+                                          headers=self.headers)
+        self.assertEqual(sum(d["total_kwh"] for d in res.json()["data"]), 6.0)
+
+        res = await self.async_client.post(reverse("async-chat-query"), {"question": "how much did my fridge use today"},
+                                           content_type="application/json", headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["device"]["slug"], "fridge")
+
+    async def test_async_ingest(self):
+        url = reverse("async-device-telemetry", args=[self.device.id])
+        rows = [{"timestamp": (self.now + timedelta(minutes=i + 1)).isoformat(), "energy_kwh": 0.25} for i in range(4)]
+        res = await self.async_client.post(url, rows, content_type="application/json", headers=self.headers)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()["created"], 4)
+
+        res = await self.async_client.post(url, {"timestamp": "nope", "energy_kwh": 1}, content_type="application/json",
+                                           headers=self.headers)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(await Telemetry.objects.filter(device=self.device).acount(), 16)
+        self.assertEqual(
+            (await self.async_client.get(reverse("async-device-summary", args=[999999]), headers=self.headers)).status_code,
+            404,
+        )
+
+    async def test_live_stream_pushes_readings_and_totals(self):
+        url = reverse("async-live")
+        self.assertEqual((await self.async_client.get(url)).status_code, 401)
+        # access tokens are not accepted in the URL, only stream tokens
+        access = self.headers["Authorization"].split()[1]
+        self.assertEqual((await self.async_client.get(url, {"token": access})).status_code, 401)
+        res = await self.async_client.post(reverse("async-live-token"), headers=self.headers)
+        self.assertEqual(res.json()["expires_in"], 60)
+        token = res.json()["token"]
+        self.assertEqual((await self.async_client.get(reverse("async-device-summary", args=[self.device.id]),
+                                                      headers={"Authorization": f"Bearer {token}"})).status_code, 401)
+        self.assertEqual((await self.async_client.get(url, {"token": token, "start": "2025-13-01T00:00:00"})).status_code,
+                         400)
+        res = await self.async_client.get(url, {"token": token, "start": (self.now - timedelta(hours=1)).isoformat()})
+        self.assertEqual(res["Content-Type"], "text/event-stream")
+        events = res.streaming_content
+        self.assertTrue((await anext(events)).startswith(b"retry:"))
+        snapshot = await anext(events)
+        self.assertIn(b"event: snapshot", snapshot)
+        self.assertEqual(json.loads(snapshot.split(b"data: ")[1])["devices"][0]["total_kwh"], 6.0)
+
+        def ingest():
+            with self.captureOnCommitCallbacks(execute=True):
+                ingest_readings([Reading(self.device.id, self.now + timedelta(minutes=1), 0.25)])
+        await sync_to_async(ingest)()
+        pushed = json.loads((await anext(events)).split(b"data: ")[1])
+        self.assertEqual(pushed["device"], self.device.id)
+        self.assertEqual(len(pushed["readings"]), 1)
+        self.assertEqual(pushed["total_kwh"], 6.25)
+        # a client disconnect cancels the pending read, which unsubscribes
+        self.assertTrue(live.broker().has_subscribers(live.channel(self.device.id)))
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertFalse(live.broker().has_subscribers(live.channel(self.device.id)))
+
+    async def test_live_snapshot_does_not_count_concurrent_commits_twice(self):
+        def ingest(minutes):
+            with self.captureOnCommitCallbacks(execute=True):
+                ingest_readings([Reading(self.device.id, self.now + timedelta(minutes=minutes), 0.25)])
+
+        read_totals = async_views._live_totals
+        calls = []
+
+        async def racing_totals(device_ids, start):
+            calls.append(start)
+            if len(calls) == 1:
+                # committed (and published) after subscribing, visible to the first read
+                await sync_to_async(ingest)(1)
+            return await read_totals(device_ids, start)
+
+        token = (await self.async_client.post(reverse("async-live-token"), headers=self.headers)).json()["token"]
+        with mock.patch.object(async_views, "_live_totals", racing_totals):
+            res = await self.async_client.get(reverse("async-live"),
+                                              {"token": token, "start": (self.now - timedelta(hours=1)).isoformat()})
+            events = res.streaming_content
+            await anext(events)
+            snapshot = json.loads((await anext(events)).split(b"data: ")[1])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(snapshot["devices"][0]["total_kwh"], 6.25)
+
+        await sync_to_async(ingest)(2)
+        pushed = json.loads((await anext(events)).split(b"data: ")[1])
+        second = (self.now + timedelta(minutes=2)).isoformat().replace("+00:00", "Z")
+        self.assertEqual(pushed["readings"][0]["timestamp"], second)
+        self.assertEqual(pushed["total_kwh"], 6.5)
+        await events.aclose()
+
+
+class IngestBufferTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        self.now = timezone.now().replace(microsecond=0)
+
+    def readings(self, n, kwh=0.5, offset=0):
+        return [Reading(self.device.id, self.now - timedelta(minutes=i + offset), kwh) for i in range(n)]
+
+    def test_coalesces_and_flushes(self):
+        # batch_size above the queue depth keeps the flush thread idle; the test flushes itself
+        buf = IngestBuffer(max_rows=10, batch_size=5, interval=3600)
+        self.addCleanup(buf.close)
+        buf.submit(self.readings(4))
+        buf.submit(self.readings(1, kwh=0.75))       # same timestamp as the first: last one wins
+        self.assertEqual(buf.depth(), 4)
+        with self.assertRaises(BufferFull):
+            buf.submit(self.readings(7, offset=10))
+        self.assertFalse(Telemetry.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(buf.flush(), 4)
+        self.assertEqual(Telemetry.objects.count(), 4)
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id]), 2.25)
+        metrics = buf.metrics()
+        self.assertEqual((metrics["depth"], metrics["flushes"], metrics["coalesced"], metrics["rejected"]), (0, 1, 1, 7))
+
+    def test_spools_on_failed_shutdown_and_replays(self):
+        def broken(batch):
+            raise OperationalError("database is down")
+
+        with TemporaryDirectory() as spool:
+            buf = IngestBuffer(max_rows=10, batch_size=10, interval=3600, spool_dir=spool, writer=broken)
+            buf.submit(self.readings(3))
+            with self.assertLogs("telemetry_service.buffer", "WARNING"):
+                buf.close()
+            self.assertEqual(buf.metrics()["spooled"], 3)
+
+            IngestBuffer(max_rows=10, batch_size=2, interval=3600, spool_dir=spool)._replay_spool()
+            self.assertEqual(Telemetry.objects.count(), 3)
+            self.assertEqual(os.listdir(spool), [])
+
+    def test_unwritable_readings_do_not_block_the_queue(self):
+        other = Device.objects.create(user=self.user, name="Oven", slug="oven")
+        poison = Reading(other.id, self.now - timedelta(hours=1), 9.0)
+
+        def writer(batch):
+            if poison in batch:
+                raise IntegrityError("CHECK constraint failed")
+            ingest_readings(batch)
+
+        with TemporaryDirectory() as spool:
+            buf = IngestBuffer(max_rows=20, batch_size=20, interval=3600, spool_dir=spool, writer=writer)
+            self.addCleanup(buf.close)
+            doomed = Device.objects.create(user=self.user, name="Old meter", slug="old-meter")
+            buf.submit([Reading(doomed.id, self.now, 1.0), Reading(doomed.id, self.now - timedelta(minutes=1), 1.0)])
+            buf.submit(self.readings(3) + [poison, Reading(other.id, self.now, 0.25)])
+            doomed.delete()
+
+            with self.captureOnCommitCallbacks(execute=True), self.assertLogs("telemetry_service.buffer", "ERROR"):
+                self.assertEqual(buf.flush(), 7)
+            self.assertEqual(buf.depth(), 0)
+            self.assertEqual(Telemetry.objects.count(), 4)
+            self.assertAlmostEqual(rollups.total_kwh([self.device.id, other.id]), 1.75)
+            metrics = buf.metrics()
+            self.assertEqual((metrics["dropped"], metrics["spooled"]), (3, 0))
+            self.assertGreater(metrics["failures"], 0)
+            rejected = sorted(os.listdir(spool))
+            self.assertEqual(len(rejected), 2)
+            self.assertTrue(all(name.startswith("rejected-") for name in rejected))
+
+            # rejected files are kept for inspection, not replayed
+            IngestBuffer(max_rows=10, batch_size=10, interval=3600, spool_dir=spool)._replay_spool()
+            self.assertEqual(len(os.listdir(spool)), 2)
+
+    @override_settings(TELEMETRY_BUFFER={"ENABLED": True, "MAX_ROWS": 3, "BATCH_SIZE": 100,
+                                         "INTERVAL": 3600, "SPOOL_DIR": None})
+    def test_endpoints_queue_and_push_back(self):
+        url = reverse("device-telemetry", args=[self.device.id])
+        rows = [{"timestamp": (self.now - timedelta(minutes=i)).isoformat(), "energy_kwh": 0.1} for i in range(2)]
+        res = self.client.post(url, rows, format="json", **auth_header(self.user))
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(res.data["accepted"], 2)
+        self.assertFalse(Telemetry.objects.exists())
+
+        rows = [{"timestamp": (self.now + timedelta(minutes=i + 1)).isoformat(), "energy_kwh": 0.1} for i in range(2)]
+        res = self.client.post(url, rows, format="json", **auth_header(self.user))
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res["Retry-After"], "3600")
+
+        buf = get_buffer()
+        self.addCleanup(buf.close)
+        buf.flush()
+        self.assertEqual(Telemetry.objects.count(), 2)
+
+        metrics_url = reverse("ingest-buffer")
+        self.assertEqual(self.client.get(metrics_url, **auth_header(self.user)).status_code, 403)
+        admin = User.objects.create_user(username="ops", password="p", is_staff=True)
+        res = self.client.get(metrics_url, **auth_header(admin))
+        self.assertEqual((res.data["flushed"], res.data["rejected"]), (2, 2))
+
+
+@skipUnless(connection.vendor == "postgresql", "import_telemetry uses COPY")
+class ImportTelemetryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="u1", password="p1")
+        self.device = Device.objects.create(user=self.user, name="Fridge", slug="fridge")
+        self.tv = Device.objects.create(user=self.user, name="TV", slug="tv")
+        self.base = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=2)
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, lines, compress=False):
+        path = os.path.join(self.tmp.name, name)
+        data = "".join(line + "\n" for line in lines)
+        if compress:
+            with gzip.open(path, "wt") as fh:
+                fh.write(data)
+        else:
+            with open(path, "w") as fh:
+                fh.write(data)
+        return path
+
+    def run_import(self, *args):
+        out = StringIO()
+        call_command("import_telemetry", *args, "--json", stdout=out)
+        return json.loads(out.getvalue())["total"]
+
+    def test_imports_csv_and_ndjson_with_dedup(self):
+        ts = [(self.base + timedelta(minutes=i)).isoformat() for i in range(100)]
+        csv_path = self.write("meters.csv.gz", ["device,timestamp,energy_kwh"]
+                              + [f"fridge,{t},0.5" for t in ts]
+                              + [f"tv,{ts[0]},0.25", f"fridge,{ts[0]},0.75", "fridge,yesterday,1"], compress=True)
+        ndjson_path = self.write("tv.ndjson", [json.dumps({"timestamp": t, "energy_kwh": 0.1}) for t in ts[:10]])
+
+        total = self.run_import(csv_path, "--user", "u1", "--chunk-rows", "40")
+        self.assertEqual((total["read"], total["inserted"], total["rejected"]), (103, 101, 1))
+        # the first reading wins unless --on-conflict update
+        self.assertEqual(Telemetry.objects.filter(device=self.device, timestamp=ts[0]).get().energy_kwh, 0.5)
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id]), 50.0)
+
+        total = self.run_import(ndjson_path, "--device", str(self.tv.id))
+        self.assertEqual((total["inserted"], total["skipped"]), (9, 1))
+
+        # re-importing changes nothing unless asked to overwrite
+        self.assertEqual(self.run_import(csv_path, "--user", "u1")["inserted"], 0)
+        update = self.write("fix.csv", ["device,timestamp,kwh", f"{self.device.id},{ts[1]},2.0"])
+        self.assertEqual(self.run_import(update, "--on-conflict", "update")["updated"], 1)
+        self.assertAlmostEqual(rollups.total_kwh([self.device.id]), 99 * 0.5 + 2.0)
+        self.assertEqual(Telemetry.objects.count(), 110)
+
+        # a compacted row holds its bucket's energy: an update adds to it
+        Telemetry.objects.filter(device=self.device, timestamp=ts[2]).update(compacted=True)
+        update = self.write("late.csv", ["device,timestamp,kwh", f"{self.device.id},{ts[2]},0.25"])
+        self.assertEqual(self.run_import(update, "--on-conflict", "update")["updated"], 1)
+        self.assertEqual(Telemetry.objects.get(device=self.device, timestamp=ts[2]).energy_kwh, 0.75)
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DeviceViewSet
+from .views import DeviceViewSet, IngestBufferView
 
 router = DefaultRouter()
 router.register("devices", DeviceViewSet, basename="device")
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("ingest/buffer/", IngestBufferView.as_view(), name="ingest-buffer"),
 ]
@@ -1,59 +1,473 @@
 from rest_framework import viewsets, mixins, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.utils.dateparse import parse_datetime
-from django.db.models import Sum
-from .models import Device, Telemetry
-from .serializers import DeviceSerializer, TelemetrySerializer
+from rest_framework.views import APIView
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from .models import Device, DeviceDailyStats, DeviceStats, Telemetry, TelemetryDaily
+from .serializers import DeviceSerializer, TelemetrySerializer, TELEMETRY_VALUES, telemetry_rows, telemetry_columns
+from .renderers import FastJSONRenderer
 from .permissions import IsOwner
+from .pagination import TelemetryKeysetPagination
+from .exports import EXPORT_FORMATS
+from .ingest import Reading, validate_batch, ingest_readings
+from .buffer import FULL_MESSAGE, BufferFull, get_buffer, retry_after
+from . import archive, caching, downsample, rollups, series, stats
+from django.conf import settings
 import calendar
-from datetime import date
-from django.db.models.functions import TruncDay
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+def month_window(params):
+    """
+    Parse ?month=January&year=2025 into (month name, year, start, end) in UTC.
+    Raises ValueError with a user-facing message.
+    """
+    raw = params.get("month")
+    try:
+        year = int(params.get("year", date.today().year))
+    except ValueError:
+        raise ValueError(f"Invalid year '{params.get('year')}'.")
+    if not raw:
+        raise ValueError("Please provide a month (e.g., January, February).")
+    month_name = raw.capitalize()
+    if month_name not in calendar.month_name[1:]:
+        raise ValueError(f"Invalid month '{raw}'.")
+    month = list(calendar.month_name).index(month_name)
+    start = datetime(year, month, 1, tzinfo=dt_timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+    return month_name, year, start, end
+
+
+def series_window(params, user):
+    """
+    Parse ?start=&end=&granularity=&tz= into (start, end, granularity, zone).
+    Naive datetimes and plain dates are read in the zone, which defaults to
+    the user's time_zone; ``end`` defaults to now. Raises ValueError with a
+    user-facing message.
+    """
+    zone = series.get_zone(params.get("tz") or user.time_zone)
+    granularity = params.get("granularity", "day")
+    if granularity not in series.GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}'. Use one of: {', '.join(series.GRANULARITIES)}.")
+    bounds = []
+    for name in ("start", "end"):
+        raw = params.get(name)
+        if not raw:
+            bounds.append(None)
+            continue
+        value = parse_datetime(raw)
+        if value is None:
+            day = parse_date(raw)
+            value = datetime.combine(day, time()) if day else None
+        if value is None:
+            raise ValueError(f"Invalid {name} '{raw}'.")
+        bounds.append(value.replace(tzinfo=zone) if value.tzinfo is None else value)
+    start, end = bounds
+    if start is None:
+        raise ValueError("Please provide a start (ISO date or datetime).")
+    end = end or timezone.now()
+    if start >= end:
+        raise ValueError("start must be before end.")
+    return start, end, granularity, zone
+
+
+def stats_day(params):
+    """The UTC day of ?date=YYYY-MM-DD (default today); raises ValueError."""
+    raw = params.get("date")
+    if not raw:
+        return timezone.now().astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    day = parse_date(raw)
+    if day is None:
+        raise ValueError(f"Invalid date '{raw}'.")
+    return datetime.combine(day, time(), tzinfo=dt_timezone.utc)
+
+
+def stats_payload(device, day, lifetime, daily):
+    return {
+        "device_id": device.id,
+        "device_name": device.name,
+        "lifetime": stats.describe(lifetime),
+        "day": {"date": day.date(), **stats.describe(daily)} if daily else None,
+        "usual": stats.usual(daily, lifetime),
+    }
+
+
+STATUSES = ("online", "stale", "offline", "never")
+
+
+def status_filter(params):
+    """The statuses of ?status=stale,offline (all by default); raises ValueError."""
+    raw = params.get("status")
+    if not raw:
+        return set(STATUSES)
+    wanted = {part.strip() for part in raw.split(",") if part.strip()}
+    unknown = sorted(wanted - set(STATUSES))
+    if unknown:
+        raise ValueError(f"Unknown status '{unknown[0]}'. Use any of: {', '.join(STATUSES)}.")
+    return wanted
+
+
+def status_rows(user):
+    """(id, name, slug, last_at, last_kwh) per device of the user, from the lifetime stats rows."""
+    return (Device.objects.filter(user=user).order_by("id")
+            .values_list("id", "name", "slug", "stats__last_at", "stats__last_kwh"))
+
+
+def status_payload(rows, wanted, now=None):
+    """Classify each device by the age of its last reading."""
+    now = now or timezone.now()
+    limits = settings.TELEMETRY_STATUS
+    counts = dict.fromkeys(STATUSES, 0)
+    devices = []
+    for device_id, name, slug, last_at, last_kwh in rows:
+        age = (now - last_at).total_seconds() if last_at is not None else None
+        if age is None:
+            status = "never"
+        elif age > limits["OFFLINE_AFTER"]:
+            status = "offline"
+        else:
+            status = "stale" if age > limits["STALE_AFTER"] else "online"
+        counts[status] += 1
+        if status in wanted:
+            devices.append({
+                "id": device_id, "name": name, "slug": slug, "status": status,
+                "last_seen": last_at, "age_seconds": round(age, 1) if age is not None else None,
+                "last_kwh": last_kwh,
+            })
+    return {
+        "as_of": now,
+        "stale_after": limits["STALE_AFTER"],
+        "offline_after": limits["OFFLINE_AFTER"],
+        "counts": counts,
+        "devices": devices,
+    }
+
+
+def window_bounds(params):
+    """
+    (start, end) in UTC from ?start=&end= (ISO), None where absent.
+    Raises ValueError with a user-facing message for unparseable values.
+    """
+    bounds = []
+    for name in ("start", "end"):
+        raw = params.get(name)
+        try:
+            value = parse_datetime(raw) if raw else None
+        except ValueError:
+            value = None
+        if raw and value is None:
+            raise ValueError("start and end must be ISO datetimes.")
+        bounds.append(rollups.as_utc(value))
+    return tuple(bounds)
+
+
+def _named_windows(now):
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    # open-ended "to date" windows keep a stable cache key through the day
+    return {
+        "today": (today, None),
+        "yesterday": (today - timedelta(days=1), today),
+        "week": (today - timedelta(days=today.weekday()), None),
+        "month": (today.replace(day=1), None),
+    }
+
+
+def fleet_window(params):
+    """
+    Parse ?devices=1,2&windows=today,week,month&start=&end=&unit=hour|day into
+    (device ids or None for all, [(name, start, end)], unit). Named windows
+    are UTC calendar periods to date; ?start=&end= adds a "custom" one.
+    Raises ValueError with a user-facing message.
+    """
+    ids = None
+    if params.get("devices"):
+        try:
+            ids = sorted({int(part) for part in params["devices"].split(",") if part.strip()})
+        except ValueError:
+            raise ValueError(f"Invalid devices '{params['devices']}'; expected ids like 1,2,3.")
+    unit = params.get("unit", "hour")
+    if unit not in rollups.UNITS:
+        raise ValueError(f"Unknown unit '{unit}'. Use hour or day.")
+    named = _named_windows(timezone.now().astimezone(dt_timezone.utc))
+    default = "" if params.get("start") or params.get("end") else "today,week,month"
+    windows = []
+    for name in dict.fromkeys(part.strip() for part in params.get("windows", default).split(",") if part.strip()):
+        if name not in named:
+            raise ValueError(f"Unknown window '{name}'. Use any of: {', '.join(named)}.")
+        windows.append((name, *named[name]))
+    if params.get("start") or params.get("end"):
+        start, end = window_bounds(params)
+        if start is not None and end is not None and start >= end:
+            raise ValueError("start must be before end.")
+        windows.append(("custom", start, end))
+    return ids, windows, unit
+
+
+def fleet_payload(devices, windows, unit, rows, max_points=None, method="lttb"):
+    """Shape {(window, device, bucket): kwh} into per-window and per-device totals, peaks and series."""
+    buckets = defaultdict(dict)     # (window, device or None for all) -> {bucket: kwh}
+    for (w, device_id, bucket), kwh in rows.items():
+        buckets[(w, device_id)][bucket] = kwh
+        fleet = buckets[(w, None)]
+        fleet[bucket] = fleet.get(bucket, 0.0) + kwh
+
+    def summarize(found, series=True):
+        peak = max(found.items(), key=lambda item: item[1], default=None)
+        out = {
+            "total_kwh": round(sum(found.values()), 4),
+            "peak": {"bucket": peak[0], "total_kwh": round(peak[1], 4)} if peak else None,
+        }
+        if series:
+            out["series"] = [{"bucket": bucket, "total_kwh": round(kwh, 4)}
+                             for bucket, kwh in downsample.points(sorted(found.items()), max_points, method)]
+        return out
+
+    return {
+        "unit": unit,
+        "windows": [
+            {"name": name, "start": start, "end": end, **summarize(buckets[(w, None)], series=False)}
+            for w, (name, start, end) in enumerate(windows)
+        ],
+        "devices": [
+            {"id": device.id, "name": device.name, "slug": device.slug,
+             "windows": {name: summarize(buckets[(w, device.id)]) for w, (name, _, _) in enumerate(windows)}}
+            for device in devices
+        ],
+    }
+
+
+def fleet_cache_args(windows, unit):
+    """(start, end, extra) covering every window, for caching.cached."""
+    bounds = [(start, end) for _, start, end in windows]
+    starts, ends = [s for s, _ in bounds], [e for _, e in bounds]
+    return (None if None in starts else min(starts), None if None in ends else max(ends),
+            repr((unit, bounds)))
+
 
 class DeviceViewSet(viewsets.ModelViewSet):
     serializer_class = DeviceSerializer
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def include_total(self):
+        # ?include_total=false skips the energy total entirely
+        return self.request.query_params.get("include_total", "true").lower() not in ("0", "false", "no")
 
     def get_queryset(self):
-        return Device.objects.filter(user=self.request.user)
+        qs = Device.objects.filter(user=self.request.user)
+        if self.action in ("list", "retrieve") and self.include_total():
+            # one correlated subquery over the daily rollups instead of a
+            # full-history aggregate per device
+            daily = (TelemetryDaily.objects.filter(device=OuterRef("pk"))
+                     .order_by().values("device")
+                     .annotate(total=Sum("total_kwh")).values("total"))
+            qs = qs.annotate(total_kwh=Coalesce(Subquery(daily, output_field=FloatField()), 0.0))
+        return qs
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["include_total"] = self.include_total()
+        return context
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def _ingest_batch(self, request, rows, default_device=None):
+        """Validate and store a list of readings; invalid rows are reported by index."""
+        if not isinstance(rows, list) or not rows:
+            return Response({"error": "Expected a non-empty list of readings."}, status=400)
+        if len(rows) > settings.TELEMETRY_BULK_MAX_ROWS:
+            return Response({"error": f"At most {settings.TELEMETRY_BULK_MAX_ROWS} readings per request."}, status=400)
+
+        if default_device is not None:
+            device_ids = {default_device}
+        else:
+            device_ids = set(Device.objects.filter(user=request.user).values_list("id", flat=True))
+        readings, errors = validate_batch(rows, device_ids, default_device)
+
+        # ?atomic=true rejects the whole batch if any row is invalid
+        atomic = request.query_params.get("atomic", "").lower() in ("1", "true", "yes")
+        buffer = get_buffer()
+        if buffer is not None and readings and not (errors and atomic):
+            try:
+                accepted = buffer.submit(readings)
+            except BufferFull:
+                return Response(FULL_MESSAGE, status=503, headers={"Retry-After": retry_after()})
+            return Response({"accepted": accepted, "rejected": len(errors), "errors": errors}, status=202)
+        created = 0 if (errors and atomic) else ingest_readings(readings)
+        return Response(
+            {"created": created, "rejected": len(errors), "errors": errors},
+            status=201 if created else 400,
+        )
+
+    @action(detail=False, methods=["post"], url_path="telemetry", url_name="bulk-telemetry")
+    def bulk_telemetry(self, request):
+        """
+        Batch ingest for any of the user's devices.
+        Accepts a list of {device, timestamp, energy_kwh} or {"readings": [...]}.
+        """
+        rows = request.data.get("readings") if isinstance(request.data, dict) else request.data
+        return self._ingest_batch(request, rows)
+
     @action(detail=True, methods=["get", "post"])
     def telemetry(self, request, pk=None):
         device = self.get_object()
         if request.method == "POST":
+            if isinstance(request.data, list):
+                # batch mode: a list of {timestamp, energy_kwh} for this device
+                return self._ingest_batch(request, request.data, default_device=device.id)
             data = request.data.copy()
             data["device"] = device.id
             ser = TelemetrySerializer(data=data)
             ser.is_valid(raise_exception=True)
-            ser.save()
-            return Response(ser.data, status=201)
+            reading = Reading(device.id, ser.validated_data["timestamp"], ser.validated_data["energy_kwh"])
+            buffer = get_buffer()
+            if buffer is not None:
+                try:
+                    buffer.submit([reading])
+                except BufferFull:
+                    return Response(FULL_MESSAGE, status=503, headers={"Retry-After": retry_after()})
+                return Response({"device": device.id, "timestamp": reading.timestamp, "energy_kwh": reading.energy_kwh},
+                                status=202)
+            # an upsert, so a retried POST returns the same reading instead of a duplicate
+            ingest_readings([reading])
+            obj = device.telemetry.get(timestamp=reading.timestamp)
+            obj.device = device
+            return Response(TelemetrySerializer(obj).data, status=201)
+
+        # GET — optional filters ?start=ISO&end=ISO, ?layout=rows|columns,
+        # ?max_points=N&downsample=lttb|minmax for charts
+        try:
+            start, end = window_bounds(request.query_params)
+            max_points, method = downsample.parse(request.query_params)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+        if max_points:
+            return Response(downsample.device_readings(device, start, end, max_points, method))
+        qs = self._telemetry_window(device, start, end).values_list(*TELEMETRY_VALUES)
+        encode = telemetry_columns if request.query_params.get("layout") == "columns" else telemetry_rows
+        paginator = TelemetryKeysetPagination()
+        if any(p in request.query_params for p in (paginator.cursor_query_param, paginator.page_size_query_param)):
+            cursor, limit = paginator.get_cursor(request), paginator.get_page_size(request) + 1
+            rows = archive.merge_newest(device.id, list(paginator.page_queryset(qs, request)), start, end, cursor, limit)
+            # archived readings have no id and sort as id 0
+            rows, next_url = paginator.finish_page(rows, request, key=lambda row: (row[1], row[0] or 0))
+            return Response({"next": next_url, "results": encode(rows, device)})
+        # legacy shape: newest 1000 rows as a plain list
+        return Response(encode(archive.merge_newest(device.id, list(qs[:1000]), start, end, limit=1000), device))
 
-        # GET — optional filters ?start=ISO&end=ISO
+    def _telemetry_window(self, device, start, end):
         qs = device.telemetry.all()
-        start = request.query_params.get("start")
-        end = request.query_params.get("end")
         if start:
-            qs = qs.filter(timestamp__gte=parse_datetime(start))
+            qs = qs.filter(timestamp__gte=start)
         if end:
-            qs = qs.filter(timestamp__lte=parse_datetime(end))
-        return Response(TelemetrySerializer(qs[:1000], many=True).data)
+            qs = qs.filter(timestamp__lte=end)
+        return qs
+
+    @action(detail=True, methods=["get"], url_path="telemetry/export", url_name="telemetry-export")
+    def export_telemetry(self, request, pk=None):
+        """
+        Streams every reading in the window, oldest first, in constant memory.
+        Accepts ?fmt=csv|ndjson (default csv) plus the usual ?start=&end=.
+        """
+        device = self.get_object()
+        fmt = request.query_params.get("fmt", "csv")
+        if fmt not in EXPORT_FORMATS:
+            return Response({"error": f"Unsupported fmt '{fmt}'. Use csv or ndjson."}, status=400)
+        try:
+            start, end = window_bounds(request.query_params)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+
+        rows = (self._telemetry_window(device, start, end)
+                .order_by("timestamp", "id")
+                .values_list("timestamp", "energy_kwh")
+                .iterator(chunk_size=settings.TELEMETRY_EXPORT_CHUNK_SIZE))
+        rows = archive.merge_oldest(device.id, rows, start, end)
+        content_type, extension, encode = EXPORT_FORMATS[fmt]
+        response = StreamingHttpResponse(encode(rows), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{device.slug}-telemetry.{extension}"'
+        return response
+
+    @action(detail=False, methods=["get"], url_path="status", url_name="fleet-status")
+    def fleet_status(self, request):
+        """
+        Last reading, its age and online/stale/offline/never status for every
+        device of the user, optionally only ?status=stale,offline. One indexed
+        join against the lifetime stats rows, which ingest keeps current.
+        """
+        try:
+            wanted = status_filter(request.query_params)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(status_payload(status_rows(request.user), wanted))
+
+    @action(detail=False, methods=["get"], url_path="summary", url_name="fleet-summary")
+    def fleet_summary(self, request):
+        """
+        Totals, peaks and per-bucket series for all the user's devices (or
+        ?devices=1,2) over several windows in one read:
+        ?windows=today,yesterday,week,month (default today,week,month) and/or
+        ?start=&end= (ISO), ?unit=hour|day, plus ?max_points=N&downsample=lttb|minmax per series.
+        """
+        try:
+            ids, windows, unit = fleet_window(request.query_params)
+            max_points, method = downsample.parse(request.query_params)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+        if not windows:
+            return Response({"error": "Please provide at least one window."}, status=400)
+        devices = self.get_queryset().order_by("id")
+        if ids is not None:
+            devices = devices.filter(id__in=ids)
+        devices = list(devices)
+        missing = sorted(set(ids or ()) - {device.id for device in devices})
+        if missing:
+            return Response({"error": f"Device(s) not found: {', '.join(map(str, missing))}."}, status=404)
+
+        device_ids = [device.id for device in devices]
+        bounds = [(start, end) for _, start, end in windows]
+        start, end, extra = fleet_cache_args(windows, unit)
+        # one statement: each source is scanned once for every window (rollups.windowed)
+        rows = caching.cached(
+            "fleet_summary", request.user.id, device_ids, start, end,
+            lambda: rollups.windowed(device_ids, bounds, unit) if device_ids else {},
+            extra=extra,
+        )
+        return Response(fleet_payload(devices, windows, unit, rows, max_points, method))
 
     @action(detail=True, methods=["get"])
     def summary(self, request, pk=None):
         device = self.get_object()
-        start = request.query_params.get("start")
-        end = request.query_params.get("end")
-        qs = device.telemetry.all()
-        if start:
-            qs = qs.filter(timestamp__gte=parse_datetime(start))
-        if end:
-            qs = qs.filter(timestamp__lte=parse_datetime(end))
-        total = qs.aggregate(total=Sum("energy_kwh"))["total"] or 0.0
+        try:
+            start, end = window_bounds(request.query_params)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+        total = caching.cached(
+            "summary", request.user.id, [device.id], start, end,
+            lambda: rollups.total_kwh([device.id], start, end),
+        )
         return Response({"device_id": device.id,"device_name":device.name ,"total_kwh": round(total, 4)})
-    
+
+    @action(detail=True, methods=["get"])
+    def stats(self, request, pk=None):
+        """
+        Running reading statistics: lifetime, one UTC day (?date=YYYY-MM-DD,
+        default today) and how that day compares with usual. Two row lookups.
+        """
+        device = self.get_object()
+        try:
+            day = stats_day(request.query_params)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+        lifetime = DeviceStats.objects.filter(device=device).first()
+        daily = DeviceDailyStats.objects.filter(device=device, bucket=day).first()
+        return Response(stats_payload(device, day, lifetime, daily))
 
     @action(detail=True, methods=["get"])
     def monthly_graph(self, request, pk=None):
@@ -62,37 +476,64 @@ class DeviceViewSet(viewsets.ModelViewSet):
         Accepts query param: ?month=January&year=2025 (year optional, defaults to current year)
         """
         device = self.get_object()
-        month_name = request.query_params.get("month")
-        year = int(request.query_params.get("year", date.today().year))
-
-        if not month_name:
-            return Response({"error": "Please provide a month (e.g., January, February)."}, status=400)
-
         try:
-            month = list(calendar.month_name).index(month_name.capitalize())
-            if month == 0:
-                raise ValueError
-        except ValueError:
-            return Response({"error": f"Invalid month '{month_name}'."}, status=400)
+            month_name, year, month_start, month_end = month_window(request.query_params)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
 
-        # Filter telemetry by year + month
-        qs = device.telemetry.filter(timestamp__year=year, timestamp__month=month)
-
-        # Group by day
-        daily_data = (
-            qs.annotate(day=TruncDay("timestamp"))
-              .values("day")
-              .annotate(total=Sum("energy_kwh"))
-              .order_by("day")
+        # Whole days come straight from the daily rollups
+        daily_data = caching.cached(
+            "monthly_graph", request.user.id, [device.id], month_start, month_end,
+            lambda: rollups.series([device.id], month_start, month_end, unit="day", include_end=False),
+            extra="day",
         )
 
         return Response({
             "device_id": device.id,
             "device_name": device.name,
-            "month": month_name.capitalize(),
+            "month": month_name,
             "year": year,
             "data": [
-                {"date": entry["day"], "total_kwh": round(entry["total"], 4)}
-                for entry in daily_data
+                {"date": day, "total_kwh": round(total, 4)}
+                for day, total in daily_data
             ]
-        })
\ No newline at end of file
+        })
+
+    @action(detail=True, methods=["get"])
+    def series(self, request, pk=None):
+        """
+        Energy per bucket over [start, end) in the user's time zone, empty buckets included.
+        Accepts ?start=&end= (ISO), ?granularity=15m|hour|day|week|month and ?tz=Area/City,
+        plus ?max_points=N&downsample=lttb|minmax.
+        """
+        device = self.get_object()
+        try:
+            start, end, granularity, zone = series_window(request.query_params, request.user)
+            max_points, method = downsample.parse(request.query_params)
+            data = caching.cached(
+                "series", request.user.id, [device.id], start, end,
+                lambda: series.device_series([device.id], start, end, granularity, zone),
+                extra=(granularity, zone.key),
+            )
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(series_payload(device, granularity, zone, downsample.points(data, max_points, method)))
+
+
+def series_payload(device, granularity, zone, data):
+    return {
+        "device_id": device.id,
+        "device_name": device.name,
+        "granularity": granularity,
+        "time_zone": zone.key,
+        "data": [{"start": start, "total_kwh": round(total, 4)} for start, total in data],
+    }
+
+
+class IngestBufferView(APIView):
+    """Write-behind ingest buffer metrics for the worker serving the request."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        buffer = get_buffer()
+        return Response({"enabled": False} if buffer is None else {"enabled": True, **buffer.metrics()})